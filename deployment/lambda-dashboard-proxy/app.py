@@ -1,22 +1,174 @@
+import re
 import json
 import boto3
 import requests
+from requests.adapters import HTTPAdapter
 from requests_aws4auth import AWS4Auth
 import os
-import gzip
 import base64
-from io import BytesIO
+from threading import Lock
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
 
 from http.cookies import SimpleCookie
 
 region = os.environ['AWS_REGION']
 dashboard_endpoint = os.environ['DASHBOARD_ENDPOINT']  # e.g., "https://your-opensearch-domain/_dashboards"
 
+# Versioned Dashboards bundles (/_dashboards/<build number>/bundles/...) never change for a given path
+static_path_pattern = re.compile(os.environ.get('STATIC_PATH_PATTERN', r'/\d+/bundles/'))
+static_cache_max_bytes = int(os.environ.get('STATIC_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+static_cache_control = os.environ.get('STATIC_CACHE_CONTROL', 'public, max-age=31536000, immutable')
+
+# Content codings requested from the upstream, in order of preference, when the client accepts them
+SUPPORTED_ENCODINGS = ('br', 'gzip')
+
+# Content types returned as text; anything else (or any compressed body) is base64 encoded
+TEXT_CONTENT_TYPES = ('text/', 'application/json', 'application/javascript', 'application/x-javascript',
+                      'application/xml', 'image/svg+xml')
+
+CORS_HEADERS = {
+    "access-control-allow-origin": "*",
+    "access-control-allow-credentials": "true",
+    "access-control-allow-methods": "GET, POST, PUT, DELETE, OPTIONS",
+    "access-control-allow-headers": "Content-Type, Authorization, X-Requested-With"
+}
+
+# Upstream response headers passed back to the client
+FORWARDED_RESPONSE_HEADERS = ("Content-Type", "Content-Encoding", "ETag", "Last-Modified", "Cache-Control", "Vary")
+
 # Get AWS credentials
 session = boto3.Session()
 credentials = session.get_credentials()
 aws_auth = AWS4Auth(credentials.access_key, credentials.secret_key, region, 'es', session_token=credentials.token)
 
+# One pooled HTTP session per container: TCP/TLS connections to the domain are reused across invocations
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# (path, content coding) -> cached upstream response of a static bundle, least recently used first
+_static_cache = OrderedDict()
+_static_cache_bytes = 0
+_static_cache_lock = Lock()
+
+def is_static_bundle(method, path):
+    return method == 'GET' and static_path_pattern.search("/" + path) is not None
+
+def static_cache_get(key):
+    with _static_cache_lock:
+        entry = _static_cache.get(key)
+        if entry is not None:
+            _static_cache.move_to_end(key)
+        return entry
+
+def static_cache_put(key, entry):
+    """
+    Cache a static bundle response, evicting least recently used bundles beyond STATIC_CACHE_MAX_BYTES.
+    """
+    global _static_cache_bytes
+    size = len(entry["body"])
+    if size > static_cache_max_bytes:
+        return
+    with _static_cache_lock:
+        previous = _static_cache.pop(key, None)
+        if previous is not None:
+            _static_cache_bytes -= len(previous["body"])
+        _static_cache[key] = entry
+        _static_cache_bytes += size
+        while _static_cache_bytes > static_cache_max_bytes:
+            _, evicted = _static_cache.popitem(last=False)
+            _static_cache_bytes -= len(evicted["body"])
+
+def negotiate_encoding(accept_encoding):
+    """
+    Pick the content coding to request upstream from the client's Accept-Encoding header:
+    the first of SUPPORTED_ENCODINGS it accepts (q > 0), else identity.
+    """
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    for coding in SUPPORTED_ENCODINGS:
+        if accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return "identity"
+
+def get_header(headers, name):
+    """Case-insensitive lookup in the API Gateway request headers."""
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def is_not_modified(request_headers, etag, last_modified):
+    """
+    Evaluate the client's conditional headers against a cached response. If-None-Match takes
+    precedence over If-Modified-Since, as in RFC 9110.
+    """
+    if_none_match = get_header(request_headers, "If-None-Match")
+    if if_none_match:
+        if not etag:
+            return False
+        # Weak comparison: W/"x" matches "x"
+        weak = lambda tag: tag[2:] if tag.startswith("W/") else tag
+        candidates = [weak(tag.strip()) for tag in if_none_match.split(",")]
+        return "*" in candidates or weak(etag) in candidates
+    if_modified_since = get_header(request_headers, "If-Modified-Since")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def encode_body(content, content_type, content_encoding):
+    """
+    Lambda proxy body for raw upstream bytes: text content types are returned as UTF-8 text,
+    compressed or binary content as base64. Bytes are never altered.
+
+    Returns:
+        (body, is_base64_encoded)
+    """
+    if not content:
+        return "", False
+    if not content_encoding or content_encoding == "identity":
+        if content_type.lower().startswith(TEXT_CONTENT_TYPES):
+            try:
+                return content.decode('utf-8'), False
+            except UnicodeDecodeError:
+                pass
+    return base64.b64encode(content).decode('ascii'), True
+
+def build_lambda_response(status_code, upstream_headers, content, static_bundle=False):
+    headers = {name: upstream_headers[name] for name in FORWARDED_RESPONSE_HEADERS if upstream_headers.get(name)}
+    if static_bundle and status_code in (200, 304):
+        # Versioned paths never change: let browsers and CDNs keep them
+        headers["Cache-Control"] = static_cache_control
+        headers["Vary"] = "Accept-Encoding"
+    elif static_bundle:
+        # Errors may be transient: keep the upstream caching policy, or none at all
+        headers.setdefault("Cache-Control", "no-store")
+    if status_code == 304:
+        headers.pop("Content-Encoding", None)
+        content = b""
+    headers.update(CORS_HEADERS)
+    headers["osd-xsrf"] = "true"
+    body, is_base64_encoded = encode_body(content, headers.get("Content-Type", ""), headers.get("Content-Encoding", ""))
+    return {
+        "statusCode": status_code,
+        "headers": headers,
+        "body": body,
+        "isBase64Encoded": is_base64_encoded
+    }
+
 def lambda_handler(event, context):
     #print(event)
     #print(context)
@@ -24,17 +176,12 @@ def lambda_handler(event, context):
     path = event.get('path', '/_dashboards/app/home')
     path = path.lstrip("/")
     #print(f"Request Path: {path}")
-    #query_params = event.get('queryStringParameters', {})
-    #multi_value_query_params = event.get('multiValueQueryStringParameters', {}) or {}
     headers = dict(event.get('headers', {}) or {})
 
     # Handle query parameters, supporting multi-value params
     single_query_params = event.get('queryStringParameters', {}) or {}
     multi_query_params = event.get('multiValueQueryStringParameters', {}) or {}
 
-    #print("single_query_params", single_query_params)
-    #print("multi_query_params", multi_query_params)
-
     # Initialize query_params as an empty dictionary
     query_params = {}
 
@@ -47,52 +194,26 @@ def lambda_handler(event, context):
         for key, value in multi_query_params.items():
             query_params[key] = value  # Directly assign, multi-value parameters are already in a list
 
-    # Print the result
-    #print(query_params)
-    
-    """
-    if method == "POST":
-        print(f"POST Request Detected! Forwarding to {dashboard_endpoint}{path}")
-    else:
-        print("Not a POST request. Ignoring...")
-    """
-
-    # Process request body
+    # Process request body: forwarded as the exact bytes the client sent
     raw_body = event.get('body', None)
     body = None
-    
+
     # Check if body is base64 encoded
     if event.get("isBase64Encoded", False) and raw_body:
-        #print("Decoding Base64 body...")
         try:
-            decoded_bytes = base64.b64decode(raw_body)
-            body = decoded_bytes.decode("utf-8")
-            #print(f"Decoded Body: {body[:500]}")  # Log first 500 chars for debugging
+            body = base64.b64decode(raw_body)
         except Exception as e:
-            #print(f"Base64 decoding failed: {e}")
             return {
                 "statusCode": 400,
                 "body": json.dumps({"error": "Invalid Base64 body"})
             }
-    else:
-        body = raw_body  # Use as-is if not encoded
-    
-
-    # Convert body to JSON if needed
-    if body:
-        try:
-            body = json.loads(body)  # Convert string to JSON object
-        except json.JSONDecodeError:
-            print("Warning: Body is not valid JSON. Sending as raw text.")
+    elif raw_body:
+        body = raw_body.encode('utf-8')
 
     # Set required headers
-    headers.setdefault("Accept-Encoding", "identity")
     headers.setdefault("User-Agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64)")
     headers.setdefault("Content-Type", "application/json")
 
-    # Construct OpenSearch Dashboards URL
-    #opensearch_url = f"{dashboard_endpoint}{path}"
-
     # Construct OpenSearch Dashboards or API URL
     if path.startswith("/_dashboards"):
         # Go to the Dashboards frontend
@@ -101,7 +222,20 @@ def lambda_handler(event, context):
         # Hit the raw OpenSearch API (strip /_dashboards from dashboard_endpoint)
         base_api_endpoint = dashboard_endpoint.split("/_dashboards")[0]
         opensearch_url = f"{base_api_endpoint}{path}"
-    
+
+    # Content coding negotiated with the client; compressed bytes are passed through as-is
+    encoding = negotiate_encoding(get_header(headers, "Accept-Encoding"))
+
+    # Versioned static bundles are served from memory once fetched, or answered with a 304
+    static_bundle = is_static_bundle(method, path)
+    cache_key = (path, encoding)
+    if static_bundle:
+        cached = static_cache_get(cache_key)
+        if cached is not None:
+            if is_not_modified(headers, cached["headers"].get("ETag"), cached["headers"].get("Last-Modified")):
+                return build_lambda_response(304, cached["headers"], b"", static_bundle=True)
+            return build_lambda_response(200, cached["headers"], cached["body"], static_bundle=True)
+
     # Handle authentication headers
     auth_header = headers.get('Authorization', None)
     cookie_header = headers.get('Cookie', '')
@@ -112,97 +246,38 @@ def lambda_handler(event, context):
         cookie = SimpleCookie()
         cookie.load(cookie_header)
         cookie_dict = {key: morsel.value.strip() for key, morsel in cookie.items()}
-        
-    #print(cookies)
-    
+
     # Ensure the 'Authorization' header is forwarded if it exists
-    forwarded_headers = {key: value for key, value in headers.items() if key.lower() not in ['host']}
+    forwarded_headers = {key: value for key, value in headers.items() if key.lower() not in ['host', 'accept-encoding', 'content-length']}
     if auth_header:
         forwarded_headers["Authorization"] = auth_header
-    forwarded_headers["Accept-Encoding"] = ""
-    
-    # Debugging logs
-    #print(f"Method: {method}")
-    #print(f"URL: {opensearch_url}")
-    #print(f"auth: {aws_auth}")
-    #print(f"Headers: {forwarded_headers}")
-    #print(f"Query Params: {query_params}")
-    #print(f"Query Params type: {type(query_params)}")
-    #print(f"Body: {body}")
-    #print(f"Forwarded Cookies: {cookie_dict}")
-    #print("Making request to OpenSearch...")
-    
-    # Forward the request
-    if method == 'GET':
-        response = requests.request(
-            method=method,
-            url=opensearch_url,
-            auth=aws_auth,
-            headers=forwarded_headers,
-            params=query_params,
-            cookies=cookie_dict,
-            #cookies={'security_authentication': cookies} if cookies else None,
-            data=body,  # Ensure JSON body is properly formatted
-            allow_redirects=False,
-            timeout=(30,30)
-        )
-    elif method == 'POST' or method == 'PUT' or method == 'DELETE':
-        response = requests.request(
-            method=method,
-            url=opensearch_url,
-            auth=aws_auth,
-            headers=forwarded_headers,
-            params=query_params,
-            cookies=cookie_dict,
-            #cookies={'security_authentication': cookies} if cookies else None,
-            json=body,  # Ensure JSON body is properly formatted
-            allow_redirects=False,
-            timeout=(30,30)
-        )
-   
-    # Process response
-    content = response.content if response.content else ""
-    content = response.content.decode('utf-8', errors='ignore') if response.content else ""
-    #content = content.replace('/_dashboards/', '/live/_dashboards/')
-    content_type = response.headers.get("Content-Type", "")
-    content_encoding = response.headers.get("Content-Encoding", "")
-    
-    # Handle gzip-encoded response for JavaScript files
-    if path.endswith("Dashboards.plugin.js") or path.endswith("Dashboards.plugin.js"):
-        if path.endswith((
-            ".js"
-        )):
-            buffer = BytesIO()
-            with gzip.GzipFile(fileobj=buffer, mode="wb") as f:
-                f.write(content.encode('utf-8'))
-            compressed_body = base64.b64encode(buffer.getvalue()).decode("utf-8")
-            lambda_response = {
-                "statusCode": response.status_code,
-                "headers": {
-                    "Content-Type": content_type,
-                    "Content-Encoding": "gzip",
-                    "access-control-allow-origin": "*",
-                    "access-control-allow-credentials": "true",
-                    "access-control-allow-methods": "GET, POST, PUT, DELETE, OPTIONS",
-                    "access-control-allow-headers": "Content-Type, Authorization, X-Requested-With"
-                },
-                "body": compressed_body,
-                "isBase64Encoded": True
-            }
-    else:
-        lambda_response = {
-            "statusCode": response.status_code,
-            "headers": {
-                "Content-Type": content_type,
-                "Content-Encoding": "",
-                "access-control-allow-origin": "*",
-                "access-control-allow-credentials": "true",
-                "access-control-allow-methods": "GET, POST, PUT, DELETE, OPTIONS",
-                "access-control-allow-headers": "Content-Type, Authorization, X-Requested-With",
-                "osd-xsrf": "true"
-            },
-            "body": content,
-            "isBase64Encoded": False
-        }
-    
-    return lambda_response
+    # If-None-Match / If-Modified-Since are forwarded, so the upstream can answer 304 itself
+    forwarded_headers["Accept-Encoding"] = encoding
+
+    # Forward the request over the pooled session
+    response = http_session.request(
+        method=method,
+        url=opensearch_url,
+        auth=aws_auth,
+        headers=forwarded_headers,
+        params=query_params,
+        cookies=cookie_dict,
+        data=body,
+        allow_redirects=False,
+        timeout=(30,30),
+        stream=True
+    )
+
+    # Raw upstream bytes, still compressed if the upstream compressed them
+    try:
+        content = response.raw.read(decode_content=False)
+    finally:
+        response.close()
+
+    if static_bundle and response.status_code == 200 and "Set-Cookie" not in response.headers:
+        static_cache_put(cache_key, {
+            "headers": {name: response.headers.get(name) for name in FORWARDED_RESPONSE_HEADERS},
+            "body": content
+        })
+
+    return build_lambda_response(response.status_code, response.headers, content, static_bundle=static_bundle)
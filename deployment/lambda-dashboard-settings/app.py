@@ -46,13 +46,16 @@ def lambda_handler(event, context):
     )
     
 
-    # The slow log settings to apply
+    # The slow log settings to apply.
+    # Per-request latency and hit counts are recorded by lambda-search in the analytics index,
+    # so the slow log only needs to catch genuinely slow operations, not every query.
     settings = {
         "settings": {
-      "index.search.slowlog.threshold.query.warn": "1ms",
-      "index.search.slowlog.threshold.fetch.warn": "1ms",
-      "index.search.slowlog.level": "TRACE",
-      "index.indexing.slowlog.threshold.index.warn": "1ms"
+      "index.search.slowlog.threshold.query.warn": environ.get('SLOWLOG_QUERY_WARN', '1s'),
+      "index.search.slowlog.threshold.query.info": environ.get('SLOWLOG_QUERY_INFO', '500ms'),
+      "index.search.slowlog.threshold.fetch.warn": environ.get('SLOWLOG_FETCH_WARN', '500ms'),
+      "index.search.slowlog.level": environ.get('SLOWLOG_LEVEL', 'INFO'),
+      "index.indexing.slowlog.threshold.index.warn": environ.get('SLOWLOG_INDEX_WARN', '1s')
         }
     }
 
@@ -1,11 +1,20 @@
 import os
-import re
 import json
+import time
 import boto3
+import random
+import hashlib
 from datetime import datetime, timedelta
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from opensearchpy import OpenSearch, RequestsHttpConnection, NotFoundError, helpers
 from requests_aws4auth import AWS4Auth
 
+from slowlog_parser import parse_slow_log
+
+CHECKPOINT_DOC_ID = 'log-ingestion-checkpoints'
+
 def get_awsauth_from_secret(region, secret_id):
     """
     Retrieves AWS OpenSearch credentials stored in AWS Secrets Manager.
@@ -24,19 +33,29 @@ def get_awsauth_from_secret(region, secret_id):
         print(f"Error retrieving secret: {e}")
         return None
 
+# Mapping of the slow log documents, shared by the legacy single index and the index template
+LOG_MAPPINGS = {
+    "properties": {
+        "timestamp": {"type": "date"},
+        "event_id": {"type": "keyword"},
+        "filters_applied": {"type": "nested"},
+        "search_string": {"type": "keyword"},
+        "took_millis": {"type": "long"},
+        "total_hits": {"type": "long"},
+        "total_hits_relation": {"type": "keyword"},
+        "total_shards": {"type": "integer"},
+        "index": {"type": "keyword"},
+        "shard": {"type": "integer"}
+    }
+}
+
+# Length of the ISO timestamp prefix naming each periodic index ('2025-01-31' daily, '2025-01' monthly)
+INDEX_PERIOD_PREFIX = {'daily': 10, 'monthly': 7}
+
 def create_opensearch_index(os_client, index_name):
     """Create a new OpenSearch index if it doesn't exist."""
     if not os_client.indices.exists(index=index_name):
-        # Define the mapping for the new index
-        index_body = {
-            "mappings": {
-                "properties": {
-                    "timestamp": {"type": "date"},
-                    "filters_applied": {"type": "nested"},
-                    "search_string": {"type": "keyword"}
-                }
-            }
-        }
+        index_body = {"mappings": LOG_MAPPINGS}
         response = os_client.indices.create(index=index_name, body=index_body)
         print(f"Created new OpenSearch index: {index_name}")
         return response
@@ -44,6 +63,35 @@ def create_opensearch_index(os_client, index_name):
         print(f"Index '{index_name}' already exists.")
         return None
 
+def put_log_index_template(os_client, index_prefix, shards=1, refresh_interval="30s"):
+    """
+    Create or update the index template applied to every periodic <index_prefix>-YYYY.MM[.DD] slow log index.
+    """
+    template_body = {
+        # Anchored on the year so other <index_prefix>-* indices (e.g. checkpoints) keep their own mappings
+        "index_patterns": [f"{index_prefix}-2*"],
+        "priority": 100,
+        "template": {
+            "settings": {
+                "number_of_shards": shards,
+                "refresh_interval": refresh_interval
+            },
+            "mappings": LOG_MAPPINGS
+        }
+    }
+    response = os_client.indices.put_index_template(name=f"{index_prefix}-template", body=template_body)
+    print(f"Put index template {index_prefix}-template for {index_prefix}-2*")
+    return response
+
+def log_index_name(index_prefix, timestamp, period):
+    """
+    Index of a log document: <index_prefix>-YYYY.MM.DD (daily) or -YYYY.MM (monthly) from its
+    event timestamp, so re-ingesting an event always targets the same index and document id.
+    """
+    if period not in INDEX_PERIOD_PREFIX or not timestamp:
+        return index_prefix
+    return f"{index_prefix}-{timestamp[:INDEX_PERIOD_PREFIX[period]].replace('-', '.')}"
+
 def delete_all_documents(os_client, index):
     """
     Deletes all documents in index
@@ -66,9 +114,53 @@ def delete_all_documents(os_client, index):
     except Exception as e:
         print(f"An error occurred while deleting documents: {e}")
 
+def load_checkpoints(os_client=None, checkpoint_index=None, checkpoint_file=None):
+    """
+    Load the per-stream ingestion checkpoints: {stream_name: {"timestamp", "ingestion_time", "token"}}.
+    They live in a single document of checkpoint_index, or in checkpoint_file when one is given
+    (a local stand-in for tests and local runs).
+    """
+    if checkpoint_file:
+        if not os.path.exists(checkpoint_file):
+            return {}
+        with open(checkpoint_file, "r") as file:
+            return json.load(file)
+
+    try:
+        response = os_client.get(index=checkpoint_index, id=CHECKPOINT_DOC_ID)
+        return response["_source"].get("streams", {})
+    except NotFoundError:
+        return {}
+
+def save_checkpoints(checkpoints, os_client=None, checkpoint_index=None, checkpoint_file=None):
+    """
+    Persist the per-stream ingestion checkpoints written by load_checkpoints.
+    """
+    if checkpoint_file:
+        with open(checkpoint_file, "w") as file:
+            json.dump(checkpoints, file)
+        return
+
+    if not os_client.indices.exists(index=checkpoint_index):
+        # Stream names contain dots and slashes, so the document is stored but not indexed
+        os_client.indices.create(index=checkpoint_index, body={"mappings": {"enabled": False}})
+    os_client.index(index=checkpoint_index, id=CHECKPOINT_DOC_ID, body={"streams": checkpoints})
+
+def has_new_events(stream, checkpoint):
+    """
+    Whether a log stream received events after its checkpoint, based on describe_log_streams metadata.
+    lastEventTimestamp is only eventually consistent, so lastIngestionTime is checked as well.
+    """
+    if not checkpoint:
+        return True
+    if stream.get('lastEventTimestamp', 0) > checkpoint.get('timestamp', 0):
+        return True
+    return stream.get('lastIngestionTime', 0) > checkpoint.get('ingestion_time', 0)
+
 def fetch_log_streams(log_group_name):
     """
     Fetch the log streams from the CloudWatch log group, including pagination.
+    Returns the stream descriptions (logStreamName, lastEventTimestamp, lastIngestionTime, ...).
     """
 
     logs_client = boto3.client('logs')
@@ -82,50 +174,94 @@ def fetch_log_streams(log_group_name):
     ):
         log_streams.extend(page.get('logStreams', []))
     
-    return [stream['logStreamName'] for stream in log_streams]
+    return log_streams
 
-def fetch_log_events(log_group_name, log_stream_name, time_threshold):
+def get_log_events_with_backoff(logs_client, params, max_retries=6, base_delay=0.2):
+    """
+    Call get_log_events, backing off exponentially (with jitter) while CloudWatch throttles us.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return logs_client.get_log_events(**params)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ThrottlingException' or attempt == max_retries:
+                raise
+            delay = base_delay * (2 ** attempt) * (0.5 + random.random())
+            print(f"get_log_events throttled for {params['logStreamName']}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+def fetch_log_events(log_group_name, log_stream_name, time_threshold, checkpoint=None, logs_client=None):
     """
     Fetch all log events from a log stream, handling pagination to ensure all events are retrieved.
+
+    With a checkpoint the stream is resumed from its stored forward token (or, if the token has
+    expired, from its last timestamp); without one the last `time_threshold` minutes are read.
+    The checkpoint dict is updated in place as events are yielded.
     """
-    logs_client = boto3.client('logs')
+    logs_client = logs_client or boto3.client('logs')
+    checkpoint = checkpoint if checkpoint is not None else {}
 
-    if time_threshold is None:
+    if checkpoint.get('timestamp'):
+        # Inclusive: events sharing the last millisecond are re-read and deduplicated by their document id
+        start_time = checkpoint['timestamp']
+    elif time_threshold is None:
         start_time = int((datetime.utcnow() - timedelta(minutes=120)).timestamp() * 1000)
     else:
         start_time = int((datetime.utcnow() - timedelta(minutes=time_threshold)).timestamp() * 1000)
 
-    end_time = int(datetime.utcnow().timestamp() * 1000)
-
     events = dict()
     next_token = None
+    event_count = 0
 
     params = dict(
         logGroupName=log_group_name,
         logStreamName=log_stream_name,
         startFromHead=True,
-        startTime=start_time,
-        endTime=end_time
+        startTime=start_time
     )
+    if checkpoint.get('token'):
+        params["nextToken"] = checkpoint['token']
 
     while next_token != events.get('nextForwardToken', ''):
         next_token = events.get('nextForwardToken')
         if next_token:
             params["nextToken"] = next_token
         
-        events = logs_client.get_log_events(**params)
+        try:
+            events = get_log_events_with_backoff(logs_client, params)
+        except logs_client.exceptions.InvalidParameterException:
+            if "nextToken" not in params:
+                raise
+            # Forward tokens expire; fall back to the checkpoint timestamp
+            print(f"Checkpoint token for {log_stream_name} was rejected, resuming from timestamp {start_time}")
+            params.pop("nextToken")
+            events = get_log_events_with_backoff(logs_client, params)
 
         for event in events.get('events'):
+            event_count += 1
+            checkpoint['timestamp'] = max(checkpoint.get('timestamp', 0), event['timestamp'])
+            checkpoint['ingestion_time'] = max(checkpoint.get('ingestion_time', 0), event.get('ingestionTime', 0))
             yield event
+
+        checkpoint['token'] = events.get('nextForwardToken')
         
-    print(f"Total events fetched: {len(events)}")
-    return events
+    print(f"Total events fetched from {log_stream_name}: {event_count}")
+
+def event_document_id(log_stream_name, event):
+    """
+    Deterministic document id for a log event, so re-ingesting an event overwrites it.
+    get_log_events does not return eventId, so it is derived from the stream, timestamp and message.
+    """
+    if event.get('eventId'):
+        return event['eventId']
+    digest = hashlib.sha1(f"{log_stream_name}\n{event.get('timestamp')}\n{event.get('message')}".encode('utf-8'))
+    return digest.hexdigest()
 
-def transform_logs(events):
+def transform_logs(events, log_stream_name=''):
     """
-    Transforms raw log events to include only the required fields
+    Transforms raw log events to include only the required fields.
+    Documents are yielded one at a time so a stream is never materialized as a list.
     """
-    transformed_logs = []
     event_iter = 0
     for event in events:
         event_iter += 1
@@ -133,56 +269,64 @@ def transform_logs(events):
         # Extract timestamp
         timestamp = event.get("timestamp")
 
-        # Extract raw message
-        raw_message = event.get("message")
-
-        # Use regex to extract the `source` JSON
-        source_pattern = r'source\[(\{.*\})\]'
-        source_match = re.search(source_pattern, raw_message)
-
-        filters = None
-        _name = None
-
-        if source_match:
-            source_json = source_match.group(1)
-            try:
-                # Parse the JSON fragment
-                source_dict = json.loads(source_json)
-
-                # Extract `_name` from `must` clauses
-                must_clauses = source_dict.get("query", {}).get("bool", {}).get("must", [])
-                for clause in must_clauses:
-                    if "match_all" in clause and "_name" in clause["match_all"]:
-                        _name = clause["match_all"]["_name"]
-                        break
-
-                # Extract `filters` from the JSON structure
-                filters = source_dict.get("query", {}).get("bool", {}).get("must", [])
-            except json.JSONDecodeError as e:
-                print("Error decoding JSON: ", e)
-        else:
-            print("No valid source JSON found in the message")
-
-        # Print extracted values for debugging
-        #print("filters ", filters)
-        #print("_name ", _name)
+        # Parse the raw message: query clauses from `source[...]` plus took/hits/shard fields
+        fields = parse_slow_log(event.get("message") or "")
 
-        # Append transformed log
-        transformed_logs.append({
+        # Yield transformed log
+        yield {
+            'event_id': event_document_id(log_stream_name, event),
             'timestamp': datetime.utcfromtimestamp(timestamp / 1000).isoformat(),
-            'filters_applied': filters, 
-            'search_string': _name
-        })
+            'filters_applied': fields['filters_applied'], 
+            'search_string': fields['search_string'],
+            'took_millis': fields['took_millis'],
+            'total_hits': fields['total_hits'],
+            'total_hits_relation': fields['total_hits_relation'],
+            'total_shards': fields['total_shards'],
+            'index': fields['index'],
+            'shard': fields['shard']
+        }
     print("Total events processed: ", event_iter)
-    
-    return transformed_logs
 
-def save_to_opensearch(os_client, index, documents):
+def save_to_opensearch(os_client, index, documents, max_docs=500, max_bytes=5 * 1024 * 1024, period='none'):
+    """
+    Loads the transformed log data into OpenSearch with the bulk API.
+    With a 'daily' or 'monthly' period, each document goes to the periodic index of its timestamp.
+
+    documents can be any iterable (typically the transform_logs generator); it is consumed
+    lazily and flushed every max_docs documents or max_bytes of request body, whichever
+    comes first, so memory stays bounded. Rejected (429) chunks are retried with backoff.
+
+    Returns:
+    - (succeeded, failed) document counts.
+    """
+    actions = ({"_index": log_index_name(index, doc.get('timestamp'), period), "_id": doc.get('event_id'), "_source": doc}
+               for doc in documents)
+    succeeded, failed = 0, 0
+    for ok, item in helpers.streaming_bulk(os_client, actions, chunk_size=max_docs, max_chunk_bytes=max_bytes,
+                                           max_retries=3, raise_on_error=False):
+        if ok:
+            succeeded += 1
+        else:
+            failed += 1
+            print(f"Failed to index log document: {item}")
+    return succeeded, failed
+
+def process_log_stream(os_client, logs_client, log_group_name, log_stream_name, index, time_threshold, checkpoint, max_docs, max_bytes, period='none'):
     """
-    Loads the transformed log data into OpenSearch.
+    Fetch, transform and bulk-save the new events of one log stream.
+    Returns the advanced checkpoint and the number of documents saved.
     """
-    for doc in documents:
-        response = os_client.index(index=index, body=doc)
+    # Fetch log events from the log stream, starting at its checkpoint
+    events = fetch_log_events(log_group_name, log_stream_name, time_threshold, checkpoint, logs_client)
+
+    # Transform logs for OpenSearch indexing
+    transformed_logs = transform_logs(events, log_stream_name)
+
+    # Save transformed logs to OpenSearch
+    succeeded, failed = save_to_opensearch(os_client, index, transformed_logs, max_docs=max_docs, max_bytes=max_bytes, period=period)
+    if failed:
+        raise RuntimeError(f"{failed} documents from {log_stream_name} failed to index")
+    return checkpoint, succeeded
 
 def lambda_handler(event, context):
     """
@@ -196,6 +340,12 @@ def lambda_handler(event, context):
     os_secret_id = os.environ['OS_SECRET_ID']
     log_group_name = os.environ['CLOUDWATCH_LOG_GROUP'] 
     time_threshold = int(os.environ['TIME_THRESHOLD'])
+    checkpoint_index = os.environ.get('CHECKPOINT_INDEX', f"{new_index_name}-checkpoints")
+    checkpoint_file = os.environ.get('CHECKPOINT_FILE')
+    max_workers = int(os.environ.get('MAX_WORKERS', '4'))
+    bulk_max_docs = int(os.environ.get('BULK_MAX_DOCS', '500'))
+    bulk_max_bytes = int(os.environ.get('BULK_MAX_BYTES', str(5 * 1024 * 1024)))
+    index_period = os.environ.get('LOG_INDEX_PERIOD', 'daily')  # 'daily', 'monthly' or 'none' (single index)
 
     # Use IAM credentials instead
     credentials = boto3.Session().get_credentials()
@@ -219,26 +369,57 @@ def lambda_handler(event, context):
         print("OpenSearch Connection Failed:", e)
 
     try:
-        # Ensure the new OpenSearch index exists
-        create_opensearch_index(os_client, new_index_name)
+        # Periodic indices get their mapping from a template; 'none' keeps the single index
+        if index_period in INDEX_PERIOD_PREFIX:
+            put_log_index_template(os_client, new_index_name)
+        else:
+            create_opensearch_index(os_client, new_index_name)
 
         # Delete all documents in the index to rebuild logs
         #delete_all_documents(os_client, new_index_name)
 
         # Fetch log streams from the CloudWatch log group
         log_streams = fetch_log_streams(log_group_name)
+        checkpoints = load_checkpoints(os_client, checkpoint_index, checkpoint_file)
 
         excluded_streams = {'es-test-log-stream', 'cust-test-log-stream'} #created automatically by OpenSearch
-        for log_stream_name in log_streams:
-            if log_stream_name not in excluded_streams:
-                # Fetch log events from each log stream
-                events = fetch_log_events(log_group_name, log_stream_name, time_threshold)
-                
-                # Transform logs for OpenSearch indexing
-                transformed_logs = transform_logs(events)
-                
-                # Save transformed logs to OpenSearch
-                save_to_opensearch(os_client, new_index_name, transformed_logs)
+        pending_streams = [
+            stream['logStreamName'] for stream in log_streams
+            if stream['logStreamName'] not in excluded_streams
+            and has_new_events(stream, checkpoints.get(stream['logStreamName']))
+        ]
+        print(f"Skipped {len(log_streams) - len(pending_streams)} log streams with no events since their checkpoint")
+
+        # boto3 clients are thread-safe; adaptive retries add client-side rate limiting on throttling
+        logs_client = boto3.client('logs', config=Config(retries={'max_attempts': 10, 'mode': 'adaptive'}))
+
+        # Streams are fetched concurrently; checkpoints are only touched from this thread
+        failed_streams = []
+        total_saved = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(process_log_stream, os_client, logs_client, log_group_name, log_stream_name, new_index_name,
+                                time_threshold, dict(checkpoints.get(log_stream_name, {})), bulk_max_docs, bulk_max_bytes,
+                                index_period): log_stream_name
+                for log_stream_name in pending_streams
+            }
+            for future in as_completed(futures):
+                log_stream_name = futures[future]
+                try:
+                    checkpoint, saved = future.result()
+                except Exception as e:
+                    print(f"Error processing log stream {log_stream_name}: {e}")
+                    failed_streams.append(log_stream_name)
+                    continue
+
+                # Only advance the checkpoint once the stream's documents are saved
+                total_saved += saved
+                checkpoints[log_stream_name] = checkpoint
+                save_checkpoints(checkpoints, os_client, checkpoint_index, checkpoint_file)
+
+        print(f"Indexed {total_saved} log documents from {len(pending_streams)} log streams")
+        if failed_streams:
+            raise RuntimeError(f"Failed to process log streams: {failed_streams}")
 
         return {
             "statusCode": 200,
@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of the slow log parser on synthetic slow log lines.
+
+Compares the former transform_logs parsing (greedy uncompiled regex + full json.loads)
+with slowlog_parser.parse_slow_log, for the query shapes lambda-search produces.
+
+Usage:
+    python benchmark_slowlog_parser.py --events 2000 --repeat 5
+"""
+import re
+import json
+import random
+import argparse
+import timeit
+
+from slowlog_parser import parse_slow_log
+
+
+def synthetic_slow_log_line(kind, rng, dimension=768):
+    """
+    Build a slow log line shaped like the ones OpenSearch publishes to CloudWatch.
+    kind is 'semantic' (hybrid k-NN query), 'browse' (filtered match_all) or 'named' (match_all with _name).
+    """
+    filters = [{"bool": {"should": [{"wildcard": {"systemName.keyword": {"value": "*geo*", "case_insensitive": True}}}], "minimum_should_match": 1}}]
+    if kind == 'semantic':
+        query = {"bool": {"must": [], "filter": filters, "should": [
+            {"multi_match": {"query": "wildfire", "fields": ["*title*^10", "*description*^15"], "type": "best_fields", "boost": 0.007}},
+            {"knn": {"vector": {"vector": [round(rng.uniform(-1, 1), 6) for _ in range(dimension)], "k": 10}}}
+        ], "minimum_should_match": 1}}
+    elif kind == 'named':
+        query = {"bool": {"must": [{"match_all": {"_name": "flood risk"}}], "filter": filters}}
+    else:
+        query = {"bool": {"must": [], "filter": filters}}
+    source = json.dumps({"size": 10, "from": 0, "query": query, "sort": [{"popularity": {"order": "desc"}}]}, separators=(',', ':'))
+    took = rng.randint(1, 400)
+    return (f"[2025-01-01T00:00:00,000][WARN ][i.s.s.query] [node-1] [mpnet-mpf-knn-20250101000000][{rng.randint(0, 4)}] "
+            f"took[{took}ms], took_millis[{took}], total_hits[{rng.randint(0, 12000)} hits], types[], stats[], "
+            f"search_type[QUERY_THEN_FETCH], total_shards[5], source[{source}], id[], ")
+
+
+def legacy_parse(raw_message):
+    """
+    The parsing transform_logs did before slowlog_parser, kept for comparison.
+    """
+    source_match = re.search(r'source\[(\{.*\})\]', raw_message)
+    filters = None
+    _name = None
+    if source_match:
+        source_dict = json.loads(source_match.group(1))
+        must_clauses = source_dict.get("query", {}).get("bool", {}).get("must", [])
+        for clause in must_clauses:
+            if "match_all" in clause and "_name" in clause["match_all"]:
+                _name = clause["match_all"]["_name"]
+                break
+        filters = source_dict.get("query", {}).get("bool", {}).get("must", [])
+    return filters, _name
+
+
+def main(n_events, repeat, seed):
+    rng = random.Random(seed)
+    kinds = ['semantic', 'browse', 'named']
+    lines = {kind: [synthetic_slow_log_line(kind, rng) for _ in range(n_events)] for kind in kinds}
+
+    # Both parsers must agree before their timings mean anything
+    for kind in kinds:
+        for line in lines[kind][:50]:
+            fields = parse_slow_log(line)
+            filters, _name = legacy_parse(line)
+            assert (fields['filters_applied'] or []) == (filters or []) and fields['search_string'] == _name, kind
+
+    print(f"{'query shape':<12} {'legacy us/line':>15} {'parser us/line':>15} {'speedup':>8}")
+    for kind in kinds:
+        legacy = min(timeit.repeat(lambda: [legacy_parse(line) for line in lines[kind]], number=1, repeat=repeat))
+        parser = min(timeit.repeat(lambda: [parse_slow_log(line) for line in lines[kind]], number=1, repeat=repeat))
+        print(f"{kind:<12} {legacy / n_events * 1e6:>15.1f} {parser / n_events * 1e6:>15.1f} {legacy / parser:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the slow log parser.')
+    parser.add_argument('--events', type=int, default=2000, help='Synthetic slow log lines per query shape')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing repetitions (best is reported)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic lines')
+    args = parser.parse_args()
+    main(args.events, args.repeat, args.seed)
@@ -0,0 +1,108 @@
+import re
+import json
+
+# orjson is optional; it parses the (vector-heavy) source JSON several times faster
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+# Patterns are compiled once at import. None of them can backtrack across the source JSON:
+# the numeric fields precede it and each pattern stops at the first closing bracket.
+TOOK_MILLIS_PATTERN = re.compile(r'took_millis\[(\d+)\]')
+TOTAL_HITS_PATTERN = re.compile(r'total_hits\[(\d+)(\+?)')
+TOTAL_SHARDS_PATTERN = re.compile(r'total_shards\[(\d+)\]')
+SHARD_PATTERN = re.compile(r'\[([^\[\]\s]+)\]\[(\d+)\]')
+
+SOURCE_PREFIX = 'source['
+SOURCE_SUFFIX = '}]'
+EMPTY_MUST = '"must":[]'
+
+
+def extract_source_span(message):
+    """
+    Return the JSON text inside `source[...]` of a slow log line, or None.
+
+    Equivalent to the greedy re.search(r'source\\[(\\{.*\\})\\]') it replaces: the span runs from
+    the first '{' after 'source[' to the last '}]' of the line. Two str.find calls, no backtracking.
+    """
+    start = message.find(SOURCE_PREFIX)
+    if start == -1:
+        return None
+    start += len(SOURCE_PREFIX)
+    if not message.startswith('{', start):
+        return None
+    end = message.rfind(SOURCE_SUFFIX)
+    if end < start:
+        return None
+    return message[start:end + 1]
+
+
+def parse_numeric_fields(message):
+    """
+    Extract the numeric slow log fields used by the dashboards.
+
+    Returns:
+    - dict with took_millis, total_hits, total_hits_relation ('eq' or 'gte'), total_shards,
+      index and shard. Fields missing from the line are None.
+    """
+    took_millis = TOOK_MILLIS_PATTERN.search(message)
+    total_hits = TOTAL_HITS_PATTERN.search(message)
+    total_shards = TOTAL_SHARDS_PATTERN.search(message)
+    shard = SHARD_PATTERN.search(message)
+    return {
+        'took_millis': int(took_millis.group(1)) if took_millis else None,
+        'total_hits': int(total_hits.group(1)) if total_hits else None,
+        'total_hits_relation': ('gte' if total_hits.group(2) else 'eq') if total_hits else None,
+        'total_shards': int(total_shards.group(1)) if total_shards else None,
+        'index': shard.group(1) if shard else None,
+        'shard': int(shard.group(2)) if shard else None,
+    }
+
+
+def extract_query_fields(source_json):
+    """
+    Extract (filters, search_string) from the slow log source JSON.
+
+    filters is query.bool.must ([] when there is none) and search_string the `_name` of a
+    match_all clause in it.
+    Cheap substring checks settle the common cases without parsing: the logged source is
+    compact JSON, so an empty must clause is literally '"must":[]'.
+    """
+    if '"must"' not in source_json or (EMPTY_MUST in source_json and source_json.count('"must"') == 1):
+        return [], None
+
+    source_dict = _json_loads(source_json)
+    must_clauses = source_dict.get("query", {}).get("bool", {}).get("must", [])
+
+    _name = None
+    if '"_name"' in source_json:
+        for clause in must_clauses:
+            if "match_all" in clause and "_name" in clause["match_all"]:
+                _name = clause["match_all"]["_name"]
+                break
+    return must_clauses, _name
+
+
+def parse_slow_log(message):
+    """
+    Parse a search slow log line into the fields indexed by the log ingestion lambda.
+
+    Returns:
+    - dict with filters_applied, search_string and the fields of parse_numeric_fields.
+    """
+    fields = parse_numeric_fields(message)
+    fields['filters_applied'] = None
+    fields['search_string'] = None
+
+    source_json = extract_source_span(message)
+    if source_json is None:
+        print("No valid source JSON found in the message")
+        return fields
+
+    try:
+        fields['filters_applied'], fields['search_string'] = extract_query_fields(source_json)
+    except ValueError as e:
+        print("Error decoding JSON: ", e)
+    return fields
@@ -0,0 +1,220 @@
+import os
+import json
+import boto3
+import hashlib
+from datetime import datetime, timedelta
+from opensearchpy import OpenSearch, RequestsHttpConnection, helpers
+from requests_aws4auth import AWS4Auth
+
+# Analytics fields rolled up per hour: dimension name -> keyword field of the lambda-search analytics documents
+ROLLUP_DIMENSIONS = {
+    "query": "q",
+    "method": "method",
+    "lang": "lang",
+    "organization_filter": "organization_filter",
+    "metadata_source_filter": "metadata_source_filter",
+    "theme_filter": "theme_filter",
+    "type_filter": "type_filter",
+    "topicCategory_filter": "topicCategory_filter",
+    "protocol_filter": "protocol_filter",
+    "mappable_filter": "mappable_filter",
+    "country": "ip2geo.country_iso_code",
+    "region": "ip2geo.region_name",
+    "city": "ip2geo.city_name",
+}
+
+ROLLUP_MAPPINGS = {
+    "properties": {
+        "hour": {"type": "date"},
+        "dimension": {"type": "keyword"},
+        "key": {"type": "keyword"},
+        "count": {"type": "long"},
+        "zero_hits": {"type": "long"},
+        "latency_p50": {"type": "float"},
+        "latency_p95": {"type": "float"},
+        "rolled_up_at": {"type": "date"}
+    }
+}
+
+def create_opensearch_index(os_client, index_name):
+    """Create the rollup index if it doesn't exist."""
+    if not os_client.indices.exists(index=index_name):
+        response = os_client.indices.create(index=index_name, body={"mappings": ROLLUP_MAPPINGS})
+        print(f"Created new OpenSearch index: {index_name}")
+        return response
+    else:
+        print(f"Index '{index_name}' already exists.")
+        return None
+
+def analytics_index_pattern(index_prefix, period):
+    """
+    Analytics indices lambda-search writes to: the periodic <index_prefix>-YYYY.MM[.DD] indices,
+    or with ANALYTICS_INDEX_PERIOD=none the single <index_prefix> index.
+    """
+    return index_prefix if period == 'none' else f"{index_prefix}-2*"
+
+def text_fields(os_client, index):
+    """
+    Rollup dimension fields mapped as text in index. The legacy single index was created without
+    some of them, so they were mapped dynamically as text with a .keyword sub-field.
+    """
+    response = os_client.indices.get_field_mapping(index=index, fields=",".join(ROLLUP_DIMENSIONS.values()),
+                                                   ignore_unavailable=True, allow_no_indices=True)
+    fields = set()
+    for index_mapping in response.values():
+        for full_name, field_mapping in index_mapping.get("mappings", {}).items():
+            if any(mapping.get("type") == "text" for mapping in field_mapping.get("mapping", {}).values()):
+                fields.add(full_name)
+    return fields
+
+def hourly_rollup_query(start, end, top_n, text_fields=()):
+    """
+    Size-0 search bucketing the analytics documents in [start, end) per hour, with the top_n keys
+    of every rollup dimension, the zero-hit count and latency percentiles of each hour.
+    Dimensions in text_fields are aggregated on their .keyword sub-field.
+    """
+    per_hour = {
+        "zero_hits": {"filter": {"term": {"total_hits": 0}}},
+        "latency": {"percentiles": {"field": "timings.total", "percents": [50, 95]}}
+    }
+    for dimension, field in ROLLUP_DIMENSIONS.items():
+        per_hour[dimension] = {"terms": {"field": f"{field}.keyword" if field in text_fields else field, "size": top_n}}
+
+    return {
+        "size": 0,
+        "query": {"range": {"timestamp": {"gte": start.isoformat(), "lt": end.isoformat()}}},
+        "aggs": {
+            "hours": {
+                "date_histogram": {"field": "timestamp", "fixed_interval": "1h", "min_doc_count": 1},
+                "aggs": per_hour
+            }
+        }
+    }
+
+def rollup_documents(response, rolled_up_at):
+    """
+    Turn the hourly buckets of hourly_rollup_query into rollup documents: one per hour with
+    dimension '_all' (totals and latency), plus one per (hour, dimension, key).
+    """
+    for hour_bucket in response.get("aggregations", {}).get("hours", {}).get("buckets", []):
+        hour = hour_bucket["key_as_string"]
+        percentiles = hour_bucket["latency"]["values"]
+        yield {
+            "hour": hour,
+            "dimension": "_all",
+            "key": "_all",
+            "count": hour_bucket["doc_count"],
+            "zero_hits": hour_bucket["zero_hits"]["doc_count"],
+            "latency_p50": percentiles.get("50.0"),
+            "latency_p95": percentiles.get("95.0"),
+            "rolled_up_at": rolled_up_at
+        }
+        for dimension in ROLLUP_DIMENSIONS:
+            for bucket in hour_bucket[dimension]["buckets"]:
+                yield {
+                    "hour": hour,
+                    "dimension": dimension,
+                    "key": str(bucket["key"]),
+                    "count": bucket["doc_count"],
+                    "rolled_up_at": rolled_up_at
+                }
+
+def rollup_document_id(document):
+    """
+    Deterministic id so re-running a window overwrites its rollups instead of duplicating them.
+    """
+    key = f"{document['hour']}\x1f{document['dimension']}\x1f{document['key']}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def save_to_opensearch(os_client, index, documents):
+    """
+    Loads the rollup documents into OpenSearch with the bulk API.
+    """
+    actions = ({"_index": index, "_id": rollup_document_id(doc), "_source": doc} for doc in documents)
+    succeeded, errors = helpers.bulk(os_client, actions, chunk_size=500, raise_on_error=False)
+    if errors:
+        print(f"Failed to index rollup documents: {errors}")
+    return succeeded, len(errors)
+
+def delete_expired_indices(os_client, index_prefix, retention_days, now):
+    """
+    Delete the daily <index_prefix>-YYYY.MM.DD analytics indices older than retention_days.
+    Their hourly rollups are kept, so dashboards over long ranges still work.
+    """
+    cutoff = (now - timedelta(days=retention_days)).strftime("%Y.%m.%d")
+    expired = []
+    for index_name in os_client.indices.get(index=f"{index_prefix}-2*", ignore_unavailable=True):
+        suffix = index_name[len(index_prefix) + 1:]
+        if len(suffix) == len(cutoff) and suffix < cutoff:
+            expired.append(index_name)
+    for index_name in sorted(expired):
+        os_client.indices.delete(index=index_name)
+        print(f"Deleted expired analytics index {index_name}")
+    return expired
+
+def lambda_handler(event, context):
+    """
+    Scheduled Lambda handler that rolls the search analytics documents of the last complete hours
+    up into hourly top queries, filter usage and geo counts.
+    """
+    # Environment variable configuration
+    region = os.environ['MY_AWS_REGION']
+    aos_host = os.environ['OS_ENDPOINT']
+    analytics_index_prefix = os.environ['NEW_INDEX_NAME']
+    rollup_index_name = os.environ.get('ROLLUP_INDEX_NAME', f"rollup-{analytics_index_prefix}")
+    lookback_hours = int(os.environ.get('LOOKBACK_HOURS', '3'))
+    top_n = int(os.environ.get('ROLLUP_TOP_N', '50'))
+    retention_days = int(os.environ.get('ANALYTICS_RETENTION_DAYS', '0'))  # 0 keeps every daily index
+    analytics_index_period = os.environ.get('ANALYTICS_INDEX_PERIOD', 'daily')  # as configured for lambda-search
+
+    # Use IAM credentials instead
+    credentials = boto3.Session().get_credentials()
+    aws_auth = AWS4Auth(credentials.access_key, credentials.secret_key, region, 'es', session_token=credentials.token)
+
+    # Initialize OpenSearch client
+    os_client = OpenSearch(
+        hosts=[{'host': aos_host, 'port': 443}],
+        http_auth=aws_auth,
+        use_ssl=True,
+        verify_certs=True,
+        ssl_assert_hostname = False,
+        ssl_show_warn = False,
+        connection_class=RequestsHttpConnection
+    )
+
+    try:
+        create_opensearch_index(os_client, rollup_index_name)
+
+        # Roll up whole hours only; the current hour is picked up again by the next run
+        now = datetime.utcnow()
+        end = now.replace(minute=0, second=0, microsecond=0)
+        start = end - timedelta(hours=lookback_hours)
+
+        analytics_index = analytics_index_pattern(analytics_index_prefix, analytics_index_period)
+        response = os_client.search(
+            index=analytics_index,
+            body=hourly_rollup_query(start, end, top_n, text_fields=text_fields(os_client, analytics_index)),
+            ignore_unavailable=True,
+            allow_no_indices=True
+        )
+        # Shards that failed the aggregations would silently leave their hours out of the rollups
+        shards = response.get("_shards", {})
+        if shards.get("failed"):
+            raise RuntimeError(f"Rollup search failed on {shards['failed']} of {shards.get('total')} shards: {shards.get('failures')}")
+        succeeded, failed = save_to_opensearch(os_client, rollup_index_name, rollup_documents(response, now.isoformat()))
+        print(f"Rolled up {start.isoformat()} - {end.isoformat()} into {succeeded} documents ({failed} failed)")
+
+        expired = []
+        if retention_days > 0:
+            expired = delete_expired_indices(os_client, analytics_index_prefix, retention_days, now)
+
+        return {
+            "statusCode": 200 if not failed else 500,
+            "body": json.dumps({"rollup_documents": succeeded, "failed": failed, "deleted_indices": expired})
+        }
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)})
+        }
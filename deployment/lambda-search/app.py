@@ -1,15 +1,21 @@
 import json
+import time
 import boto3
 import requests
 
 from os import environ
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
 from requests_aws4auth import AWS4Auth
 
 from filter_builder import *
 from dashboard import *
+from metrics import timed, emit_metrics
+from embedding_cache import get_embedding, get_embeddings
+from query_router import route_query
+from density import parse_density_params, density_aggregation, create_density_response
 
 #Global variables for prod 
 region = environ['MY_AWS_REGION']
@@ -18,6 +24,134 @@ sagemaker_endpoint = environ['SAGEMAKER_ENDPOINT']
 os_secret_id = environ['OS_SECRET_ID']
 model_name = environ['MODEL_NAME']
 search_index_name = environ['NEW_INDEX_NAME']
+# Independent request steps (geolocation, facet aggregations) run on this pool, reused across invocations
+search_workers = int(environ.get('SEARCH_WORKERS', '4'))
+split_facet_aggs = environ.get('SPLIT_FACET_AGGS', 'false').lower() == 'true'
+# 'opensearch' (default) or 'local': semantic searches served in-process from a local index (local_index.py)
+search_backend = environ.get('SEARCH_BACKEND', 'opensearch')
+# Index sort of the searched index (Create_Opensearch_index.py --index_sort), empty if it is not sorted
+index_sort_field = environ.get('INDEX_SORT_FIELD', '')
+index_sort_order = environ.get('INDEX_SORT_ORDER', 'desc')
+
+# filter_config.json entries for fields added to the index mapping by later builds. They are used
+# only once the searched index maps the field; until then the older filters apply.
+MAPPED_FILTER_KEYS = ("temporal", "extent")
+mapping_recheck_seconds = int(environ.get('MAPPING_RECHECK_SECONDS', '300'))
+# Index document fields used by the search and the index build only, never returned to API clients
+INTERNAL_SOURCE_FIELDS = ["vector", "footprint", "content_hash", "temporalRange", "extent"]
+
+executor = ThreadPoolExecutor(max_workers=search_workers)
+_os_client = None
+_mapped_fields = {}  # field -> (mapped, checked at)
+_vector_dimension = {}  # index -> (knn dimension, checked at)
+
+def get_os_client():
+    """
+    OpenSearch client shared by every invocation of the container, created on first use.
+    AWSV4SignerAuth signs each request with the session's refreshable credentials, so the
+    cached client keeps working after the Lambda role credentials rotate.
+    """
+    global _os_client
+    if _os_client is None:
+        credentials = boto3.Session().get_credentials()
+        _os_client = OpenSearch(
+            hosts=[{'host': aos_host, 'port': 443}],
+            http_auth=AWSV4SignerAuth(credentials, region, 'es'),
+            use_ssl=True,
+            verify_certs=True,
+            connection_class=RequestsHttpConnection,
+            pool_maxsize=search_workers + 1
+        )
+    return _os_client
+
+def get_search_client(os_client):
+    """
+    Client semantic searches go to: os_client, or the container's local index with SEARCH_BACKEND=local.
+    Keyword searches, the analytics and the embedding cache always use OpenSearch.
+    """
+    if search_backend == 'local':
+        # Imported on demand: numpy is only loaded by containers serving the local index
+        from local_index import get_local_index
+        return get_local_index()
+    return os_client
+
+def available_routes():
+    """Query routes the search backend can serve: the local index has no text index, only ids."""
+    return ("id",) if search_backend == 'local' else None
+
+def sorted_like_index(sort_param):
+    """True if the requested sort is the index sort, so the hits request can terminate early."""
+    return bool(index_sort_field) and sort_param == [{index_sort_field: {"order": index_sort_order}}]
+
+def split_index_sorted_query(query, idx_name):
+    """
+    _msearch lines of a query sorted like the index: the hits request without a total, so each segment
+    stops after from + size documents, and a size-0 request for the total and the facets, which the
+    shard request cache keeps.
+    """
+    hits_query = {key: value for key, value in query.items() if key != "aggs"}
+    hits_query["track_total_hits"] = False
+    count_query = {"size": 0, "track_total_hits": True, "query": query["query"], "aggs": query.get("aggs", {})}
+    if "min_score" in query:
+        count_query["min_score"] = query["min_score"]
+    return [{"index": idx_name}, hits_query, {"index": idx_name, "request_cache": True}, count_query]
+
+def merge_index_sorted_responses(hits_result, count_result):
+    """Search response of a split_index_sorted_query: hits of the first request, total and facets of the second."""
+    hits_result["hits"]["total"] = count_result["hits"]["total"]
+    hits_result["aggregations"] = count_result.get("aggregations", {})
+    return hits_result
+
+def field_is_mapped(os_client, field, idx_name=model_name):
+    """
+    True if the searched index maps field. A mapped field is remembered for the life of the container;
+    an unmapped one is checked again after MAPPING_RECHECK_SECONDS, so a rebuild or sync is picked up.
+    """
+    mapped, checked_at = _mapped_fields.get(field, (False, None))
+    if mapped or (checked_at is not None and time.monotonic() - checked_at < mapping_recheck_seconds):
+        return mapped
+    try:
+        if search_backend == 'local':
+            mapped = get_search_client(os_client).has_field(field)
+        else:
+            # Object fields (extent) have no mapping of their own, only their sub-fields
+            response = os_client.indices.get_field_mapping(index=idx_name, fields=f"{field},{field}.*")
+            mapped = any(index_mapping.get("mappings") for index_mapping in response.values())
+    except Exception as e:
+        print(f"Error checking the mapping of {field} on {idx_name}: {e}")
+        mapped = False
+    _mapped_fields[field] = (mapped, time.monotonic())
+    return mapped
+
+def vector_dimension(os_client, idx_name=model_name):
+    """
+    Dimension of the searched index's vectors, part of the embedding cache version. Like field_is_mapped,
+    it is remembered for the life of the container once known and checked again after MAPPING_RECHECK_SECONDS
+    otherwise; None until then.
+    """
+    dimension, checked_at = _vector_dimension.get(idx_name, (None, None))
+    if dimension or (checked_at is not None and time.monotonic() - checked_at < mapping_recheck_seconds):
+        return dimension
+    try:
+        if search_backend == 'local':
+            dimension = get_search_client(os_client).vectors.shape[1]
+        else:
+            response = os_client.indices.get_field_mapping(index=idx_name, fields="vector")
+            dimension = next((index_mapping["mappings"]["vector"]["mapping"]["vector"].get("dimension")
+                              for index_mapping in response.values() if "vector" in index_mapping.get("mappings", {})), None)
+    except Exception as e:
+        print(f"Error reading the vector dimension of {idx_name}: {e}")
+        dimension = None
+    _vector_dimension[idx_name] = (dimension, time.monotonic())
+    return dimension
+
+def search_filter_config(os_client):
+    """filter_config.json without the MAPPED_FILTER_KEYS entries whose field the searched index does not map yet."""
+    filter_config = load_config()
+    for key in MAPPED_FILTER_KEYS:
+        if filter_config.get(key) and not field_is_mapped(os_client, filter_config[key][0]):
+            del filter_config[key]
+    return filter_config
 
 def get_awsauth_from_secret(region, secret_id):
     """
@@ -59,19 +193,36 @@ def invoke_sagemaker_endpoint(sagemaker_endpoint, payload, region):
         print(f"Error invoking SageMaker endpoint {sagemaker_endpoint}: {e}")
         
 
-def semantic_search_neighbors(lang, search_text, features, os_client, sort_param, k_neighbors=50, from_param=0, idx_name=model_name, filters=None, size=10):
+def invoke_sagemaker_endpoint_batch(sagemaker_endpoint, texts, region):
+    """Invoke a SageMaker endpoint with a JSON list of texts (ContentType='application/json') to get one embedding per text."""
+    runtime_client = boto3.client('runtime.sagemaker', region_name=region)
+    try:
+        response = runtime_client.invoke_endpoint(
+            EndpointName=sagemaker_endpoint,
+            ContentType='application/json',
+            Accept='application/json',
+            Body=json.dumps(list(texts))
+        )
+
+        result = json.loads(response['Body'].read().decode())
+        return (result)
+    except Exception as e:
+        print(f"Error invoking SageMaker endpoint {sagemaker_endpoint}: {e}")
+
+def build_semantic_query(lang, search_text, features, sort_param, k_neighbors=50, from_param=0, filters=None, size=10, filter_config=None, must=None):
     """
-    Perform semantic search and get neighbots using the cosine similarity of the vectors 
-    output: a list of json, each json contains _id, _score, title, and uuid 
+    Build the search body of a semantic (hybrid BM25 + k-NN) query with its facet aggregations.
+    Without features (empty query text) it is a filtered browse query; must holds the clause of a
+    routed query (query_router.py), which is searched without features.
     """
-    filter_config = load_config()
+    filter_config = filter_config or load_config()
     # Correct language suffix
     org_field_lang = "organisation.en.keyword" if lang == "en" else "organisation.fr.keyword"
     #print("Filters:", json.dumps(filters, indent=2))
     query = {
         "query": {
             "bool": {
-                "must": [],
+                "must": [must] if must else [],
                 "filter": filters if filters else []  # Apply filters
             }
         },
@@ -164,13 +315,44 @@ def semantic_search_neighbors(lang, search_text, features, os_client, sort_param
         #    }
         #})
         query["min_score"] = 0.55
+
+    return query
+
+def semantic_search_neighbors(lang, search_text, features, os_client, sort_param, k_neighbors=50, from_param=0, idx_name=model_name, filters=None, size=10, timings=None, must=None):
+    """
+    Perform semantic search and get neighbots using the cosine similarity of the vectors 
+    output: a list of json, each json contains _id, _score, title, and uuid 
+    timings: optional dict that receives the search, opensearch_took and response_build timings (ms)
+    """
+    timings = timings if timings is not None else {}
+    query = build_semantic_query(lang, search_text, features, sort_param, k_neighbors=k_neighbors, from_param=from_param,
+                                 filters=filters, size=size, must=must)
             
     #print(json.dumps(query, indent=2))
     
-    res = os_client.search(
-        request_timeout=55, 
-        index=idx_name,
-        body=query)
+    search_client = get_search_client(os_client)
+    with timed(timings, "search"):
+        if sorted_like_index(sort_param):
+            # Sorted like the index (browse queries): the hits stop early, total and facets come from the request cache
+            responses = search_client.msearch(body=split_index_sorted_query(query, idx_name), request_timeout=55)["responses"]
+            for search_result in responses:
+                if "error" in search_result:
+                    raise RuntimeError(f"Search on {idx_name} failed: {search_result['error']}")
+            res = merge_index_sorted_responses(*responses)
+        else:
+            if split_facet_aggs:
+                # The facets go out as their own size-0 request, concurrently with the hits request
+                facet_query = {"size": 0, "track_total_hits": False, "query": query["query"], "aggs": query.pop("aggs")}
+                if "min_score" in query:
+                    facet_query["min_score"] = query["min_score"]
+                facet_future = executor.submit(search_client.search, request_timeout=55, index=idx_name, body=facet_query)
+            res = search_client.search(
+                request_timeout=55, 
+                index=idx_name,
+                body=query)
+            if split_facet_aggs:
+                res["aggregations"] = facet_future.result().get("aggregations", {})
+    timings["opensearch_took"] = res.get("took")
 
     #print(res)
     
@@ -181,18 +363,42 @@ def semantic_search_neighbors(lang, search_text, features, os_client, sort_param
     # query_result_df = pd.DataFrame(data=query_result,columns=["_id","_score","title",'uuid'])
     # return query_result_df
 
-    api_response = create_api_response_geojson(res, lang)
+    with timed(timings, "response_build"):
+        api_response = create_api_response_geojson(res, lang)
     #api_response = create_api_response(res)
     return api_response 
 
-def text_search_keywords(lang, payload, os_client, k=30,idx_name=model_name):
+def result_density(lang, search_text, features, os_client, grid, precision, k_neighbors=50, idx_name=model_name, filters=None, bbox=None, timings=None, must=None):
+    """
+    Density of the results of a semantic search: its query and filters with size 0 and a grid
+    aggregation over the record geometries (density.py). bbox is the parsed bbox filter, if any,
+    which also bounds the grid cells.
+    timings: optional dict that receives the search, opensearch_took and response_build timings (ms)
+    """
+    timings = timings if timings is not None else {}
+    filter_config = load_config()
+    query = build_semantic_query(lang, search_text, features, [], k_neighbors=k_neighbors, filters=filters, size=0,
+                                 filter_config=filter_config, must=must)
+    del query["sort"], query["from"]
+    query["aggs"] = {"density": density_aggregation(filter_config["bbox"][0], grid, precision, bbox=bbox)}
+
+    with timed(timings, "search"):
+        res = get_search_client(os_client).search(request_timeout=55, index=idx_name, body=query)
+    timings["opensearch_took"] = res.get("took")
+
+    with timed(timings, "response_build"):
+        api_response = create_density_response(res, grid, precision)
+    return api_response
+
+def text_search_keywords(lang, payload, os_client, k=30,idx_name=model_name, timings=None):
     """
     Keyword search of the payload string 
     """
+    timings = timings if timings is not None else {}
     search_body = {
         "size": k,
         "_source": {
-            "excludes": ["vector"]
+            "excludes": INTERNAL_SOURCE_FIELDS
         },
         "highlight": {
             "fields": {
@@ -207,10 +413,12 @@ def text_search_keywords(lang, payload, os_client, k=30,idx_name=model_name):
         }
     }
     
-    res = os_client.search(
-        request_timeout=55, 
-        index=idx_name,
-        body=search_body)
+    with timed(timings, "search"):
+        res = os_client.search(
+            request_timeout=55, 
+            index=idx_name,
+            body=search_body)
+    timings["opensearch_took"] = res.get("took")
     
     # query_result = [
     #     [hit['_id'], hit['_score'], hit['_source']['title'], hit['_source']['id']]
@@ -218,7 +426,8 @@ def text_search_keywords(lang, payload, os_client, k=30,idx_name=model_name):
     # query_result_df = pd.DataFrame(data=query_result,columns=["_id","_score","title",'uuid'])
     # return query_result_df
     
-    api_response = create_api_response_geojson(res, lang)
+    with timed(timings, "response_build"):
+        api_response = create_api_response_geojson(res, lang)
     return api_response 
 
 def add_to_top_of_dict(original_dict, key, value):
@@ -268,8 +477,7 @@ def create_api_response_geojson(search_results, lang):
     
     for count, hit in enumerate(search_results['hits']['hits'], start=1):
         try:
-            source_data = hit['_source'].copy()
-            source_data.pop('vector', None)
+            source_data = {key: value for key, value in hit['_source'].items() if key not in INTERNAL_SOURCE_FIELDS}
             source_data = add_to_top_of_dict(source_data, 'relevancy', hit.get('_score', ''))
             source_data = add_to_top_of_dict(source_data, 'row_num', count)
 
@@ -312,9 +520,12 @@ def load_config(file_path="filter_config.json"):
         "method": "$input.params('method')",
         "q": "$input.params('q')",
         "bbox": "$input.params('bbox')",
+        "zoom": "$input.params('zoom')",
+        "grid": "$input.params('grid')",
         "relation": "$input.params('relation')",
         "begin": "$input.params('begin')",
         "end": "$input.params('end')",
+        "temporal_relation": "$input.params('temporal_relation')",
         "org": "$input.params('org')",
         "type": "$input.params('type')",
         "protocol": "$input.params('protocol')",
@@ -340,126 +551,74 @@ def load_config(file_path="filter_config.json"):
     with open(file_path, "r") as file:
         return json.load(file)
     
-def lambda_handler(event, context):
-    """
-    /postText: Uses semantic search to find similar records based on vector similarity.
-    Other paths: Uses a direct keyword text match to find matched records .
-    """
-    #awsauth = get_awsauth_from_secret(region, secret_id=os_secret_id)
-    #print(awsauth)
+# Keyword filters of a search event; each event key is also its field list key in filter_config.json
+KEYWORD_FILTER_KEYS = ("org", "source_system", "theme", "topic_category", "type", "protocol", "mappable",
+                       "foundational", "eo_collection", "polarization", "orbit_direction")
 
-    credentials = boto3.Session().get_credentials()
-    awsauth = AWS4Auth(credentials.access_key, credentials.secret_key, region, 'es', session_token=credentials.token)
+# Request context copied from a batch request onto the analytics document of each of its queries
+REQUEST_CONTEXT_KEYS = ("method", "timestamp", "user_agent", "http_method", "ip_address", "ip_address_forward")
 
-    os_client = OpenSearch(
-        hosts=[{'host': aos_host, 'port': 443}],
-        http_auth=awsauth,
-        use_ssl=True,
-        verify_certs=True,
-        connection_class=RequestsHttpConnection
-    )
+batch_max_queries = int(environ.get('BATCH_MAX_QUERIES', '50'))
 
-    #print(event)
-    
-    k = 10
+def parse_search_params(event):
+    """
+    Query text, paging, sort and language of a search event, with the API defaults.
+    A search without query text is sorted by popularity.
+    """
     payload = event.get('q', '') or ''
-    if not payload:
-        event['sort'] = "popularity"
-    
-    # Debug event
-    #print("event", event)
-    
-    # Load filter config from filter_config.json
-    filter_config = load_config()
-
-    # Extract response variables
-    from_param = event.get('from', 0)
 
     # Validate 'from'
+    from_param = event.get('from', 0)
     if not from_param or not str(from_param).isdigit():
         from_param = 0
     else:
         from_param = int(from_param)
 
-    size = 10
     size_param = event.get('size', '')
-
-    if not size_param or not size_param.isdigit():
+    if not size_param or not str(size_param).isdigit():
         size = 10
     else:
         size = int(size_param)
-    sort_param = event.get('sort', "relevancy")
-    order_param = event.get('order', "desc")
 
     """ Language filter """
     lang_filter = event.get('lang', 'en')
     if not lang_filter:
         lang_filter = 'en'
 
+    return {
+        "q": payload,
+        "from": from_param,
+        "size": size,
+        "sort": event.get('sort', "relevancy") if payload else "popularity",
+        "order": event.get('order', "desc"),
+        "lang": lang_filter
+    }
+
+def build_filters_from_event(event, filter_config=None):
+    """
+    Keyword, temporal and spatial filters of a search event, with field paths from filter_config.json.
+    The temporal filter uses the date_range field of the "temporal" entry when there is one, falling
+    back to the begin and end fields for records without a range; else only the begin and end fields. Returns None if the event sets no filter. Raises ValueError for an
+    invalid bbox, date or relation.
+    """
+    filter_config = filter_config or load_config()
+    filters = []
+
     """ Keyword filters """
-    # Extract filters from the event input
-    organization_filter = event.get('org', None)
-    metadata_source_filter = event.get('source_system', None)
-    theme_filter = event.get('theme', None)
-    topicCategory_filter = event.get('topic_category', None)
-    type_filter = event.get('type', None)
-    protocol_filter = event.get('protocol', None)
-    mappable_filter = event.get('mappable', None)
-    foundational_filter = event.get('foundational', None)
-    eoCollection_filter = event.get('eo_collection', None)
-    polarization_filter = event.get('polarization', None)
-    orbit_direction_filter = event.get('orbit_direction', None)
+    for key in KEYWORD_FILTER_KEYS:
+        if event.get(key):
+            filters.append(build_wildcard_filter(filter_config[key], event[key]))
 
     """ Temporal filters """
     start_date_filter = event.get('begin', None)
     end_date_filter = event.get('end', None)
-
-    """ Spatial filters """
-    spatial_filter = event.get('bbox', None)
-    relation = event.get('relation', None)
-
-    # Convert filter string into list (handle multi-selection of filters) 
-    #organization_list = [org.strip() for org in organization_filter.split(",")]
-    
-
-    filters = []
-    """ Keyword filters """
-    if organization_filter:
-        organization_field = filter_config["org"]  # Get field paths from config
-        filters.append(build_wildcard_filter(organization_field, organization_filter))
-    if metadata_source_filter:
-        source_system_field = filter_config["source_system"]  # Get field paths from config
-        filters.append(build_wildcard_filter(source_system_field, metadata_source_filter))
-    if theme_filter:
-        theme_field = filter_config["theme"]  # Get field paths from config
-        filters.append(build_wildcard_filter(theme_field, theme_filter))
-    if topicCategory_filter:
-        topicCategory_field = filter_config["topic_category"]  # Get field paths from config
-        filters.append(build_wildcard_filter(topicCategory_field, topicCategory_filter))
-    if type_filter:
-        type_field = filter_config["type"]  # Get field paths from config
-        filters.append(build_wildcard_filter(type_field, type_filter))
-    if protocol_filter:
-        protocol_field = filter_config["protocol"]  # Get field paths from config
-        filters.append(build_wildcard_filter(protocol_field, protocol_filter))
-    if mappable_filter:
-        mappable_field = filter_config["mappable"]  # Get field paths from config
-        filters.append(build_wildcard_filter(mappable_field, mappable_filter))
-    if foundational_filter:
-        foundational_field = filter_config["foundational"]  # Get field paths from config
-        filters.append(build_wildcard_filter(foundational_field, foundational_filter))
-    if eoCollection_filter:
-        eo_collection_field = filter_config["eo_collection"]  # Get field paths from config
-        filters.append(build_wildcard_filter(eo_collection_field, eoCollection_filter))
-    if polarization_filter:
-        polarization_field = filter_config["polarization"]  # Get field paths from config
-        filters.append(build_wildcard_filter(polarization_field, polarization_filter))
-    if orbit_direction_filter:
-        orbit_direction_field = filter_config["orbit_direction"]  # Get field paths from config
-        filters.append(build_wildcard_filter(orbit_direction_field, orbit_direction_filter))
-   
-    """ Temporal filters """
-    if start_date_filter and end_date_filter:
+    if (start_date_filter or end_date_filter) and filter_config.get("temporal"):
+        # One range query on the date_range field normalized at ingest
+        filters.extend(build_temporal_range_filter(filter_config["temporal"][0], start_date=start_date_filter,
+                                                   end_date=end_date_filter, relation=event.get('temporal_relation') or None,
+                                                   begin_field=filter_config.get("begin", [None])[0],
+                                                   end_field=filter_config.get("end", [None])[0]))
+    elif start_date_filter and end_date_filter:
         begin_field = filter_config["begin"][0]
         end_field = filter_config["end"][0]
         filters.extend(build_date_filter(begin_field, end_field, start_date=start_date_filter, end_date=end_date_filter))
@@ -469,101 +628,303 @@ def lambda_handler(event, context):
     elif end_date_filter:
         end_field = filter_config["end"][0]
         filters.extend(build_date_filter(end_field, end_date=end_date_filter))
-    
+
     """ Spatial filters """
+    spatial_filter = event.get('bbox', None)
     if spatial_filter:
         spatial_field = filter_config["bbox"][0]
-        filters.append(build_spatial_filter(spatial_field, spatial_filter, relation))
-    
-    # Sort param
-    sort_param_final = build_sort_filter(lang_filter, sort_field=sort_param, sort_order=order_param)
-    
+        extent_field = filter_config.get("extent", [None])[0]
+        filters.append(build_spatial_filter(spatial_field, spatial_filter, event.get('relation', None), extent_field=extent_field))
+
     # If no filters are specified, set filters to None
-    filters = filters if filters else None
+    return filters if filters else None
 
-    #print("filters : ", filters)
+def client_ip_address(event):
+    """Client IP of the request: the first X-Forwarded-For address if there is one."""
+    ip_address = event.get('ip_address', '') or ''
+    ip_address_forward = event.get('ip_address_forward', '') or ''
+    if ip_address_forward:
+        ip_address = ip_address_forward.split(',')[0].strip() #Use first forwarded IP address if it exists
+    return ip_address
+
+def build_analytics_document(event, params, ip2geo_data, total_hits, timings):
+    """
+    Analytics document of one search, written to the analytics index for the dashboards.
+    """
+    return {
+        "timestamp": event.get('timestamp', '') or '',
+        "lang": params["lang"],
+        "q": params["q"],
+        "user_agent": event.get('user_agent', '') or '',
+        "http_method": event.get('http_method', '') or '',
+        "sort_param": params["sort"],
+        "order_param": params["order"],
+        "organization_filter": event.get('org', None),
+        "metadata_source_filter": event.get('source_system', None),
+        "theme_filter": event.get('theme', None),
+        "topicCategory_filter": event.get('topic_category', None),
+        "type_filter": event.get('type', None),
+        "protocol_filter": event.get('protocol', None),
+        "mappable_filter": event.get('mappable', None),
+        "foundational_filter": event.get('foundational', None),
+        "eo_collection_filter": event.get('eo_collection', None),
+        "polarization_filter": event.get('polarization', None),
+        "orbit_direction_filter": event.get('orbit_direction', None),
+        # Raw request values, kept for replay (loadtest.py); start_date_filter, end_date_filter and spatial_filter stay unset
+        "begin_filter": event.get('begin', None),
+        "end_filter": event.get('end', None),
+        "bbox_filter": event.get('bbox', None),
+        "relation": event.get('relation', None),
+        "temporal_relation": event.get('temporal_relation', None),
+        "size": params["size"],
+        "from": params["from"],
+        "ip2geo": ip2geo_data,
+        "method": event.get('method'),
+        "route": params.get("route"),
+        "total_hits": total_hits,
+        "timings": timings
+    }
+
+def batch_queries_from_event(event):
+    """
+    Query objects of a BatchSemanticSearch request: event['queries'], or the request body as a
+    JSON list or {"queries": [...]}. Each object takes the same keys as a single search event.
+    Raises ValueError if the list is missing, malformed or longer than BATCH_MAX_QUERIES.
+    """
+    queries = event.get('queries')
+    if queries is None and event.get('body'):
+        body = json.loads(event['body']) if isinstance(event['body'], str) else event['body']
+        queries = body.get('queries') if isinstance(body, dict) else body
+    if isinstance(queries, str):
+        queries = json.loads(queries)
+    if not isinstance(queries, list) or not queries or not all(isinstance(query, dict) for query in queries):
+        raise ValueError("BatchSemanticSearch expects a non-empty list of query objects in 'queries'")
+    if len(queries) > batch_max_queries:
+        raise ValueError(f"BatchSemanticSearch accepts at most {batch_max_queries} queries, got {len(queries)}")
+    return queries
+
+def batch_semantic_search(queries, os_client, k_neighbors=10, idx_name=model_name, timings=None, refresh_embeddings=False, params=None):
+    """
+    Run several semantic searches with one encoder call and one _msearch request.
+
+    Args:
+        queries (list): Query objects with the keys of a single search event (q, filters, sort, size, from, lang).
+        params (list): parse_search_params of each query, computed here if not given; each gets its route.
+
+    Returns:
+        list: One create_api_response_geojson result per query, in order; {"error": ...} for
+              a query whose filters are invalid or whose search failed.
+    """
+    timings = timings if timings is not None else {}
+    filter_config = search_filter_config(os_client)
+    params = params if params is not None else [parse_search_params(query) for query in queries]
+    clauses = []
+    for query_params in params:
+        query_params["route"], clause = route_query(query_params["q"], routes=available_routes())
+        clauses.append(clause)
+
+    # Every distinct non-empty query text routed to semantic search is embedded once, in a single encoder call
+    texts = list(dict.fromkeys(p["q"] for p in params if p["q"] and p["route"] == "semantic"))
+    with timed(timings, "embedding"):
+        vectors = get_embeddings(texts, lambda batch: invoke_sagemaker_endpoint_batch(sagemaker_endpoint, batch, region),
+                                 os_client, refresh=refresh_embeddings, dimension=vector_dimension(os_client)) if texts else []
+    features_by_text = dict(zip(texts, vectors))
+
+    results = [None] * len(queries)
+    searches, positions = [], []
+    for position, (query, query_params, clause) in enumerate(zip(queries, params, clauses)):
+        try:
+            body = build_semantic_query(
+                query_params["lang"], query_params["q"], features_by_text.get(query_params["q"]) if clause is None else None,
+                build_sort_filter(query_params["lang"], sort_field=query_params["sort"], sort_order=query_params["order"]),
+                k_neighbors=k_neighbors, from_param=query_params["from"], filters=build_filters_from_event(query, filter_config),
+                size=query_params["size"], filter_config=filter_config, must=clause)
+        except ValueError as e:
+            results[position] = {"error": str(e)}
+            continue
+        # A query sorted like the index takes two lines: its early terminating hits request and its total/facets request
+        split = sorted_like_index(body["sort"])
+        searches.extend(split_index_sorted_query(body, idx_name) if split else [{"index": idx_name}, body])
+        positions.append((position, split))
+
+    if searches:
+        with timed(timings, "search"):
+            res = get_search_client(os_client).msearch(body=searches, request_timeout=55)
+        timings["opensearch_took"] = res.get("took")
+
+        with timed(timings, "response_build"):
+            responses = iter(res.get("responses", []))
+            for position, split in positions:
+                search_results = [next(responses), next(responses)] if split else [next(responses)]
+                errors = [search_result["error"] for search_result in search_results if "error" in search_result]
+                if errors:
+                    results[position] = {"error": errors[0]}
+                else:
+                    search_result = merge_index_sorted_responses(*search_results) if split else search_results[0]
+                    results[position] = create_api_response_geojson(search_result, params[position]["lang"])
+    return results
+
+def lambda_handler(event, context):
+    """
+    /postText: Uses semantic search to find similar records based on vector similarity.
+    BatchSemanticSearch: Runs a list of semantic searches with one encoder call and one _msearch.
+    ResultDensity: Counts the results of a semantic search per map grid cell (density.py).
+    Other paths: Uses a direct keyword text match to find matched records .
+    """
+    #awsauth = get_awsauth_from_secret(region, secret_id=os_secret_id)
+    #print(awsauth)
+
+    # Per-phase timings (ms), recorded in the analytics document and emitted as metrics
+    timings = {}
+    request_start = time.perf_counter()
+
+    with timed(timings, "setup"):
+        os_client = get_os_client()
+
+    analytics_index = prepare_analytics_index(os_client, search_index_name)
+
+    # Geolocation only feeds the analytics document: run it while the query is embedded and searched
+    ip_address = client_ip_address(event)
+    def timed_ip2geo():
+        with timed(timings, "ip2geo"):
+            return ip2geo_handler(os_client, ip_address)
+    ip2geo_future = executor.submit(timed_ip2geo)
+
+    k = 10
+
+    if event['method'] == 'BatchSemanticSearch':
+        try:
+            queries = batch_queries_from_event(event)
+        except ValueError as e:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": str(e)})
+            }
+        batch_params = [parse_search_params(query) for query in queries]
+        search_responses = batch_semantic_search(queries, os_client, k_neighbors=k, idx_name=model_name, timings=timings,
+                                                 refresh_embeddings=bool(event.get('refresh_embeddings')), params=batch_params)
+        response = {
+            "method": "BatchSemanticSearch",
+            "responses": search_responses
+        }
+        # One analytics document per query, carrying the request context of the batch
+        logged = [(dict(query, **{key: event.get(key) for key in REQUEST_CONTEXT_KEYS}), query_params, search_response)
+                  for query, query_params, search_response in zip(queries, batch_params, search_responses)]
+    else:
+        params = parse_search_params(event)
+        payload = params["q"]
+        if event['method'] == 'postText':
+            payload = params["q"] = json.loads(event['body'])['text']
+
+        if event['method'] == 'ResultDensity' and search_backend == 'local':
+            # The local index only computes terms aggregations, not the density grids
+            return {
+                "statusCode": 501,
+                "body": json.dumps({"error": "ResultDensity is not available with the local search backend"})
+            }
+
+        # Keyword, temporal and spatial filters, and the density grid: malformed parameters are a client error
+        try:
+            filters = build_filters_from_event(event, search_filter_config(os_client))
+            if event['method'] == 'ResultDensity':
+                density_params = parse_density_params(event)
+                bbox = parse_bbox(event['bbox']) if event.get('bbox') else None
+        except ValueError as e:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": str(e)})
+            }
+
+        # Sort param
+        sort_param_final = build_sort_filter(params["lang"], sort_field=params["sort"], sort_order=params["order"])
+
+        if event['method'] in ('SemanticSearch', 'ResultDensity'):
+            # Identifier and exact-match queries skip the encoder and the k-NN clause, and so do browse queries (no q)
+            params["route"], clause = route_query(payload, routes=available_routes())
+            features = None
+            if clause is None and payload:
+                with timed(timings, "embedding"):
+                    features = get_embedding(payload, lambda text: invoke_sagemaker_endpoint(sagemaker_endpoint, text, region),
+                                             os_client, refresh=bool(event.get('refresh_embeddings')),
+                                             dimension=vector_dimension(os_client))
+
+        if event['method'] == 'ResultDensity':
+            search_response = result_density(
+                lang=params["lang"],
+                search_text=payload,
+                features=features,
+                os_client=os_client,
+                grid=density_params["grid"],
+                precision=density_params["precision"],
+                k_neighbors=k,
+                idx_name=model_name,
+                filters=filters,
+                bbox=bbox,
+                timings=timings,
+                must=clause
+            )
+
+            response = {
+                "method": "ResultDensity",
+                "response": search_response
+            }
+        elif event['method'] == 'SemanticSearch':
+            search_response = semantic_search_neighbors(
+                lang=params["lang"],
+                search_text=payload,
+                features=features,
+                os_client=os_client,
+                k_neighbors=k,
+                from_param=params["from"],
+                idx_name=model_name,
+                filters=filters,
+                sort_param=sort_param_final,
+                size=params["size"],
+                timings=timings,
+                must=clause
+            )
+
+            response = {
+                "method": "SemanticSearch", 
+                "response": search_response
+            }         
+        else:
+            search_response = text_search_keywords(params["lang"], payload, os_client, k, idx_name=model_name, timings=timings)
+
+            response = {
+                "statusCode": 200,
+                "body": json.dumps({"keyword_response": search_response}),
+            }
+        logged = [(event, params, search_response)]
+
+    ip2geo_data = ip2geo_future.result()
+    timings["total"] = round((time.perf_counter() - request_start) * 1000, 3)
+    total_hits = sum(search_response.get("total_hits", 0) for _, _, search_response in logged)
+
+    # Warmup requests (warmup.py) prime the caches without counting as user traffic
+    if event.get('warmup'):
+        return response
 
     ####
     #OpenSearch DashBoard code
     ####
-    ip_address = event.get('ip_address', '') or ''
-    #print("ip_address", ip_address)
-    ip_address_forward = event.get('ip_address_forward', '') or ''
-    #print("ip_address_forward", ip_address_forward)
-    if ip_address_forward:
-        ip_address = ip_address_forward.split(',')[0].strip() #Use first forwarded IP address if it exists   
-    #print("final ip", ip_address)
-    timestamp = event.get('timestamp', '') or ''
-    user_agent = event.get('user_agent', '') or ''
-    http_method = event.get('http_method', '') or ''
-
-    create_opensearch_index(os_client, search_index_name)
-    ip2geo_data = {}
-    ip2geo_data = ip2geo_handler(os_client, ip_address)
     document = [
-        {
-            "timestamp": timestamp,
-            "lang": lang_filter,
-            "q": payload,
-            "user_agent": user_agent,
-            "http_method": http_method,
-            "sort_param": sort_param,
-            "order_param": order_param,
-            "organization_filter": organization_filter,
-            "metadata_source_filter": metadata_source_filter,
-            "theme_filter": theme_filter,
-            "topicCategory_filter": topicCategory_filter,
-            "type_filter": type_filter,
-            "protocol_filter": protocol_filter,
-            "mappable_filter": mappable_filter,
-            #"start_date_filter": start_date_filter,
-            #"end_date_filter": end_date_filter,
-            #"spatial_filter": spatial_filter,
-            "relation": relation,
-            "size": size,
-            "from": from_param,
-            "ip2geo": ip2geo_data
-        }
+        build_analytics_document(logged_event, logged_params, ip2geo_data, search_response.get("total_hits", 0), timings)
+        for logged_event, logged_params, search_response in logged
     ]
 
     print(f"Document to be indexed: {document}")
     
-    save_to_opensearch(os_client, search_index_name, document)
+    with timed(timings, "analytics_write"):
+        save_to_opensearch(os_client, analytics_index, document)
 
-    ### End of OpenSearch DashBoard code
+    emit_metrics(timings, dimensions={"method": event.get('method') or "KeywordSearch"},
+                 counts={"total_hits": total_hits, "queries": len(logged),
+                         "routed_queries": sum(logged_params.get("route", "semantic") != "semantic" for _, logged_params, _ in logged)})
 
-    if event['method'] == 'postText':
-        payload = json.loads(event['body'])['text']
-    
-    if event['method'] == 'SemanticSearch':
-        #print(f'This is payload {payload}')
-        
-        features = invoke_sagemaker_endpoint(sagemaker_endpoint, payload, region)
-       
-        semantic_search = semantic_search_neighbors(
-            lang=lang_filter,
-            search_text=payload,
-            features=features,
-            os_client=os_client,
-            k_neighbors=k,
-            from_param=from_param,
-            idx_name=model_name,
-            filters=filters,
-            sort_param=sort_param_final,
-            size=size            
-        )
-        
-        return {
-            "method": "SemanticSearch", 
-            "response": semantic_search
-        }         
-    else:
-        search = text_search_keywords(lang_filter, payload, os_client, k, idx_name=model_name)
+    ### End of OpenSearch DashBoard code
 
-        return {
-            "statusCode": 200,
-            "body": json.dumps({"keyword_response": search}),
-        }
+    return response
 
 def language_config(uuid):
     url = f"https://geocore.api.geo.ca/id/v2?lang=fr&id={uuid}"
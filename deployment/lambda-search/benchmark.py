@@ -0,0 +1,374 @@
+"""
+Offline benchmark of lambda-search's lambda_handler.
+
+Drives the handler with a corpus of events (benchmark_events.json) against an in-process fake
+OpenSearch transport (recorded or synthetic responses, configurable latency per operation) and a
+fake encoder standing in for the SageMaker endpoint. No AWS access is needed.
+
+Reports per-phase p50/p95/p99 timings (the phases lambda_handler records), handler wall time,
+backend requests per call and, with --memory, peak Python allocations per call (tracemalloc).
+
+Usage:
+    python benchmark.py --iterations 20 --latency search=40,bulk=10,simulate=5 --encoder_latency 60
+    python benchmark.py --responses recorded_responses.json --cold --memory --json results.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tracemalloc
+import contextlib
+from collections import Counter, defaultdict
+
+# lambda-search reads its configuration from the environment at import time
+BENCHMARK_ENVIRONMENT = {
+    'MY_AWS_REGION': 'ca-central-1',
+    'OS_ENDPOINT': 'benchmark.local',
+    'SAGEMAKER_ENDPOINT': 'benchmark-endpoint',
+    'OS_SECRET_ID': 'benchmark',
+    'MODEL_NAME': 'benchmark-index',
+    'NEW_INDEX_NAME': 'benchmark-analytics',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+}
+
+# Default simulated latency of each backend operation, in milliseconds
+DEFAULT_LATENCY_MS = {'search': 40, 'msearch': 60, 'bulk': 10, 'simulate': 5, 'get': 3, 'index': 5, 'exists': 2, 'template': 5, 'mapping': 3, 'other': 2}
+
+def load_app():
+    """
+    Import lambda-search with the benchmark environment (real values already set are kept).
+    The working directory becomes the package directory, like the Lambda task root, since
+    filter_config.json is opened by relative path.
+    """
+    for key, value in BENCHMARK_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(here)
+    sys.path.insert(0, here)
+    import app
+    return app
+
+def classify_request(method, url):
+    """Backend operation of an OpenSearch HTTP request, as counted and delayed by the fake transport."""
+    if '_msearch' in url:
+        return 'msearch'
+    if '_search' in url:
+        return 'search'
+    if '_bulk' in url:
+        return 'bulk'
+    if url.endswith('_simulate'):
+        return 'simulate'
+    if '/_mapping/' in url:
+        return 'mapping'
+    if '_index_template' in url:
+        return 'template'
+    if method == 'HEAD':
+        return 'exists'
+    if '/_doc/' in url:
+        return 'get' if method == 'GET' else 'index'
+    return 'other'
+
+def synthetic_search_response(hits=10, dimension=768, seed=0):
+    """Search response shaped like the k-NN index's: stored vectors, polygon footprints and facet buckets."""
+    rng = random.Random(seed)
+    buckets = [{"key": f"value-{i}", "doc_count": rng.randint(1, 500)} for i in range(20)]
+    return {
+        "took": 12,
+        "timed_out": False,
+        "hits": {
+            "total": {"value": 1234, "relation": "eq"},
+            "max_score": 1.0,
+            "hits": [{
+                "_index": "benchmark-index",
+                "_id": f"record-{i}",
+                "_score": round(1.0 - i * 0.01, 4),
+                "_source": {
+                    "id": f"record-{i}",
+                    "title_en": f"Benchmark record {i}",
+                    "title_fr": f"Enregistrement {i}",
+                    "description_en": "Lorem ipsum dolor sit amet " * 20,
+                    "keywords_en": "wildfire, flood, elevation",
+                    "organisation_en": "Natural Resources Canada",
+                    "popularity": rng.randint(0, 1000),
+                    "coordinates": {"type": "Polygon", "coordinates": [[[-80.0, 43.0], [-78.0, 43.0], [-78.0, 45.0], [-80.0, 45.0], [-80.0, 43.0]]]},
+                    "vector": [round(rng.uniform(-1, 1), 6) for _ in range(dimension)]
+                }
+            } for i in range(hits)]
+        },
+        "aggregations": {name: {"buckets": buckets} for name in
+                         ["unique_mappable", "unique_protocol", "unique_org", "unique_source_system",
+                          "unique_eo_collection", "unique_topic_category", "unique_theme"]}
+    }
+
+class FakeBackend:
+    """
+    Recorded responses, latencies and request counts shared by every fake transport connection.
+
+    responses maps an operation (see classify_request) to the response body returned for it.
+    """
+    def __init__(self, responses=None, latency_ms=None):
+        self.responses = {
+            'search': synthetic_search_response(),
+            'simulate': {"docs": [{"doc": {"_source": {"ip2geo": {"country_iso_code": "CA", "country_name": "Canada", "location": "45.42,-75.69"}}}}]},
+            'bulk': {"took": 3, "errors": False, "items": []},
+            'get': {"found": False},
+            'index': {"result": "created"},
+            'template': {"acknowledged": True},
+            # Every requested field is mapped, so filters on fields added by later index builds are enabled,
+            # and the vectors have the dimension of FakeEncoder
+            'mapping': {"benchmark-index": {"mappings": {
+                "field": {"full_name": "field", "mapping": {}},
+                "vector": {"full_name": "vector", "mapping": {"vector": {"type": "knn_vector", "dimension": 768}}}}}},
+            'other': {"acknowledged": True},
+        }
+        self.responses.update(responses or {})
+        self.latency_ms = dict(DEFAULT_LATENCY_MS)
+        self.latency_ms.update(latency_ms or {})
+        self.counts = Counter()
+
+    def respond(self, method, url, body):
+        operation = classify_request(method, url)
+        self.counts[operation] += 1
+        time.sleep(self.latency_ms.get(operation, 0) / 1000)
+
+        if operation == 'exists':
+            return 200, ''
+        if operation == 'msearch':
+            n_searches = len([line for line in (body or b'').splitlines() if line.strip()]) // 2
+            return 200, json.dumps({"took": 20, "responses": [self.responses['search']] * n_searches})
+        if operation == 'bulk':
+            n_actions = len([line for line in (body or b'').splitlines() if line.strip()]) // 2
+            return 200, json.dumps(dict(self.responses['bulk'], items=[{"index": {"status": 201}}] * n_actions))
+        if operation == 'get' and not self.responses['get'].get('found'):
+            return 404, json.dumps(self.responses['get'])
+        return 200, json.dumps(self.responses[operation])
+
+def fake_connection_class(backend):
+    """opensearchpy Connection subclass answering every request from backend."""
+    from opensearchpy import Connection
+    from opensearchpy.exceptions import HTTP_EXCEPTIONS, TransportError
+
+    class FakeConnection(Connection):
+        def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None):
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            status, raw = backend.respond(method, url, body)
+            if not (200 <= status < 300) and status not in ignore:
+                raise HTTP_EXCEPTIONS.get(status, TransportError)(status, raw, json.loads(raw) if raw else {})
+            return status, {}, raw
+
+    return FakeConnection
+
+class FakeEncoder:
+    """
+    Stand-in for invoke_sagemaker_endpoint: a deterministic unit vector per text after latency_ms.
+    Lists of texts (batch payloads) get one vector per text.
+    """
+    def __init__(self, dimension=768, latency_ms=50):
+        self.dimension = dimension
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self.texts = 0
+
+    def embed(self, text):
+        rng = random.Random(hashlib.sha1(str(text).encode('utf-8')).hexdigest())
+        vector = [rng.gauss(0, 1) for _ in range(self.dimension)]
+        norm = sum(v * v for v in vector) ** 0.5
+        return [v / norm for v in vector]
+
+    def __call__(self, sagemaker_endpoint, payload, region):
+        self.calls += 1
+        time.sleep(self.latency_ms / 1000)
+        if isinstance(payload, list):
+            self.texts += len(payload)
+            return [self.embed(text) for text in payload]
+        self.texts += 1
+        return self.embed(payload)
+
+def install_fakes(app, backend, encoder):
+    """
+    Point lambda-search at the fake backend and encoder, and capture the per-request timings
+    lambda_handler passes to emit_metrics. Returns the list the timings are appended to.
+    """
+    connection_class = fake_connection_class(backend)
+    real_opensearch = app.OpenSearch
+    app.OpenSearch = lambda **kwargs: real_opensearch(hosts=[{'host': 'benchmark.local', 'port': 443}], connection_class=connection_class)
+    app._os_client = None
+    app.invoke_sagemaker_endpoint = encoder
+    app.invoke_sagemaker_endpoint_batch = lambda sagemaker_endpoint, texts, region: encoder(sagemaker_endpoint, list(texts), region)
+
+    recorded_timings = []
+    def record_metrics(timings, dimensions, counts=None, namespace=None):
+        recorded_timings.append(dict(timings))
+    app.emit_metrics = record_metrics
+    return recorded_timings
+
+def clear_caches():
+    """Empty the in-process caches so every request pays for a cold container."""
+    import app
+    import geoip
+    import embedding_cache
+    geoip._cache.clear()
+    embedding_cache._cache.clear()
+    app._mapped_fields.clear()
+    app._vector_dimension.clear()
+
+def percentile(values, q):
+    """Linear interpolation percentile (q in 0-100) of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "max": max(samples) if samples else None,
+    }
+
+def run_handler(app, event):
+    """Call lambda_handler on a copy of event with its prints silenced; returns (wall ms, error or None)."""
+    start = time.perf_counter()
+    error = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            app.lambda_handler(json.loads(json.dumps(event)), None)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    return (time.perf_counter() - start) * 1000, error
+
+def run_benchmark(events, iterations=20, warmup=2, latency_ms=None, encoder_latency_ms=50, responses=None, cold=False, memory=False, seed=0):
+    """
+    Run every event `iterations` times (after `warmup` untimed rounds) and collect the results.
+
+    Returns:
+        dict: phases (per-phase summaries), wall (handler wall time summary), requests_per_call,
+              encoder calls, errors and, with memory=True, peak allocation summary in KiB.
+    """
+    app = load_app()
+    backend = FakeBackend(responses=responses, latency_ms=latency_ms)
+    encoder = FakeEncoder(latency_ms=encoder_latency_ms)
+    recorded_timings = install_fakes(app, backend, encoder)
+    rng = random.Random(seed)
+
+    for _ in range(warmup):
+        for event in events:
+            run_handler(app, event)
+
+    recorded_timings.clear()
+    backend.counts.clear()
+    encoder.calls = encoder.texts = 0
+    wall, errors = [], Counter()
+    calls = 0
+    for _ in range(iterations):
+        order = list(events)
+        rng.shuffle(order)
+        for event in order:
+            if cold:
+                clear_caches()
+            elapsed, error = run_handler(app, event)
+            calls += 1
+            wall.append(elapsed)
+            if error:
+                errors[error] += 1
+
+    phases = defaultdict(list)
+    for timings in recorded_timings:
+        for phase, value in timings.items():
+            if value is not None:
+                phases[phase].append(value)
+
+    results = {
+        "calls": calls,
+        "phases": {phase: summarize(values) for phase, values in phases.items()},
+        "wall": summarize(wall),
+        "requests_per_call": {operation: count / calls for operation, count in sorted(backend.counts.items())},
+        "encoder": {"calls_per_call": encoder.calls / calls, "texts_per_call": encoder.texts / calls},
+        "errors": dict(errors),
+    }
+
+    if memory:
+        # Separate pass: tracemalloc slows every allocation down and would skew the timings above
+        peaks = []
+        tracemalloc.start()
+        for event in events:
+            if cold:
+                clear_caches()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            run_handler(app, event)
+            peaks.append((tracemalloc.get_traced_memory()[1] - baseline) / 1024)
+        tracemalloc.stop()
+        results["peak_alloc_kib"] = summarize(peaks)
+
+    return results
+
+def print_report(results):
+    print(f"{results['calls']} handler calls")
+    print(f"\n{'phase':<18} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'n':>6}")
+    rows = sorted(results['phases'].items()) + [("handler wall", results['wall'])]
+    for phase, summary in rows:
+        print(f"{phase:<18} {summary['p50']:>9.2f} {summary['p95']:>9.2f} {summary['p99']:>9.2f} {summary['max']:>9.2f} {summary['count']:>6}")
+
+    print(f"\n{'backend requests':<18} {'per call':>9}")
+    for operation, per_call in results['requests_per_call'].items():
+        print(f"{operation:<18} {per_call:>9.2f}")
+    print(f"{'encoder calls':<18} {results['encoder']['calls_per_call']:>9.2f}")
+    print(f"{'encoded texts':<18} {results['encoder']['texts_per_call']:>9.2f}")
+
+    if 'peak_alloc_kib' in results:
+        alloc = results['peak_alloc_kib']
+        print(f"\npeak allocations per call: p50 {alloc['p50']:.0f} KiB, p95 {alloc['p95']:.0f} KiB, max {alloc['max']:.0f} KiB")
+    if results['errors']:
+        print("\nerrors:")
+        for error, count in results['errors'].items():
+            print(f"  {count:>5} x {error}")
+
+def parse_latency(value):
+    """'search=40,bulk=10' -> {'search': 40.0, 'bulk': 10.0}"""
+    latency = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        operation, _, ms = item.partition('=')
+        latency[operation.strip()] = float(ms)
+    return latency
+
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Benchmark lambda-search lambda_handler offline.')
+    parser.add_argument('--events', type=str, default=os.path.join(here, 'benchmark_events.json'), help='JSON list of handler events')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed passes over the event corpus')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed passes before measuring')
+    parser.add_argument('--latency', type=str, default='', help='Backend latency per operation in ms, e.g. search=40,bulk=10,simulate=5')
+    parser.add_argument('--encoder_latency', type=float, default=50, help='Fake encoder latency in ms')
+    parser.add_argument('--responses', type=str, default=None, help='JSON file of recorded responses keyed by operation (search, simulate, bulk, get)')
+    parser.add_argument('--cold', action='store_true', help='Clear the in-process caches before every call')
+    parser.add_argument('--memory', action='store_true', help='Measure peak allocations per call with tracemalloc')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the event order')
+    parser.add_argument('--json', type=str, default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    with open(args.events) as file:
+        events = json.load(file)
+    responses = None
+    if args.responses:
+        with open(args.responses) as file:
+            responses = json.load(file)
+
+    results = run_benchmark(events, iterations=args.iterations, warmup=args.warmup, latency_ms=parse_latency(args.latency),
+                            encoder_latency_ms=args.encoder_latency, responses=responses, cold=args.cold,
+                            memory=args.memory, seed=args.seed)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
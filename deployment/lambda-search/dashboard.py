@@ -1,4 +1,8 @@
 import json
+from os import environ
+from datetime import datetime
+from opensearchpy import helpers, exceptions
+from geoip import cached_lookup, get_local_provider
 
 def parse_geo_point(ip2geo_data):
     if 'location' in ip2geo_data and isinstance(ip2geo_data['location'], str):
@@ -10,8 +14,11 @@ def parse_geo_point(ip2geo_data):
             ip2geo_data['location'] = None  # Handle errors gracefully
     return ip2geo_data
 
-def ip2geo_handler(os_client, ip_address):
-    
+def simulate_ip2geo(os_client, ip_address):
+    """
+    Geolocate ip_address by running the ip-to-geo ingest pipeline through the _simulate API.
+    Returns None if the cluster response cannot be read.
+    """
     ip2geo_payload = {
         "docs": [
             {
@@ -24,63 +31,117 @@ def ip2geo_handler(os_client, ip_address):
         ]
     }
 
-    response = os_client.transport.perform_request(
-        method="POST",
-        url="/_ingest/pipeline/ip-to-geo-pipeline/_simulate",
-        body=json.dumps(ip2geo_payload)
-    )
-
-    ip2geo_data = {}
-
     try:
+        response = os_client.transport.perform_request(
+            method="POST",
+            url="/_ingest/pipeline/ip-to-geo-pipeline/_simulate",
+            body=json.dumps(ip2geo_payload)
+        )
         ip2geo_data = response["docs"][0]["doc"]["_source"].get("ip2geo", {})
-        ip2geo_data = parse_geo_point(ip2geo_data) #ensure lat lon is a geo_point
-    except (KeyError, json.JSONDecodeError) as e:
+        return parse_geo_point(ip2geo_data) #ensure lat lon is a geo_point
+    except (KeyError, json.JSONDecodeError, exceptions.OpenSearchException) as e:
         print("Error extracting ip2geo data:", str(e))
-    
-    return ip2geo_data
+        return None
+
+def ip2geo_handler(os_client, ip_address):
+    """
+    Geolocate the client IP: the local database (IP2GEO_DATABASE) first, the ingest pipeline
+    _simulate API as fallback, both behind an LRU cache so repeat clients cost no cluster call.
+    """
+    providers = [lambda ip: simulate_ip2geo(os_client, ip)]
+    local_provider = get_local_provider()
+    if local_provider is not None:
+        providers.insert(0, local_provider)
+    return cached_lookup(ip_address, providers)
 
 
-def create_opensearch_index(os_client, index_name):
-    """Create a new OpenSearch index if it doesn't exist."""
-    if not os_client.indices.exists(index=index_name):
-        # Define the mapping for the new index
-        index_body = {
-            "mappings": {
-                "properties": {
-                    "timestamp": {"type": "date"},
-                    "lang": {"type": "keyword"},
-                    "id": {"type": "keyword"},
-                    "q": {"type": "keyword"},
-                    "user_agent": {"type": "keyword"},
-                    "http_method": {"type": "keyword"},
-                    "sort_param": {"type": "keyword"},
-                    "order_param": {"type": "keyword"},
-                    "organization_filter": {"type": "keyword"},
-                    "metadata_source_filter": {"type": "keyword"},
-                    "theme_filter": {"type": "keyword"},
-                    "type_filter": {"type": "keyword"},
-                    "start_date_filter": {"type": "date", "null_value": "1970-01-01T00:00:00.000Z"},
-                    "end_date_filter": {"type": "date", "null_value": "1970-01-01T00:00:00.000Z"},
-                    "spatial_filter": {"type": "geo_shape"},
-                    "relation": {"type": "keyword"},
-                    "size": {"type": "keyword"},
-                    "ip2geo": {
-                        "properties": {
-                            "continent_name": {"type": "keyword"},
-                            "region_iso_code": {"type": "keyword"},
-                            "city_name": {"type": "keyword"},
-                            "country_iso_code": {"type": "keyword"},
-                            "country_name": {"type": "keyword"},
-                            "region_name": {"type": "keyword"},
-                            "location": {"type": "geo_point"},
-                            "time_zone": {"type": "keyword"}
-                        }
-                    }
-                }
+# Mapping of the search analytics documents, shared by the legacy single index and the index template
+ANALYTICS_MAPPINGS = {
+    "properties": {
+        "timestamp": {"type": "date"},
+        "lang": {"type": "keyword"},
+        "id": {"type": "keyword"},
+        "q": {"type": "keyword"},
+        "user_agent": {"type": "keyword"},
+        "http_method": {"type": "keyword"},
+        "sort_param": {"type": "keyword"},
+        "order_param": {"type": "keyword"},
+        "organization_filter": {"type": "keyword"},
+        "metadata_source_filter": {"type": "keyword"},
+        "theme_filter": {"type": "keyword"},
+        "type_filter": {"type": "keyword"},
+        "topicCategory_filter": {"type": "keyword"},
+        "protocol_filter": {"type": "keyword"},
+        "mappable_filter": {"type": "keyword"},
+        "start_date_filter": {"type": "date", "null_value": "1970-01-01T00:00:00.000Z"},
+        "end_date_filter": {"type": "date", "null_value": "1970-01-01T00:00:00.000Z"},
+        "spatial_filter": {"type": "geo_shape"},
+        "foundational_filter": {"type": "keyword"},
+        "eo_collection_filter": {"type": "keyword"},
+        "polarization_filter": {"type": "keyword"},
+        "orbit_direction_filter": {"type": "keyword"},
+        "begin_filter": {"type": "keyword"},
+        "end_filter": {"type": "keyword"},
+        "bbox_filter": {"type": "keyword"},
+        "relation": {"type": "keyword"},
+        "temporal_relation": {"type": "keyword"},
+        "size": {"type": "keyword"},
+        "method": {"type": "keyword"},
+        "route": {"type": "keyword"},
+        "total_hits": {"type": "long"},
+        "timings": {
+            "properties": {
+                "setup": {"type": "float"},
+                "ip2geo": {"type": "float"},
+                "embedding": {"type": "float"},
+                "search": {"type": "float"},
+                "opensearch_took": {"type": "float"},
+                "response_build": {"type": "float"},
+                "total": {"type": "float"}
+            }
+        },
+        "ip2geo": {
+            "properties": {
+                "continent_name": {"type": "keyword"},
+                "region_iso_code": {"type": "keyword"},
+                "city_name": {"type": "keyword"},
+                "country_iso_code": {"type": "keyword"},
+                "country_name": {"type": "keyword"},
+                "region_name": {"type": "keyword"},
+                "location": {"type": "geo_point"},
+                "time_zone": {"type": "keyword"}
             }
         }
+    }
+}
+
+# Analytics document field -> lambda-search event key, to rebuild events from analytics documents (warmup.py, loadtest.py)
+ANALYTICS_TO_EVENT = {
+    "method": "method",
+    "q": "q",
+    "lang": "lang",
+    "organization_filter": "org",
+    "metadata_source_filter": "source_system",
+    "theme_filter": "theme",
+    "topicCategory_filter": "topic_category",
+    "type_filter": "type",
+    "protocol_filter": "protocol",
+    "mappable_filter": "mappable",
+    "sort_param": "sort",
+    "order_param": "order",
+    "size": "size",
+}
 
+# 'daily' or 'monthly' writes to <prefix>-<period> indices created from a template; 'none' keeps the single index
+analytics_index_period = environ.get('ANALYTICS_INDEX_PERIOD', 'daily')
+INDEX_PERIOD_FORMATS = {"daily": "%Y.%m.%d", "monthly": "%Y.%m"}
+
+_prepared_analytics_indices = set()
+
+def create_opensearch_index(os_client, index_name):
+    """Create a new OpenSearch index if it doesn't exist."""
+    if not os_client.indices.exists(index=index_name):
+        index_body = {"mappings": ANALYTICS_MAPPINGS}
         response = os_client.indices.create(index=index_name, body=index_body)
         print(f"Created new OpenSearch index: {index_name}")
         return response
@@ -88,9 +149,61 @@ def create_opensearch_index(os_client, index_name):
         print(f"Index '{index_name}' already exists.")
         return None
 
+def analytics_index_name(index_prefix, period=None, when=None):
+    """
+    Name of the analytics index a document written at `when` (UTC, default now) goes to,
+    e.g. search-analytics-2025.01.31 for the daily period.
+    """
+    period = period or analytics_index_period
+    if period not in INDEX_PERIOD_FORMATS:
+        return index_prefix
+    when = when or datetime.utcnow()
+    return f"{index_prefix}-{when.strftime(INDEX_PERIOD_FORMATS[period])}"
+
+def put_analytics_index_template(os_client, index_prefix, shards=1, refresh_interval="30s"):
+    """
+    Create or update the index template applied to every periodic <index_prefix>-YYYY.MM[.DD] analytics index.
+    Periodic indices are small, so one shard and a relaxed refresh interval keep writes cheap.
+    """
+    template_body = {
+        # Anchored on the year so other <index_prefix>-* indices (e.g. checkpoints) keep their own mappings
+        "index_patterns": [f"{index_prefix}-2*"],
+        "priority": 100,
+        "template": {
+            "settings": {
+                "number_of_shards": shards,
+                "refresh_interval": refresh_interval
+            },
+            "mappings": ANALYTICS_MAPPINGS
+        }
+    }
+    response = os_client.indices.put_index_template(name=f"{index_prefix}-template", body=template_body)
+    print(f"Put index template {index_prefix}-template for {index_prefix}-2*")
+    return response
+
+def prepare_analytics_index(os_client, index_prefix, period=None):
+    """
+    Return the analytics index to write to, creating its template (or the legacy single index)
+    once per Lambda container instead of checking the index on every request.
+    """
+    period = period or analytics_index_period
+    if (index_prefix, period) not in _prepared_analytics_indices:
+        try:
+            if period in INDEX_PERIOD_FORMATS:
+                put_analytics_index_template(os_client, index_prefix)
+            else:
+                create_opensearch_index(os_client, index_prefix)
+            _prepared_analytics_indices.add((index_prefix, period))
+        except exceptions.OpenSearchException as e:
+            print(f"Error preparing analytics index {index_prefix}: {e}")
+    return analytics_index_name(index_prefix, period)
+
 def save_to_opensearch(os_client, index, document):
     """
-    Loads the transformed log data into OpenSearch.
+    Loads the transformed log data into OpenSearch with a single bulk request.
     """
-    for doc in document:
-        response = os_client.index(index=index, body=doc)
\ No newline at end of file
+    actions = ({"_index": index, "_source": doc} for doc in document)
+    succeeded, errors = helpers.bulk(os_client, actions, chunk_size=500, max_chunk_bytes=5 * 1024 * 1024, raise_on_error=False)
+    if errors:
+        print(f"Failed to index analytics documents: {errors}")
+    return succeeded
\ No newline at end of file
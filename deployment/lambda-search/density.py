@@ -0,0 +1,95 @@
+"""
+Result density for map clients (method=ResultDensity): the query and filters of a SemanticSearch are run
+with size 0 and a geotile_grid or geohash_grid aggregation over the record geometries, so a map can draw
+where the results are without fetching them.
+
+The response is a GeoJSON FeatureCollection with one Polygon per grid cell holding results:
+    {"total_hits": 1234, "grid": "geotile", "precision": 6, "type": "FeatureCollection",
+     "features": [{"type": "Feature", "geometry": {"type": "Polygon", ...}, "properties": {"key": "6/17/21", "count": 42}}]}
+geotile keys are z/x/y web map tile coordinates, so cells line up with the client's vector tiles.
+"""
+import math
+from os import environ
+
+density_max_cells = int(environ.get('DENSITY_MAX_CELLS', '10000'))  # bucket limit of the grid aggregation
+
+# Grid -> (lowest precision, highest precision, default precision)
+DENSITY_GRIDS = {
+    "geotile": (0, 29, 6),
+    "geohash": (1, 12, 4),
+}
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+COORDINATE_DECIMALS = 6
+
+def parse_density_params(event):
+    """
+    Grid and precision of a ResultDensity event: grid is 'geotile' (default) or 'geohash', zoom its precision.
+    Raises ValueError for an unknown grid or a precision out of its range.
+    """
+    grid = (event.get('grid') or 'geotile').lower()
+    if grid not in DENSITY_GRIDS:
+        raise ValueError(f"Unsupported grid '{grid}'. Must be one of {list(DENSITY_GRIDS)}.")
+    lowest, highest, default = DENSITY_GRIDS[grid]
+    zoom = event.get('zoom', '')
+    if zoom in (None, ''):
+        precision = default
+    elif str(zoom).isdigit() and lowest <= int(zoom) <= highest:
+        precision = int(zoom)
+    else:
+        raise ValueError(f"Invalid zoom '{zoom}'. The {grid} grid takes a precision between {lowest} and {highest}.")
+    return {"grid": grid, "precision": precision}
+
+def density_aggregation(geo_field, grid, precision, bbox=None):
+    """
+    Grid aggregation of the record geometries. With a bbox (min_lon, min_lat, max_lon, max_lat)
+    only the cells inside it are returned.
+    """
+    aggregation = {"field": geo_field, "precision": precision, "size": density_max_cells}
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        aggregation["bounds"] = {"top_left": {"lat": max_lat, "lon": min_lon}, "bottom_right": {"lat": min_lat, "lon": max_lon}}
+    return {f"{grid}_grid": aggregation}
+
+def tile_bounds(key):
+    """(west, south, east, north) of a z/x/y web map tile."""
+    zoom, x, y = (int(part) for part in key.split("/"))
+    n = 2 ** zoom
+    latitude = lambda row: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    return x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180, latitude(y)
+
+def geohash_bounds(key):
+    """(west, south, east, north) of a geohash cell."""
+    west, south, east, north = -180.0, -90.0, 180.0, 90.0
+    even = True
+    for char in key:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            bit = (bits >> shift) & 1
+            if even:
+                middle = (west + east) / 2
+                west, east = (middle, east) if bit else (west, middle)
+            else:
+                middle = (south + north) / 2
+                south, north = (middle, north) if bit else (south, middle)
+            even = not even
+    return west, south, east, north
+
+def create_density_response(search_results, grid, precision):
+    """GeoJSON FeatureCollection of the grid cells of a density search (see the module docstring)."""
+    cell_bounds = tile_bounds if grid == "geotile" else geohash_bounds
+    features = []
+    for bucket in search_results.get("aggregations", {}).get("density", {}).get("buckets", []):
+        west, south, east, north = (round(value, COORDINATE_DECIMALS) for value in cell_bounds(bucket["key"]))
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [[[west, south], [east, south], [east, north], [west, north], [west, south]]]},
+            "properties": {"key": bucket["key"], "count": bucket["doc_count"]}
+        })
+    hits = search_results.get("hits", {})
+    return {
+        "total_hits": hits["total"]["value"] if "total" in hits else 0,
+        "grid": grid,
+        "precision": precision,
+        "type": "FeatureCollection",
+        "features": features
+    }
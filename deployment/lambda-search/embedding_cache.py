@@ -0,0 +1,197 @@
+import re
+import hashlib
+from os import environ
+from threading import Lock
+from datetime import datetime
+from collections import OrderedDict
+from opensearchpy import exceptions
+
+embedding_cache_size = int(environ.get('EMBEDDING_CACHE_SIZE', '2000'))
+# Shared cache tier in OpenSearch, created on first write; set EMBEDDING_CACHE_INDEX to an empty string to disable it
+embedding_cache_index = environ.get('EMBEDDING_CACHE_INDEX', 'embedding-cache')
+# Part of every cache key, with the vector dimension of the searched index: change it (or deploy a new
+# endpoint) when the model changes, or when its projection is refitted to the same dimension
+embedding_cache_version = environ.get('EMBEDDING_CACHE_VERSION', environ.get('SAGEMAKER_ENDPOINT', ''))
+
+EMBEDDING_CACHE_MAPPINGS = {
+    "properties": {
+        "text": {"type": "keyword"},
+        "version": {"type": "keyword"},
+        "vector": {"type": "float", "index": False, "doc_values": False},
+        "created": {"type": "date"}
+    }
+}
+
+_cache = OrderedDict()
+_cache_lock = Lock()
+_shared_index_ready = set()
+
+def normalize_query(text):
+    """
+    Cache form of a query string: surrounding whitespace stripped and inner runs collapsed.
+    Case is kept since the encoder is case sensitive.
+    """
+    return re.sub(r'\s+', ' ', str(text)).strip()
+
+def cache_version(dimension=None):
+    """
+    Cache version of the embeddings of a dimension. A projected model (dimensionality_reduction.py)
+    returns vectors of another dimension than the full one, so their cache entries never mix.
+    """
+    return f"{embedding_cache_version}/{dimension}" if dimension else embedding_cache_version
+
+def embedding_cache_key(text, version=None):
+    """
+    Key of an embedding in both cache tiers: sha1 of the cache version and the normalized text.
+    """
+    version = embedding_cache_version if version is None else version
+    return hashlib.sha1(f"{version}\x1f{normalize_query(text)}".encode('utf-8')).hexdigest()
+
+def lru_get(key):
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    return None
+
+def lru_put(key, vector):
+    with _cache_lock:
+        _cache[key] = vector
+        _cache.move_to_end(key)
+        while len(_cache) > embedding_cache_size:
+            _cache.popitem(last=False)
+
+def ensure_shared_cache_index(os_client, index_name=None):
+    """
+    Create the shared embedding cache index if needed, once per container.
+    """
+    index_name = index_name or embedding_cache_index
+    if not index_name or index_name in _shared_index_ready:
+        return
+    if not os_client.indices.exists(index=index_name):
+        os_client.indices.create(index=index_name, body={
+            "settings": {"number_of_shards": 1, "refresh_interval": "30s"},
+            "mappings": EMBEDDING_CACHE_MAPPINGS
+        })
+        print(f"Created embedding cache index: {index_name}")
+    _shared_index_ready.add(index_name)
+
+def shared_get(os_client, key, index_name=None):
+    """
+    Read a vector from the shared cache tier. Returns None on a miss or any cluster error.
+    """
+    index_name = index_name or embedding_cache_index
+    if not index_name or os_client is None:
+        return None
+    try:
+        response = os_client.get(index=index_name, id=key, _source_includes="vector")
+        return response.get("_source", {}).get("vector") if response.get("found") else None
+    except exceptions.NotFoundError:
+        return None
+    except exceptions.OpenSearchException as e:
+        print(f"Error reading embedding cache: {e}")
+        return None
+
+def shared_get_many(os_client, keys, index_name=None):
+    """
+    Read several vectors from the shared cache tier with one _mget. Returns {key: vector} for the hits.
+    """
+    index_name = index_name or embedding_cache_index
+    if not index_name or os_client is None or not keys:
+        return {}
+    try:
+        response = os_client.mget(index=index_name, body={"ids": list(keys)}, _source_includes="vector")
+        return {doc["_id"]: doc["_source"]["vector"] for doc in response.get("docs", []) if doc.get("found")}
+    except exceptions.NotFoundError:
+        return {}
+    except exceptions.OpenSearchException as e:
+        print(f"Error reading embedding cache: {e}")
+        return {}
+
+def shared_put(os_client, key, text, vector, index_name=None, version=None):
+    """
+    Write a vector to the shared cache tier; errors are logged and ignored.
+    """
+    index_name = index_name or embedding_cache_index
+    if not index_name or os_client is None:
+        return
+    try:
+        ensure_shared_cache_index(os_client, index_name)
+        os_client.index(index=index_name, id=key, body={
+            "text": normalize_query(text),
+            "version": embedding_cache_version if version is None else version,
+            "vector": vector,
+            "created": datetime.utcnow().isoformat()
+        })
+    except exceptions.OpenSearchException as e:
+        print(f"Error writing embedding cache: {e}")
+
+def get_embedding(text, encoder, os_client=None, refresh=False, dimension=None):
+    """
+    Embedding of text through the in-process LRU, then the shared OpenSearch tier, then the encoder.
+
+    Args:
+        text (str): Query text.
+        encoder (callable): Computes the embedding of a text (e.g. the SageMaker endpoint call),
+                            returns None on failure.
+        os_client (OpenSearch): Client for the shared tier; None uses the LRU only.
+        refresh (bool): Skip the cache reads and overwrite both tiers (used by the warmup).
+        dimension (int): Vector dimension of the searched index, part of the cache version; None if unknown.
+
+    Returns:
+        list: The embedding, or None if the encoder failed (failures are not cached).
+    """
+    version = cache_version(dimension)
+    key = embedding_cache_key(text, version)
+    if not refresh:
+        vector = lru_get(key)
+        if vector is not None:
+            return vector
+        vector = shared_get(os_client, key)
+        if vector is not None:
+            lru_put(key, vector)
+            return vector
+
+    vector = encoder(text)
+    if vector is None:
+        return None
+    lru_put(key, vector)
+    shared_put(os_client, key, text, vector, version=version)
+    return vector
+
+def get_embeddings(texts, batch_encoder, os_client=None, refresh=False, dimension=None):
+    """
+    Embeddings of several texts through the cache tiers, with a single batch_encoder call for
+    all the texts neither tier has.
+
+    Args:
+        texts (list): Query texts.
+        batch_encoder (callable): Computes the embeddings of a list of texts in one call, returns a
+                                  list of vectors in the same order, or None on failure.
+        dimension (int): Vector dimension of the searched index, as in get_embedding.
+
+    Returns:
+        list: One embedding per text, None for texts the encoder failed on.
+    """
+    version = cache_version(dimension)
+    keys = [embedding_cache_key(text, version) for text in texts]
+    vectors = {}
+    if not refresh:
+        for key in keys:
+            vector = lru_get(key)
+            if vector is not None:
+                vectors[key] = vector
+        shared = shared_get_many(os_client, [key for key in dict.fromkeys(keys) if key not in vectors])
+        for key, vector in shared.items():
+            lru_put(key, vector)
+        vectors.update(shared)
+
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if missing:
+        encoded = batch_encoder(list(missing.values()))
+        if encoded is not None and len(encoded) == len(missing):
+            for (key, text), vector in zip(missing.items(), encoded):
+                vectors[key] = vector
+                lru_put(key, vector)
+                shared_put(os_client, key, text, vector, version=version)
+    return [vectors.get(key) for key in keys]
@@ -1,5 +1,10 @@
+import re
+import calendar
 from datetime import datetime
 
+PARTIAL_DATE_PATTERN = re.compile(r'^\s*(\d{4})(?:-(\d{2}))?(?:-(\d{2}))?\s*$')
+TEMPORAL_RELATIONS = ["intersects", "within", "contains"]
+
 def build_wildcard_filter(field_paths, values):
     """
     Builds a wildcard OR filter for multiple field paths and values.
@@ -121,28 +126,139 @@ def build_date_filter(begin_field=None, end_field=None, start_date=None, end_dat
 
     return date_filters
 
-def build_spatial_filter(geo_field, bbox, relation=None):
+def date_bound(value, upper=False):
     """
-    Builds a spatial filter for geo_shape fields based on a bounding box (bbox).
+    Widens a YYYY, YYYY-MM or YYYY-MM-DD filter date to a full date: the first day of its year or
+    month, or with upper the last one (e.g. 2024-02 -> 2024-02-29).
+
+    Raises:
+        ValueError: If the value is not such a date.
+    """
+    match = PARTIAL_DATE_PATTERN.match(value)
+    if match is None:
+        raise ValueError(f"Invalid date '{value}'. Expected YYYY, YYYY-MM or YYYY-MM-DD.")
+    year, month, day = match.groups()
+    year = int(year)
+    month = int(month) if month else (12 if upper else 1)
+    try:
+        if not day:
+            day = calendar.monthrange(year, month)[1] if upper else 1
+        return datetime(year, month, int(day)).strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"Invalid date '{value}'.")
+
+def build_temporal_range_filter(range_field, start_date=None, end_date=None, relation=None, begin_field=None, end_field=None):
+    """
+    Builds a single range query on the date_range field holding each record's temporal extent,
+    normalized at ingest (open-ended when the extent is ongoing).
+
+    Records with an unknown begin or end have no date_range value. With begin_field and end_field,
+    they are matched as before the date_range field existed instead, by range queries on their
+    begin and end dates.
 
     Args:
-        geo_field (str): The geo_shape field name from the mapping configuration.
-        bbox (list): A list of four coordinates defining the bounding box [min_lon, min_lat, max_lon, max_lat].
-        relation (str): The spatial relation for the filter. Defaults to 'intersects'.
+        range_field (str): The date_range field name from the mapping configuration.
+        start_date (str): Start of the searched period (YYYY, YYYY-MM or YYYY-MM-DD); open if missing.
+        end_date (str): End of the searched period; 'present' is today, 'null' and
+                        'not available; indisponible' leave it open.
+        relation (str): How the record extents relate to the period: 'within' (default, the extent
+                        lies inside it), 'intersects' (the extent overlaps it) or 'contains'.
+        begin_field (str): Optional begin date field of the records without a date_range value.
+        end_field (str): Optional end date field of the records without a date_range value.
 
     Returns:
-        dict: A geo_shape query using the 'envelope' type.
+        list: One query, or none if neither date bounds the period.
 
     Raises:
-        ValueError: If the bbox is invalid or the relation is unsupported.
+        ValueError: If a date is invalid or the relation is unsupported.
     """
     if relation is None:
-        relation = "intersects"
+        relation = "within"
+    if relation not in TEMPORAL_RELATIONS:
+        raise ValueError(f"Unsupported temporal relation '{relation}'. Must be one of {TEMPORAL_RELATIONS}.")
+
+    open_values = ['null', 'not available; indisponible']
+    period = {}
+    if start_date and start_date.lower() not in open_values:
+        period["gte"] = date_bound(start_date)
+    if end_date and end_date.lower() == "present":
+        period["lte"] = datetime.now().strftime('%Y-%m-%d')
+    elif end_date and end_date.lower() not in open_values:
+        period["lte"] = date_bound(end_date, upper=True)
+
+    if not period:
+        return []
+    if "gte" in period and "lte" in period and period["gte"] > period["lte"]:
+        raise ValueError("Invalid temporal filter: begin is after end.")
+    range_query = {
+        "range": {
+            range_field: dict(period, relation=relation)
+        }
+    }
+    if not (begin_field and end_field):
+        return [range_query]
+
+    legacy_filters = []
+    if "gte" in period:
+        legacy_filters.append({"range": {begin_field: {"gte": period["gte"]}}})
+    if "lte" in period:
+        legacy_filters.append({"range": {end_field: {"lte": period["lte"]}}})
+    return [{
+        "bool": {
+            "should": [
+                range_query,
+                {"bool": {"must_not": [{"exists": {"field": range_field}}], "filter": legacy_filters}}
+            ],
+            "minimum_should_match": 1
+        }
+    }]
 
-    supported_relations = ["intersects", "disjoint", "within", "contains"]
-    if relation not in supported_relations:
-        raise ValueError(f"Unsupported relation '{relation}'. Must be one of {supported_relations}.")
+def build_extent_filter(extent_field, min_lon, min_lat, max_lon, max_lat, relation):
+    """
+    Builds range queries on the numeric bounding box of each record (<extent_field>.min_lon, ...),
+    computed at ingest, relating it to the bbox.
+
+    'within' is exact, since a geometry lies inside a box exactly when its bounding box does.
+    'intersects' and 'disjoint' compare bounding boxes, which is exact for rectangular footprints.
+    'contains' is only a prefilter: a geometry can only contain the box if its bounding box does.
+
+    Returns:
+        dict: A bool query.
+    """
+    def side(name, op, value):
+        return {"range": {f"{extent_field}.{name}": {op: value}}}
+
+    if relation == "within":
+        clauses = [side("min_lon", "gte", min_lon), side("max_lon", "lte", max_lon),
+                   side("min_lat", "gte", min_lat), side("max_lat", "lte", max_lat)]
+    elif relation == "contains":
+        clauses = [side("min_lon", "lte", min_lon), side("max_lon", "gte", max_lon),
+                   side("min_lat", "lte", min_lat), side("max_lat", "gte", max_lat)]
+    else:
+        clauses = [side("min_lon", "lte", max_lon), side("max_lon", "gte", min_lon),
+                   side("min_lat", "lte", max_lat), side("max_lat", "gte", min_lat)]
+
+    if relation == "disjoint":
+        # Records with a bounding box entirely on one side of the bbox
+        return {
+            "bool": {
+                "should": [side("max_lon", "lt", min_lon), side("min_lon", "gt", max_lon),
+                           side("max_lat", "lt", min_lat), side("min_lat", "gt", max_lat)],
+                "minimum_should_match": 1
+            }
+        }
+    return {"bool": {"filter": clauses}}
 
+def parse_bbox(bbox):
+    """
+    Parses a bbox parameter ("min_lon,min_lat,max_lon,max_lat").
+
+    Returns:
+        tuple: (min_lon, min_lat, max_lon, max_lat) as floats.
+
+    Raises:
+        ValueError: If the bbox is not four numbers within the longitude and latitude ranges.
+    """
     try:
         bbox = [float(val.strip()) for val in bbox.split(",") if val.strip()]
     except ValueError:
@@ -160,7 +276,36 @@ def build_spatial_filter(geo_field, bbox, relation=None):
     if not (-90 <= min_lat <= 90 and -90 <= max_lat <= 90):
         raise ValueError("Latitude values must be between -90 and 90.")
 
-    return {
+    return min_lon, min_lat, max_lon, max_lat
+
+def build_spatial_filter(geo_field, bbox, relation=None, extent_field=None):
+    """
+    Builds a spatial filter for geo_shape fields based on a bounding box (bbox).
+
+    Args:
+        geo_field (str): The geo_shape field name from the mapping configuration.
+        bbox (list): A list of four coordinates defining the bounding box [min_lon, min_lat, max_lon, max_lat].
+        relation (str): The spatial relation for the filter. Defaults to 'intersects'.
+        extent_field (str): Optional numeric bounding box field from the mapping configuration. When set,
+                            intersects, disjoint and within are answered from it with range queries, and
+                            contains uses it as a prefilter before the geo_shape query.
+
+    Returns:
+        dict: A geo_shape query using the 'envelope' type, or a bool query on the extent field.
+
+    Raises:
+        ValueError: If the bbox is invalid or the relation is unsupported.
+    """
+    if relation is None:
+        relation = "intersects"
+
+    supported_relations = ["intersects", "disjoint", "within", "contains"]
+    if relation not in supported_relations:
+        raise ValueError(f"Unsupported relation '{relation}'. Must be one of {supported_relations}.")
+
+    min_lon, min_lat, max_lon, max_lat = parse_bbox(bbox)
+
+    geo_shape = {
         "geo_shape": {
             geo_field: {
                 "shape": {
@@ -171,6 +316,14 @@ def build_spatial_filter(geo_field, bbox, relation=None):
             }
         }
     }
+    if not extent_field:
+        return geo_shape
+
+    extent_filter = build_extent_filter(extent_field, min_lon, min_lat, max_lon, max_lat, relation)
+    if relation == "contains":
+        # Exact geo_shape test only on the records whose bounding box contains the bbox
+        extent_filter["bool"]["filter"].append(geo_shape)
+    return extent_filter
 
 def build_sort_filter(lang_filter, sort_field="relevancy", sort_order="desc"):
     """
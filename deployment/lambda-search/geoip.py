@@ -0,0 +1,172 @@
+import csv
+import bisect
+import ipaddress
+from os import environ
+from threading import Lock
+from collections import OrderedDict
+
+# Optional: MaxMind reader for .mmdb databases
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+ip2geo_database = environ.get('IP2GEO_DATABASE', '')  # .mmdb file or .csv range table packaged with the lambda
+ip2geo_cache_size = int(environ.get('IP2GEO_CACHE_SIZE', '10000'))
+ip2geo_cache_key = environ.get('IP2GEO_CACHE_KEY', 'prefix')  # 'prefix' (/24 IPv4, /48 IPv6) or 'ip'
+
+# Fields produced by the ip-to-geo ingest pipeline, mapped in the analytics index
+IP2GEO_FIELDS = ["continent_name", "region_iso_code", "city_name", "country_iso_code", "country_name", "region_name", "time_zone"]
+
+_cache = OrderedDict()
+_cache_lock = Lock()
+_local_provider = None
+_local_provider_loaded = False
+
+def cache_key(ip_address):
+    """
+    LRU cache key of an IP address: its /24 (IPv4) or /48 (IPv6) network, or the address itself.
+    Returns None for values that are not IP addresses.
+    """
+    try:
+        ip = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return None
+    if ip2geo_cache_key == 'ip':
+        return str(ip)
+    prefix = 24 if ip.version == 4 else 48
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+def cached_lookup(ip_address, providers):
+    """
+    Geolocate ip_address with the first provider that returns a result, through the LRU cache.
+
+    Args:
+        ip_address (str): Client IP address.
+        providers (list): Callables taking an IP address and returning an ip2geo dict,
+                          or None when they cannot answer (tried in order).
+
+    Returns:
+        dict: ip2geo data, {} when no provider knows the address. Results are cached per
+              cache_key, except when every provider failed to answer.
+    """
+    key = cache_key(ip_address)
+    if key is None:
+        return {}
+
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return dict(_cache[key])
+
+    ip2geo_data = None
+    for provider in providers:
+        ip2geo_data = provider(ip_address)
+        if ip2geo_data is not None:
+            break
+    if ip2geo_data is None:
+        return {}
+
+    with _cache_lock:
+        _cache[key] = ip2geo_data
+        _cache.move_to_end(key)
+        while len(_cache) > ip2geo_cache_size:
+            _cache.popitem(last=False)
+    return dict(ip2geo_data)
+
+def load_range_table(file_path):
+    """
+    Load a CSV IP range table into sorted arrays for binary search.
+
+    The CSV needs either a `network` (CIDR) column or `start_ip`/`end_ip` columns, plus any of
+    IP2GEO_FIELDS and `latitude`/`longitude`. Rows may be in any order.
+
+    Returns:
+        dict: {4: (starts, ends, records), 6: (starts, ends, records)} with starts sorted.
+    """
+    rows = {4: [], 6: []}
+    with open(file_path, newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            if row.get('network'):
+                network = ipaddress.ip_network(row['network'].strip(), strict=False)
+                start, end, version = int(network.network_address), int(network.broadcast_address), network.version
+            else:
+                start_ip, end_ip = ipaddress.ip_address(row['start_ip'].strip()), ipaddress.ip_address(row['end_ip'].strip())
+                start, end, version = int(start_ip), int(end_ip), start_ip.version
+            record = {field: row[field] for field in IP2GEO_FIELDS if row.get(field)}
+            if row.get('latitude') and row.get('longitude'):
+                record['location'] = {"lat": float(row['latitude']), "lon": float(row['longitude'])}
+            rows[version].append((start, end, record))
+
+    table = {}
+    for version, version_rows in rows.items():
+        version_rows.sort(key=lambda r: r[0])
+        table[version] = ([r[0] for r in version_rows], [r[1] for r in version_rows], [r[2] for r in version_rows])
+    return table
+
+def lookup_range_table(table, ip_address):
+    """
+    Find the range containing ip_address with a binary search over the sorted range starts.
+    Returns a copy of the matching record, or None if no range contains the address.
+    """
+    ip = ipaddress.ip_address(ip_address)
+    starts, ends, records = table[ip.version]
+    ip_int = int(ip)
+    i = bisect.bisect_right(starts, ip_int) - 1
+    if i >= 0 and ip_int <= ends[i]:
+        return dict(records[i])
+    return None
+
+def mmdb_record_to_ip2geo(record):
+    """
+    Map a GeoLite2/GeoIP2 City record onto the fields written by the ip-to-geo pipeline.
+    """
+    if not record:
+        return None
+    subdivision = (record.get('subdivisions') or [{}])[0]
+    location = record.get('location', {})
+    ip2geo_data = {
+        "continent_name": record.get('continent', {}).get('names', {}).get('en'),
+        "region_iso_code": subdivision.get('iso_code'),
+        "city_name": record.get('city', {}).get('names', {}).get('en'),
+        "country_iso_code": record.get('country', {}).get('iso_code'),
+        "country_name": record.get('country', {}).get('names', {}).get('en'),
+        "region_name": subdivision.get('names', {}).get('en'),
+        "time_zone": location.get('time_zone'),
+    }
+    if 'latitude' in location and 'longitude' in location:
+        ip2geo_data["location"] = {"lat": location['latitude'], "lon": location['longitude']}
+    return {key: value for key, value in ip2geo_data.items() if value is not None}
+
+def load_local_provider(database):
+    """
+    Build an in-process geolocation provider for a .mmdb or .csv database.
+    Returns None when the database is not set, of an unknown type, or cannot be loaded.
+    """
+    provider = None
+    try:
+        if database.endswith('.mmdb'):
+            if maxminddb is None:
+                print("maxminddb is not installed, cannot read", database)
+            else:
+                reader = maxminddb.open_database(database)
+                provider = lambda ip_address: mmdb_record_to_ip2geo(reader.get(ip_address))
+        elif database.endswith('.csv'):
+            table = load_range_table(database)
+            provider = lambda ip_address: lookup_range_table(table, ip_address)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading ip2geo database {database}: {e}")
+    return provider
+
+def get_local_provider(database=None):
+    """
+    In-process geolocation provider for IP2GEO_DATABASE, built once per container.
+    An explicit database gets a provider of its own, leaving the container's one untouched.
+    Returns None when no database is configured or it cannot be loaded.
+    """
+    global _local_provider, _local_provider_loaded
+    if database is not None:
+        return load_local_provider(database)
+    if not _local_provider_loaded:
+        _local_provider, _local_provider_loaded = load_local_provider(ip2geo_database), True
+    return _local_provider
@@ -0,0 +1,332 @@
+"""
+Traffic replay load test of lambda-search.
+
+Rebuilds lambda_handler events from search analytics documents (the records dashboard.py writes),
+read from the analytics indices or from an exported NDJSON file, and replays them at a target QPS
+profile with bounded concurrency against either:
+    - the handler in-process, with benchmark.py's fake OpenSearch transport and encoder, or
+    - an HTTP URL (the API Gateway stage), with the event keys as query string parameters.
+
+Requests are sent open loop: each one is scheduled at its arrival time whatever the state of
+earlier requests, and its latency is measured from that time, so queueing behind a saturated
+target shows up in the results instead of silently lowering the rate. Reports latency
+percentiles and histograms, and error breakdowns, per query class.
+
+Replayed requests are ordinary traffic to the target: over HTTP they are written to its
+analytics indices like any other search, so point the tool at a staging stack.
+
+Usage:
+    python loadtest.py --ndjson analytics.ndjson --profile 5:60,20:120,50:60 --concurrency 32
+    python loadtest.py --analytics_index analytics-2* --os_endpoint search-domain.ca-central-1.es.amazonaws.com \\
+        --url https://api.example.com/live/search-opensearch --profile 10:300 --arrivals poisson --json results.json
+"""
+import io
+import os
+import json
+import time
+import random
+import argparse
+import threading
+import contextlib
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark import load_app, FakeBackend, FakeEncoder, install_fakes, parse_latency, summarize
+from dashboard import ANALYTICS_TO_EVENT
+
+# Analytics document fields replayed on top of ANALYTICS_TO_EVENT: paging, the spatial and temporal filters
+# and their relations, and the foundational and EO filters
+REPLAY_FIELDS = dict(ANALYTICS_TO_EVENT, **{
+    "from": "from", "relation": "relation", "temporal_relation": "temporal_relation",
+    "begin_filter": "begin", "end_filter": "end", "bbox_filter": "bbox", "foundational_filter": "foundational",
+    "eo_collection_filter": "eo_collection", "polarization_filter": "polarization", "orbit_direction_filter": "orbit_direction",
+})
+
+# Event keys that identify a filtered search, for query classes
+FILTER_KEYS = ("org", "source_system", "theme", "topic_category", "type", "protocol", "mappable",
+               "eo_collection", "polarization", "orbit_direction", "foundational", "begin", "end", "bbox")
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is unbounded
+HISTOGRAM_BOUNDS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+def analytics_record_to_event(record):
+    """
+    lambda-search event of an analytics document (or a search hit carrying one in _source).
+    Documents written by BatchSemanticSearch hold one query each and are replayed as SemanticSearch.
+    """
+    record = record.get("_source", record)
+    event = {event_key: record.get(field) for field, event_key in REPLAY_FIELDS.items()}
+    event = {key: '' if value is None else str(value) for key, value in event.items()}
+    if event["method"] in ('', 'BatchSemanticSearch'):
+        event["method"] = "SemanticSearch"
+    event["timestamp"] = record.get("timestamp") or ''
+    return event
+
+def load_ndjson(path):
+    """Analytics documents of an NDJSON export, one document or search hit per line."""
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def fetch_analytics_records(os_client, index_pattern, days=1, limit=10000):
+    """
+    Analytics documents of the last `days` days, oldest first, at most `limit` of them.
+    """
+    from opensearchpy import helpers
+
+    query = {"query": {"range": {"timestamp": {"gte": f"now-{days}d"}}}}
+    records = []
+    for hit in helpers.scan(os_client, index=index_pattern, query=query, ignore_unavailable=True, allow_no_indices=True):
+        records.append(hit["_source"])
+        if len(records) >= limit:
+            break
+    records.sort(key=lambda record: str(record.get("timestamp") or ''))
+    return records
+
+def analytics_client(endpoint, region):
+    """OpenSearch client of the domain holding the analytics indices, signed with the local AWS credentials."""
+    import boto3
+    from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+
+    credentials = boto3.Session().get_credentials()
+    return OpenSearch(
+        hosts=[{'host': endpoint, 'port': 443}],
+        http_auth=AWSV4SignerAuth(credentials, region, 'es'),
+        use_ssl=True,
+        verify_certs=True,
+        connection_class=RequestsHttpConnection
+    )
+
+def query_class(event):
+    """
+    Class of a search for the report: method, text or browse (no query text), and filtered when
+    any filter is set, e.g. 'SemanticSearch/text+filters'.
+    """
+    kind = "text" if event.get("q") else "browse"
+    if any(event.get(key) for key in FILTER_KEYS):
+        kind += "+filters"
+    return f"{event.get('method') or 'KeywordSearch'}/{kind}"
+
+def parse_profile(value):
+    """'5:60,20:120' -> [(5.0, 60.0), (20.0, 120.0)]: QPS held for a number of seconds, stage by stage."""
+    profile = []
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        qps, _, seconds = item.partition(':')
+        profile.append((float(qps), float(seconds)))
+    if not profile or any(qps <= 0 or seconds <= 0 for qps, seconds in profile):
+        raise ValueError(f"Invalid load profile: {value!r}")
+    return profile
+
+def arrival_times(profile, arrivals="uniform", seed=0):
+    """
+    Send times (seconds from the start) of the requests of a profile. 'uniform' spaces them evenly
+    within each stage, 'poisson' draws exponential gaps at the stage's rate.
+    """
+    rng = random.Random(seed)
+    times = []
+    stage_start = 0.0
+    for qps, seconds in profile:
+        offset = 0.0
+        while True:
+            offset += rng.expovariate(qps) if arrivals == "poisson" else 1 / qps
+            if offset > seconds:
+                break
+            times.append(stage_start + offset)
+        stage_start += seconds
+    return times
+
+def response_error(response):
+    """Error reported in a lambda_handler response, or None."""
+    if not isinstance(response, dict):
+        return None
+    if int(response.get("statusCode", 200)) >= 400:
+        return f"status {response['statusCode']}"
+    inner = response.get("response")
+    if isinstance(inner, dict) and "error" in inner:
+        return "error response"
+    return None
+
+class InProcessTarget:
+    """lambda_handler in this process, against benchmark.py's fake backend and encoder."""
+    def __init__(self, latency_ms=None, encoder_latency_ms=50, responses=None):
+        self.app = load_app()
+        self.backend = FakeBackend(responses=responses, latency_ms=latency_ms)
+        self.encoder = FakeEncoder(latency_ms=encoder_latency_ms)
+        install_fakes(self.app, self.backend, self.encoder)
+
+    def __call__(self, event):
+        return response_error(self.app.lambda_handler(json.loads(json.dumps(event)), None))
+
+class HttpTarget:
+    """GET requests to a deployed search API, one pooled connection per concurrent request."""
+    def __init__(self, url, concurrency, timeout=30):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def __call__(self, event):
+        params = {key: value for key, value in event.items() if value and key != 'timestamp'}
+        response = self.session.get(self.url, params=params, timeout=self.timeout)
+        if response.status_code >= 400:
+            return f"HTTP {response.status_code}"
+        try:
+            return response_error(response.json())
+        except ValueError:
+            return "invalid JSON"
+
+def histogram(samples, bounds=HISTOGRAM_BOUNDS_MS):
+    """Counts of samples per latency bucket: [(upper bound ms or None, count)]."""
+    counts = [0] * (len(bounds) + 1)
+    for sample in samples:
+        position = 0
+        while position < len(bounds) and sample > bounds[position]:
+            position += 1
+        counts[position] += 1
+    return list(zip(list(bounds) + [None], counts))
+
+def run_load(events, target, profile, concurrency=16, arrivals="uniform", shuffle=False, seed=0):
+    """
+    Replay events through target following the profile, cycling over the events as needed.
+
+    Returns:
+        dict: sent, duration and achieved QPS, dispatch lag, and per class: latency (from the
+              scheduled send time) and service time summaries, latency histogram and errors.
+    """
+    if not events:
+        raise ValueError("No events to replay")
+    order = list(events)
+    if shuffle:
+        random.Random(seed).shuffle(order)
+    schedule = arrival_times(profile, arrivals=arrivals, seed=seed)
+
+    latency, service, errors = defaultdict(list), defaultdict(list), defaultdict(Counter)
+    lock = threading.Lock()
+
+    def send(event, scheduled):
+        started = time.perf_counter()
+        try:
+            error = target(event)
+        except Exception as e:
+            error = type(e).__name__
+        finished = time.perf_counter()
+        cls = query_class(event)
+        with lock:
+            latency[cls].append((finished - scheduled) * 1000)
+            service[cls].append((finished - started) * 1000)
+            if error:
+                errors[cls][error] += 1
+
+    lag = []
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    start = time.perf_counter()
+    for position, offset in enumerate(schedule):
+        scheduled = start + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        lag.append(max(0.0, -delay) * 1000)
+        pool.submit(send, order[position % len(order)], scheduled)
+    pool.shutdown(wait=True)
+    duration = time.perf_counter() - start
+
+    classes = {}
+    for cls in sorted(latency):
+        count = len(latency[cls])
+        classes[cls] = {
+            "latency": summarize(latency[cls]),
+            "service": summarize(service[cls]),
+            "histogram": histogram(latency[cls]),
+            "errors": dict(errors[cls]),
+            "error_rate": sum(errors[cls].values()) / count,
+        }
+    all_latency = [value for values in latency.values() for value in values]
+    return {
+        "sent": len(schedule),
+        "duration": duration,
+        "achieved_qps": len(schedule) / duration if duration else None,
+        "dispatch_lag_ms": summarize(lag),
+        "latency": summarize(all_latency),
+        "histogram": histogram(all_latency),
+        "classes": classes,
+    }
+
+def print_histogram(buckets, indent="  ", width=40):
+    """Text histogram of the buckets between the first and last non-empty ones."""
+    filled = [position for position, (_, count) in enumerate(buckets) if count]
+    if not filled:
+        return
+    peak = max(count for _, count in buckets)
+    previous = buckets[filled[0] - 1][0] if filled[0] else 0
+    for bound, count in buckets[filled[0]:filled[-1] + 1]:
+        label = f"{previous}-{bound} ms" if bound is not None else f">{previous} ms"
+        print(f"{indent}{label:>14} {count:>7} {'#' * round(width * count / peak)}")
+        previous = bound
+
+def print_report(results):
+    print(f"{results['sent']} requests in {results['duration']:.1f} s ({results['achieved_qps']:.2f} QPS achieved), "
+          f"dispatch lag p99 {results['dispatch_lag_ms']['p99']:.2f} ms")
+
+    print(f"\n{'query class':<32} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+    for cls, stats in results['classes'].items():
+        summary = stats['latency']
+        print(f"{cls:<32} {summary['count']:>6} {summary['p50']:>9.2f} {summary['p95']:>9.2f} {summary['p99']:>9.2f} "
+              f"{summary['max']:>9.2f} {stats['error_rate']:>7.1%}")
+    summary = results['latency']
+    print(f"{'all':<32} {summary['count']:>6} {summary['p50']:>9.2f} {summary['p95']:>9.2f} {summary['p99']:>9.2f} {summary['max']:>9.2f}")
+
+    print("\nlatency histogram, all classes:")
+    print_histogram(results['histogram'])
+    for cls, stats in results['classes'].items():
+        print(f"\n{cls}:")
+        print_histogram(stats['histogram'])
+        for error, count in sorted(stats['errors'].items(), key=lambda item: -item[1]):
+            print(f"  {count:>5} x {error}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay search analytics traffic against lambda-search.')
+    parser.add_argument('--ndjson', type=str, default=None, help='NDJSON export of analytics documents')
+    parser.add_argument('--analytics_index', type=str, default=None, help='Analytics index pattern to read, e.g. analytics-2*')
+    parser.add_argument('--os_endpoint', type=str, default=None, help='OpenSearch domain endpoint holding the analytics index')
+    parser.add_argument('--region', type=str, default=os.environ.get('AWS_REGION', 'ca-central-1'), help='Region of the domain')
+    parser.add_argument('--days', type=int, default=1, help='Days of analytics documents to read')
+    parser.add_argument('--limit', type=int, default=10000, help='Maximum number of analytics documents to read')
+    parser.add_argument('--url', type=str, default=None, help='Search API URL; the handler runs in-process with fakes when omitted')
+    parser.add_argument('--profile', type=str, default='10:60', help='Load profile as qps:seconds stages, e.g. 5:60,20:120')
+    parser.add_argument('--concurrency', type=int, default=16, help='Maximum requests in flight')
+    parser.add_argument('--arrivals', choices=['uniform', 'poisson'], default='uniform', help='Spacing of the requests within a stage')
+    parser.add_argument('--shuffle', action='store_true', help='Replay in random order instead of timestamp order')
+    parser.add_argument('--latency', type=str, default='', help='In-process: backend latency per operation in ms, e.g. search=40,bulk=10')
+    parser.add_argument('--encoder_latency', type=float, default=50, help='In-process: fake encoder latency in ms')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for arrivals and shuffling')
+    parser.add_argument('--json', type=str, default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.ndjson:
+        records = load_ndjson(args.ndjson)
+    elif args.analytics_index and args.os_endpoint:
+        records = fetch_analytics_records(analytics_client(args.os_endpoint, args.region), args.analytics_index,
+                                          days=args.days, limit=args.limit)
+    else:
+        parser.error('--ndjson or --analytics_index with --os_endpoint is required')
+    events = [analytics_record_to_event(record) for record in records]
+    print(f"Replaying {len(events)} recorded searches")
+
+    profile = parse_profile(args.profile)
+    if args.url:
+        results = run_load(events, HttpTarget(args.url, args.concurrency), profile, concurrency=args.concurrency,
+                           arrivals=args.arrivals, shuffle=args.shuffle, seed=args.seed)
+    else:
+        target = InProcessTarget(latency_ms=parse_latency(args.latency), encoder_latency_ms=args.encoder_latency)
+        # The handler prints every analytics document: keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = run_load(events, target, profile, concurrency=args.concurrency,
+                               arrivals=args.arrivals, shuffle=args.shuffle, seed=args.seed)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
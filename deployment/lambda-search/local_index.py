@@ -0,0 +1,422 @@
+"""
+In-process vector index for SEARCH_BACKEND=local: serves the searches of lambda-search from a local
+index (built by src/build_local_index.py next to a vector artifact) instead of the OpenSearch k-NN index.
+
+LocalIndex.search and LocalIndex.msearch take the request bodies build_semantic_query produces and return
+OpenSearch shaped responses, so semantic_search_neighbors and batch_semantic_search are unchanged:
+    - bool filter and must: ids, wildcard (case-insensitive substring) and term clauses on keyword fields are answered
+      from per-term bitmaps, range and term clauses on dates from date columns (date_range fields from their
+      begin and end columns, with the intersects, within and contains relations), and geo_shape envelopes
+      from each record's bounding box (exact for rectangular footprints).
+    - should: the knn clause is an exact scan of the memory-mapped vectors, or an hnswlib graph search
+      when the artifact has one and the filters keep more than LOCAL_INDEX_EXACT_MAX records; term clauses
+      add their boost. multi_match has no local text index and scores nothing, so hits are the k nearest
+      records among the filtered ones (at least from + size) with a score of at least min_score.
+    - sort, from, size, track_total_hits, and terms aggregations over the matching records.
+Anything else raises ValueError.
+"""
+import os
+import re
+import json
+import mmap
+import time
+import boto3
+import numpy as np
+from os import environ
+from threading import Lock
+from botocore.exceptions import ClientError
+
+# Optional: HNSW graph search, used when the local index ships a graph
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+local_index_path = environ.get('LOCAL_INDEX_PATH', '')  # local artifact prefix (packaged or on EFS)
+local_index_bucket = environ.get('LOCAL_INDEX_BUCKET', '')  # or an S3 artifact, downloaded to /tmp on cold start
+local_index_key = environ.get('LOCAL_INDEX_KEY', '')
+local_index_exact_max = int(environ.get('LOCAL_INDEX_EXACT_MAX', '20000'))  # filtered searches up to this size are exact
+local_index_ef = int(environ.get('LOCAL_INDEX_EF', '128'))
+# Read the vectors into memory as float32 on cold start: float16 artifacts then skip the per-query conversion
+local_index_in_memory = environ.get('LOCAL_INDEX_IN_MEMORY', 'false').lower() == 'true'
+
+# Files of a local index, written by src/build_local_index.py
+VECTORS_SUFFIX = '.vectors.npy'
+DOCUMENTS_SUFFIX = '.documents.jsonl'
+COLUMNS_SUFFIX = '.columns.npz'
+FACETS_SUFFIX = '.facets.npz'
+HNSW_SUFFIX = '.hnsw.bin'
+REQUIRED_SUFFIXES = (VECTORS_SUFFIX, DOCUMENTS_SUFFIX, COLUMNS_SUFFIX, FACETS_SUFFIX)
+
+# _id at the start of each document line
+DOCUMENT_ID_PATTERN = re.compile(rb'^\{"_id":"((?:[^"\\]|\\.)*)"', re.MULTILINE)
+
+# Bits set in each byte value, to count bitmap intersections
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+_local_index = None
+_local_index_lock = Lock()
+
+def field_path(path):
+    """Source path of a mapped field: 'organisation.en.keyword' -> 'organisation.en'."""
+    return path[:-len('.keyword')] if path.endswith('.keyword') else path
+
+def knn_score(similarity):
+    """OpenSearch score of a cosinesimil k-NN hit: 1 / (1 + cosine distance)."""
+    return 1.0 / (2.0 - similarity)
+
+class LocalIndex:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.vectors = np.load(f"{prefix}{VECTORS_SUFFIX}", mmap_mode='r')
+        if local_index_in_memory:
+            self.vectors = np.asarray(self.vectors, dtype=np.float32)
+        self.n_rows = self.vectors.shape[0]
+        columns = np.load(f"{prefix}{COLUMNS_SUFFIX}")
+        self.columns = {name: columns[name] for name in columns.files}
+        self.offsets = self.columns.pop("_offsets")
+        norms = self.columns.pop("_norms")
+        # Zero vectors get an infinite norm, hence a similarity of 0
+        self.inverse_norms = np.where(norms > 0, 1.0 / np.where(norms > 0, norms, 1.0), 0.0).astype(np.float32)
+        facets = np.load(f"{prefix}{FACETS_SUFFIX}")
+        self.facets = {}
+        for name in facets.files:
+            path, _, kind = name.rpartition('.')
+            self.facets.setdefault(path, {})[kind] = facets[name]
+        self.terms_lower = {path: np.char.lower(facet["terms"]) for path, facet in self.facets.items()}
+        documents = open(f"{prefix}{DOCUMENTS_SUFFIX}", 'rb')
+        self.documents = mmap.mmap(documents.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b''
+        documents.close()
+        self.row_by_id = None
+        self.hnsw = None
+        if hnswlib is not None and os.path.exists(f"{prefix}{HNSW_SUFFIX}"):
+            self.hnsw = hnswlib.Index(space='cosine', dim=self.vectors.shape[1])
+            self.hnsw.load_index(f"{prefix}{HNSW_SUFFIX}", max_elements=self.n_rows)
+        if len(self.offsets) != self.n_rows + 1:
+            raise ValueError(f"Local index {prefix} is inconsistent: {len(self.offsets) - 1} documents for {self.n_rows} vectors.")
+
+    def document(self, row):
+        return json.loads(self.documents[self.offsets[row]:self.offsets[row + 1]])
+
+    def has_field(self, field):
+        """True if the local index has a column or facet for field (or for its sub-fields)."""
+        path = field_path(field)
+        return any(name == path or name.startswith(f"{path}.") for name in list(self.columns) + list(self.facets))
+
+    # Filters
+
+    def ids_mask(self, values):
+        """Records with one of the _id values; the _id -> row map is built from the documents on first use."""
+        if self.row_by_id is None:
+            self.row_by_id = {json.loads(b'"' + match.group(1) + b'"'): row
+                              for row, match in enumerate(DOCUMENT_ID_PATTERN.finditer(self.documents))}
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[[self.row_by_id[value] for value in values if value in self.row_by_id]] = True
+        return mask
+
+    def bitmap_mask(self, packed):
+        return np.unpackbits(packed, count=self.n_rows).astype(bool)
+
+    def facet(self, field):
+        facet = self.facets.get(field_path(field))
+        if facet is None:
+            raise ValueError(f"Field '{field}' is not a facet of the local index")
+        return facet
+
+    def wildcard_mask(self, field, spec):
+        value = spec["value"] if isinstance(spec, dict) else spec
+        if not (value.startswith('*') and value.endswith('*')):
+            raise ValueError(f"Only *value* wildcards are supported by the local index, got '{value}'")
+        facet = self.facet(field)
+        needle = value.strip('*')
+        terms = self.terms_lower[field_path(field)] if spec.get("case_insensitive") else facet["terms"]
+        rows = np.flatnonzero(np.char.find(terms, needle.lower() if spec.get("case_insensitive") else needle) >= 0)
+        if not len(rows):
+            return np.zeros(self.n_rows, dtype=bool)
+        return self.bitmap_mask(np.bitwise_or.reduce(facet["bitmaps"][rows], axis=0))
+
+    def term_mask(self, field, spec):
+        value = spec["value"] if isinstance(spec, dict) else spec
+        column = self.columns.get(field_path(field))
+        if column is not None and column.dtype.kind == 'M':
+            try:
+                return column == np.datetime64(str(value)[:10], 'D')
+            except ValueError:
+                return np.zeros(self.n_rows, dtype=bool)
+        facet = self.facet(field)
+        value = ('true' if value else 'false') if isinstance(value, bool) else str(value)
+        rows = np.flatnonzero(facet["terms"] == value)
+        return self.bitmap_mask(facet["bitmaps"][rows[0]]) if len(rows) else np.zeros(self.n_rows, dtype=bool)
+
+    def range_mask(self, field, spec):
+        if "relation" in spec or f"{field_path(field)}.gte" in self.columns:
+            return self.date_range_mask(field, spec)
+        column = self.columns.get(field_path(field))
+        if column is None:
+            raise ValueError(f"Field '{field}' has no local index column for range queries")
+        mask = np.ones(self.n_rows, dtype=bool)
+        for op, compare in (("gte", np.greater_equal), ("gt", np.greater), ("lte", np.less_equal), ("lt", np.less)):
+            if op in spec:
+                bound = np.datetime64(str(spec[op])[:10], 'D') if column.dtype.kind == 'M' else float(spec[op])
+                mask &= compare(column, bound)
+        return mask
+
+    def date_range_mask(self, field, spec):
+        """Range query on a date_range field: its <path>.gte and <path>.lte columns, NaT where the range is open."""
+        path = field_path(field)
+        if f"{path}.gte" not in self.columns:
+            raise ValueError(f"Field '{field}' has no local index columns for date_range queries")
+        begin = self.columns[f"{path}.gte"].view(np.int64)
+        end = self.columns[f"{path}.lte"].view(np.int64)
+        open_begin, open_end = np.isnat(self.columns[f"{path}.gte"]), np.isnat(self.columns[f"{path}.lte"])
+        lowest, highest = np.iinfo(np.int64).min + 1, np.iinfo(np.int64).max
+        begin, end = np.where(open_begin, lowest, begin), np.where(open_end, highest, end)
+        day = lambda value: np.datetime64(str(value)[:10], 'D').astype(np.int64)
+        query_begin = day(spec["gte"]) if "gte" in spec else day(spec["gt"]) + 1 if "gt" in spec else lowest
+        query_end = day(spec["lte"]) if "lte" in spec else day(spec["lt"]) - 1 if "lt" in spec else highest
+        has_range = ~(open_begin & open_end)
+        relation = spec.get("relation", "intersects").lower()
+        if relation == "intersects":
+            return has_range & (begin <= query_end) & (end >= query_begin)
+        if relation == "within":
+            return has_range & (begin >= query_begin) & (end <= query_end)
+        if relation == "contains":
+            return has_range & (begin <= query_begin) & (end >= query_end)
+        raise ValueError(f"Unsupported relation '{relation}'")
+
+    def exists_mask(self, field):
+        """Records with a value in a date_range, date or number column."""
+        path = field_path(field)
+        if f"{path}.gte" in self.columns:
+            return ~(np.isnat(self.columns[f"{path}.gte"]) & np.isnat(self.columns[f"{path}.lte"]))
+        column = self.columns.get(path)
+        if column is None:
+            raise ValueError(f"Field '{field}' has no local index column for exists queries")
+        return ~np.isnat(column) if column.dtype.kind == 'M' else ~np.isnan(column)
+
+    def geo_shape_mask(self, field, spec):
+        shape = spec["shape"]
+        if shape.get("type") != "envelope":
+            raise ValueError("Only envelope geo_shape filters are supported by the local index")
+        (west, north), (east, south) = shape["coordinates"]
+        path = field_path(field)
+        min_lon, min_lat = self.columns[f"{path}.min_lon"], self.columns[f"{path}.min_lat"]
+        max_lon, max_lat = self.columns[f"{path}.max_lon"], self.columns[f"{path}.max_lat"]
+        with np.errstate(invalid='ignore'):
+            intersects = (min_lon <= east) & (max_lon >= west) & (min_lat <= north) & (max_lat >= south)
+            relation = spec.get("relation", "intersects")
+            if relation == "intersects":
+                return intersects
+            if relation == "disjoint":
+                return ~intersects & ~np.isnan(min_lon)
+            if relation == "within":
+                return (min_lon >= west) & (max_lon <= east) & (min_lat >= south) & (max_lat <= north)
+            if relation == "contains":
+                return (min_lon <= west) & (max_lon >= east) & (min_lat <= south) & (max_lat >= north)
+        raise ValueError(f"Unsupported relation '{relation}'")
+
+    def filter_mask(self, clause):
+        """Boolean mask of the records matching a filter clause."""
+        (kind, spec), = clause.items()
+        if kind == "bool":
+            mask = np.ones(self.n_rows, dtype=bool)
+            for sub in spec.get("filter", []) + spec.get("must", []):
+                mask &= self.filter_mask(sub)
+            for sub in spec.get("must_not", []):
+                mask &= ~self.filter_mask(sub)
+            should = spec.get("should", [])
+            if should:
+                any_should = np.zeros(self.n_rows, dtype=bool)
+                for sub in should:
+                    any_should |= self.filter_mask(sub)
+                mask &= any_should
+            return mask
+        if kind == "match_all":
+            return np.ones(self.n_rows, dtype=bool)
+        if kind == "ids":
+            return self.ids_mask(spec.get("values", []))
+        if kind == "exists":
+            return self.exists_mask(spec["field"])
+        (field, value), = spec.items()
+        if kind == "wildcard":
+            return self.wildcard_mask(field, value)
+        if kind == "term":
+            return self.term_mask(field, value)
+        if kind == "range":
+            return self.range_mask(field, value)
+        if kind == "geo_shape":
+            return self.geo_shape_mask(field, value)
+        raise ValueError(f"Unsupported query '{kind}' for the local index")
+
+    # k-NN
+
+    def nearest(self, vector, k, mask=None, chunk_size=16384):
+        """
+        (rows, cosine similarities) of the k records nearest to vector among the mask, best first.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        candidates = int(mask.sum()) if mask is not None else self.n_rows
+        k = min(k, candidates)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if self.hnsw is not None and candidates > local_index_exact_max:
+            self.hnsw.set_ef(max(local_index_ef, k))
+            labels, distances = self.hnsw.knn_query(query, k=k, filter=(lambda label: bool(mask[label])) if mask is not None else None)
+            return labels[0].astype(np.int64), 1.0 - distances[0]
+
+        rows = np.flatnonzero(mask) if mask is not None else None
+        total = len(rows) if rows is not None else self.n_rows
+        best_rows, best_scores = [], []
+        for start in range(0, total, chunk_size):
+            chunk_rows = rows[start:start + chunk_size] if rows is not None else np.arange(start, min(start + chunk_size, total))
+            block = self.vectors[chunk_rows] if rows is not None else self.vectors[start:start + chunk_size]
+            scores = (np.asarray(block, dtype=np.float32) @ query) * self.inverse_norms[chunk_rows]
+            top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+            best_rows.append(chunk_rows[top])
+            best_scores.append(scores[top])
+        best_rows, best_scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        order = np.argsort(-best_scores, kind='stable')[:k]
+        return best_rows[order], best_scores[order]
+
+    # Search
+
+    def sort_rows(self, rows, scores, sort):
+        """rows (and their scores) ordered by an OpenSearch sort list; missing values sort last."""
+        keys = []
+        for spec in reversed(sort or [{"_score": {"order": "desc"}}]):
+            field, options = (spec, {}) if isinstance(spec, str) else next(iter(spec.items()))
+            options = options if isinstance(options, dict) else {"order": options}
+            descending = options.get("order", "desc" if field == "_score" else "asc") == "desc"
+            if field == "_score":
+                values, missing = scores.astype(np.float64), np.zeros(len(rows), dtype=bool)
+            else:
+                column = self.columns.get(field_path(field))
+                if column is None:
+                    raise ValueError(f"Field '{field}' has no local index column to sort on")
+                values = column[rows]
+                if values.dtype.kind == 'M':
+                    missing, values = np.isnat(values), values.astype('int64').astype(np.float64)
+                elif values.dtype.kind == 'f':
+                    missing = np.isnan(values)
+                else:
+                    missing, values = values < 0, values.astype(np.float64)
+            keys.extend([-values if descending else values, missing])
+        order = np.lexsort(keys) if keys else np.arange(len(rows))
+        return rows[order], scores[order]
+
+    def terms_aggregation(self, field, size, packed_mask):
+        facet = self.facet(field)
+        if not len(facet["terms"]):
+            return {"buckets": []}
+        counts = POPCOUNT[facet["bitmaps"] & packed_mask].sum(axis=1, dtype=np.int64)
+        top = [i for i in np.lexsort((facet["terms"], -counts)) if counts[i] > 0][:size]
+        return {
+            "doc_count_error_upper_bound": 0,
+            "sum_other_doc_count": int(counts.sum() - counts[top].sum()) if top else 0,
+            "buckets": [{"key": str(facet["terms"][i]), "doc_count": int(counts[i])} for i in top]
+        }
+
+    def search(self, index=None, body=None, **kwargs):
+        """Run a search body (see the module docstring for the supported subset); OpenSearch response shape."""
+        start = time.perf_counter()
+        body = body or {}
+        query = body.get("query", {"match_all": {}})
+        size, from_param = int(body.get("size", 10)), int(body.get("from", 0))
+
+        knn, boosts = None, []
+        if "bool" in query:
+            spec = query["bool"]
+            mask = self.filter_mask({"bool": {"filter": spec.get("filter", []), "must": spec.get("must", [])}})
+            for clause in spec.get("should", []):
+                (kind, clause_spec), = clause.items()
+                if kind == "knn":
+                    (_, knn), = clause_spec.items()
+                elif kind == "term":
+                    (field, value), = clause_spec.items()
+                    boost = value.get("boost", 1.0) if isinstance(value, dict) else 1.0
+                    boosts.append((self.term_mask(field, value), boost))
+                elif kind != "multi_match":
+                    raise ValueError(f"Unsupported should clause '{kind}' for the local index")
+        else:
+            mask = self.filter_mask(query)
+
+        if knn is not None:
+            rows, similarities = self.nearest(knn["vector"], max(int(knn.get("k", 10)), from_param + size), mask)
+            scores = knn_score(similarities).astype(np.float64)
+            for boost_mask, boost in boosts:
+                scores += boost * boost_mask[rows]
+            if "min_score" in body:
+                keep = scores >= body["min_score"]
+                rows, scores = rows[keep], scores[keep]
+        else:
+            rows = np.flatnonzero(mask)
+            scores = np.zeros(len(rows), dtype=np.float64)
+
+        rows, scores = self.sort_rows(rows, scores, body.get("sort"))
+        hits = []
+        for row, score in zip(rows[from_param:from_param + size], scores[from_param:from_param + size]):
+            document = self.document(row)
+            hits.append({"_index": index, "_id": document["_id"], "_score": float(score), "_source": document["_source"]})
+
+        response = {"hits": {"total": {"value": len(rows), "relation": "eq"},
+                             "max_score": float(scores.max()) if len(scores) else None, "hits": hits}}
+        if body.get("aggs"):
+            matched = np.zeros(self.n_rows, dtype=bool)
+            matched[rows] = True
+            packed_mask = np.packbits(matched)
+            aggregations = {}
+            for name, aggregation in body["aggs"].items():
+                if "terms" not in aggregation:
+                    raise ValueError(f"Unsupported aggregation '{name}' for the local index")
+                aggregations[name] = self.terms_aggregation(aggregation["terms"]["field"], int(aggregation["terms"].get("size", 10)), packed_mask)
+            response["aggregations"] = aggregations
+        response["took"] = round((time.perf_counter() - start) * 1000)
+        response["timed_out"] = False
+        return response
+
+    def msearch(self, body=None, index=None, **kwargs):
+        """Run a list of (header, body) pairs, like the _msearch API; failed searches get an error item."""
+        body = body or []
+        responses = []
+        start = time.perf_counter()
+        for header, search_body in zip(body[0::2], body[1::2]):
+            try:
+                responses.append(self.search(index=header.get("index", index), body=search_body))
+            except ValueError as e:
+                responses.append({"error": {"type": "local_index_exception", "reason": str(e)}, "status": 400})
+        return {"took": round((time.perf_counter() - start) * 1000), "responses": responses}
+
+def download_local_index(bucket, key_prefix, local_dir='/tmp'):
+    """
+    Download a local index from S3 to local_dir; the HNSW graph is optional.
+
+    Returns:
+        str: Local prefix to open with LocalIndex.
+    """
+    s3_client = boto3.client('s3')
+    prefix = os.path.join(local_dir, os.path.basename(key_prefix))
+    for suffix in REQUIRED_SUFFIXES + (HNSW_SUFFIX,):
+        if os.path.exists(f"{prefix}{suffix}"):
+            continue
+        try:
+            s3_client.download_file(bucket, f"{key_prefix}{suffix}", f"{prefix}{suffix}")
+        except ClientError:
+            if suffix in REQUIRED_SUFFIXES:
+                raise
+    return prefix
+
+def get_local_index():
+    """
+    Local index of the container, opened on first use from LOCAL_INDEX_PATH or downloaded from
+    LOCAL_INDEX_BUCKET / LOCAL_INDEX_KEY.
+    """
+    global _local_index
+    with _local_index_lock:
+        if _local_index is None:
+            prefix = local_index_path or download_local_index(local_index_bucket, local_index_key)
+            start = time.perf_counter()
+            _local_index = LocalIndex(prefix)
+            print(f"Opened local index {prefix}: {_local_index.n_rows} records in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return _local_index
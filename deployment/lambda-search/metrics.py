@@ -0,0 +1,59 @@
+import json
+import time
+from os import environ
+from contextlib import contextmanager
+
+metrics_namespace = environ.get('METRICS_NAMESPACE', 'SemanticSearch')
+
+@contextmanager
+def timed(timings, phase):
+    """
+    Record the wall time of the enclosed block in timings[phase], in milliseconds.
+
+    Usage:
+        with timed(timings, "embedding"):
+            features = invoke_sagemaker_endpoint(...)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = round((time.perf_counter() - start) * 1000, 3)
+
+def emit_metrics(timings, dimensions, counts=None, namespace=None):
+    """
+    Print the request timings as a CloudWatch Embedded Metric Format (EMF) record.
+
+    Lambda forwards stdout to CloudWatch Logs, which turns EMF records into metrics
+    without any PutMetricData call on the request path.
+
+    Args:
+        timings (dict): Phase name -> duration in milliseconds; None values are skipped.
+        dimensions (dict): Dimension name -> value (e.g. {"method": "SemanticSearch"}).
+        counts (dict): Optional metric name -> count (e.g. {"total_hits": 61}); None values are skipped.
+        namespace (str): CloudWatch namespace, defaults to METRICS_NAMESPACE.
+
+    Returns:
+        dict: The EMF record that was printed.
+    """
+    # Missing values (e.g. opensearch_took of a failed search) are left out: EMF rejects a null metric value
+    timings = {phase: value for phase, value in timings.items() if value is not None}
+    counts = {name: value for name, value in (counts or {}).items() if value is not None}
+    metrics = [{"Name": f"{phase}_ms", "Unit": "Milliseconds"} for phase in timings]
+    metrics += [{"Name": name, "Unit": "Count"} for name in counts]
+
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": namespace or metrics_namespace,
+                "Dimensions": [list(dimensions)],
+                "Metrics": metrics
+            }]
+        }
+    }
+    record.update({str(name): str(value) for name, value in dimensions.items()})
+    record.update({f"{phase}_ms": value for phase, value in timings.items()})
+    record.update(counts)
+    print(json.dumps(record))
+    return record
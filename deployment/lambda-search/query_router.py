@@ -0,0 +1,113 @@
+"""
+Query routing for SemanticSearch: identifier and exact-match queries skip the encoder and the k-NN clause.
+
+route_query(q) returns (route, clause). The route is recorded in the analytics document. The clause
+is a query added to the search's bool must, None for the semantic route:
+    id        the query is one or more record UUIDs: ids query (records are indexed with their id as _id)
+    exact     the query is quoted: phrase match on the title, keyword and description fields
+    keyword   a single short code (a token with both digits and letters): BM25 match with no k-NN clause
+    semantic  everything else: embedded and searched with the hybrid k-NN query, as before
+Rules are tried in QUERY_ROUTER_RULES order (empty disables the rules). When they all fall through, the
+optional QUERY_ROUTER_MODEL (a JSON logistic model over query_features) can still route the query to
+exact (phrase match of the whole query) or keyword.
+"""
+import re
+import json
+import math
+from os import environ
+
+query_router_rules = [rule.strip() for rule in environ.get('QUERY_ROUTER_RULES', 'id,exact,keyword').split(',') if rule.strip()]
+query_router_model_path = environ.get('QUERY_ROUTER_MODEL', '')  # JSON file packaged with the lambda; empty disables the model
+
+UUID_PATTERN = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+IDS_PATTERN = re.compile(rf'^\s*{UUID_PATTERN.pattern}(\s*[,;\s]\s*{UUID_PATTERN.pattern})*\s*$')
+QUOTED_PATTERN = re.compile(r'^\s*["“«]\s*(.+?)\s*["”»]\s*$')
+# One token with both digits and letters (31G04, RCM-1, S1A), in any case. Plain words and acronyms
+# stay semantic whatever their case, and so do numbers and dates (2020, 2020-01)
+SHORT_CODE_PATTERN = re.compile(r'^(?=[^\s]*\d)(?=[^\s]*[A-Za-z])[A-Za-z0-9][A-Za-z0-9._:/-]{0,31}$')
+
+# Fields of the BM25 clause of the hybrid query, reused by the exact and keyword routes
+TEXT_FIELDS = ["*topicCategory*", "*keywords*^5", "*description*^15", "*title*^10", "*organisation*", "*systemName*", "*id*^5"]
+PHRASE_FIELDS = ["*title*^10", "*keywords*^5", "*description*"]
+
+_model = None
+_model_loaded = False
+
+def ids_clause(query_text):
+    return {"ids": {"values": UUID_PATTERN.findall(query_text)}}
+
+def exact_clause(query_text):
+    quoted = QUOTED_PATTERN.match(query_text)
+    phrase = quoted.group(1) if quoted else query_text.strip()
+    return {"multi_match": {"query": phrase, "type": "phrase", "fields": PHRASE_FIELDS}}
+
+def keyword_clause(query_text):
+    return {"multi_match": {"query": query_text.strip(), "type": "best_fields", "fields": TEXT_FIELDS}}
+
+# Rule name -> (predicate, clause builder)
+RULES = {
+    "id": (lambda text: IDS_PATTERN.match(text) is not None, ids_clause),
+    "exact": (lambda text: QUOTED_PATTERN.match(text) is not None, exact_clause),
+    "keyword": (lambda text: SHORT_CODE_PATTERN.match(text.strip()) is not None, keyword_clause),
+}
+
+# Routes the model can pick: identifiers are left to the id rule
+MODEL_ROUTES = ("exact", "keyword")
+
+def query_features(query_text):
+    """Numeric features of a query for the optional routing model."""
+    text = query_text.strip()
+    tokens = text.split()
+    n_chars = max(len(text), 1)
+    return {
+        "tokens": len(tokens),
+        "chars": len(text),
+        "digit_ratio": sum(c.isdigit() for c in text) / n_chars,
+        "upper_ratio": sum(c.isupper() for c in text) / n_chars,
+        "punct_ratio": sum(not c.isalnum() and not c.isspace() for c in text) / n_chars,
+        "mean_token_length": sum(len(token) for token in tokens) / len(tokens) if tokens else 0.0,
+    }
+
+def load_model(path=None):
+    """
+    Routing model of QUERY_ROUTER_MODEL, loaded once per container:
+    {"route": "keyword", "threshold": 0.5, "bias": -1.2, "weights": {"tokens": -0.8, "digit_ratio": 3.1, ...}}
+    """
+    global _model, _model_loaded
+    if not _model_loaded:
+        path = path or query_router_model_path
+        if path:
+            with open(path) as file:
+                _model = json.load(file)
+            if _model.get("route") not in MODEL_ROUTES:
+                raise ValueError(f"Routing model route must be one of {MODEL_ROUTES}, got {_model.get('route')}")
+        _model_loaded = True
+    return _model
+
+def model_probability(model, query_text):
+    features = query_features(query_text)
+    score = model.get("bias", 0.0) + sum(weight * features.get(name, 0.0) for name, weight in model.get("weights", {}).items())
+    return 1.0 / (1.0 + math.exp(-score))
+
+def route_query(query_text, routes=None):
+    """
+    Route of a query and its must clause (None for semantic).
+
+    Args:
+        query_text (str): The q parameter.
+        routes (iterable): Routes the search backend can serve; defaults to every route.
+
+    Returns:
+        (route, clause)
+    """
+    if not query_text or not query_text.strip():
+        return "semantic", None
+    allowed = set(RULES) if routes is None else set(routes)
+    for name in query_router_rules:
+        predicate, build_clause = RULES.get(name, (None, None))
+        if predicate is not None and name in allowed and predicate(query_text):
+            return name, build_clause(query_text)
+    model = load_model()
+    if model is not None and model["route"] in allowed and model_probability(model, query_text) >= model.get("threshold", 0.5):
+        return model["route"], RULES[model["route"]][1](query_text)
+    return "semantic", None
@@ -0,0 +1,127 @@
+"""
+Cache warmup entry point, deployed from the lambda-search package with handler warmup.lambda_handler.
+
+Replays the most frequent recent query and filter combinations from the analytics indices through
+app.lambda_handler. This computes their embeddings into the shared embedding cache (EMBEDDING_CACHE_INDEX),
+which every search container reads, and warms the k-NN graphs and caches of the OpenSearch index.
+Run it on a schedule and after every reindex or endpoint deploy (Create_Opensearch_index.py --warmup_function).
+Pass {"refresh_embeddings": true} after a model change to recompute cached embeddings.
+"""
+import time
+from os import environ
+
+import app
+from dashboard import ANALYTICS_TO_EVENT
+from embedding_cache import embedding_cache_index
+
+def text_fields(os_client, index):
+    """
+    ANALYTICS_TO_EVENT fields mapped as text in index. The legacy single index was created without
+    some of them, so they were mapped dynamically as text with a .keyword sub-field.
+    """
+    response = os_client.indices.get_field_mapping(index=index, fields=",".join(ANALYTICS_TO_EVENT),
+                                                   ignore_unavailable=True, allow_no_indices=True)
+    fields = set()
+    for index_mapping in response.values():
+        for full_name, field_mapping in index_mapping.get("mappings", {}).items():
+            if any(mapping.get("type") == "text" for mapping in field_mapping.get("mapping", {}).values()):
+                fields.add(full_name)
+    return fields
+
+def top_query_combinations(os_client, index_pattern, days=7, top_n=100, page_size=1000, max_pages=20, text_fields=()):
+    """
+    Most frequent (method, q, lang, filters, sort, size) combinations of the last `days` days.
+
+    A composite aggregation pages through every distinct combination (missing values included),
+    up to max_pages pages, and the combinations are then ranked by document count. Fields in
+    text_fields are aggregated on their .keyword sub-field.
+
+    Returns:
+        list: (combination dict keyed by analytics field, count) tuples, most frequent first.
+    """
+    sources = [{field: {"terms": {"field": f"{field}.keyword" if field in text_fields else field, "missing_bucket": True}}}
+               for field in ANALYTICS_TO_EVENT]
+    body = {
+        "size": 0,
+        "query": {"range": {"timestamp": {"gte": f"now-{days}d"}}},
+        "aggs": {"combinations": {"composite": {"size": page_size, "sources": sources}}}
+    }
+
+    combinations = []
+    for _ in range(max_pages):
+        response = os_client.search(index=index_pattern, body=body, ignore_unavailable=True, allow_no_indices=True)
+        shards = response.get("_shards", {})
+        if shards.get("failed"):
+            print(f"Warning: the combinations of {index_pattern} failed on {shards['failed']} of {shards.get('total')} shards: {shards.get('failures')}")
+        aggregation = response.get("aggregations", {}).get("combinations", {})
+        combinations.extend((bucket["key"], bucket["doc_count"]) for bucket in aggregation.get("buckets", []))
+        after_key = aggregation.get("after_key")
+        if not after_key:
+            break
+        body["aggs"]["combinations"]["composite"]["after"] = after_key
+
+    combinations.sort(key=lambda item: item[1], reverse=True)
+    return combinations[:top_n]
+
+def merge_combinations(*combination_lists, top_n=100):
+    """
+    Sum the counts of the same combination across the lists of top_query_combinations, most frequent first.
+    """
+    counts = {}
+    for combinations in combination_lists:
+        for combination, count in combinations:
+            key = tuple(sorted(combination.items(), key=lambda item: item[0]))
+            counts[key] = counts.get(key, 0) + count
+    merged = [(dict(key), count) for key, count in counts.items()]
+    merged.sort(key=lambda item: item[1], reverse=True)
+    return merged[:top_n]
+
+def warmup_event(combination, refresh_embeddings=False):
+    """
+    lambda-search event replaying an analytics combination, flagged so it is not logged as traffic.
+    """
+    event = {event_key: combination.get(field) or '' for field, event_key in ANALYTICS_TO_EVENT.items()}
+    event["method"] = event["method"] or "SemanticSearch"
+    event["warmup"] = True
+    event["refresh_embeddings"] = refresh_embeddings
+    return event
+
+def lambda_handler(event, context):
+    """
+    Replay the top-N recent query combinations to prime the embedding and search caches.
+
+    Event (all optional): top_n, days, refresh_embeddings.
+    """
+    event = event or {}
+    top_n = int(event.get('top_n', environ.get('WARMUP_TOP_N', '100')))
+    days = int(event.get('days', environ.get('WARMUP_DAYS', '7')))
+    refresh_embeddings = bool(event.get('refresh_embeddings', False))
+
+    os_client = app.get_os_client()
+    if embedding_cache_index:
+        print(f"Warming the shared embedding cache {embedding_cache_index}")
+    else:
+        print("WARNING: EMBEDDING_CACHE_INDEX is empty, so the shared embedding cache is disabled and "
+              "only this container's embeddings and the OpenSearch caches are warmed")
+
+    # The single index (all of the history with ANALYTICS_INDEX_PERIOD=none, or until the first periodic
+    # index) and the periodic indices are aggregated apart, since their mappings of some fields differ
+    combinations = merge_combinations(*[
+        top_query_combinations(os_client, index, days=days, top_n=None, text_fields=text_fields(os_client, index))
+        for index in (app.search_index_name, f"{app.search_index_name}-2*")
+    ], top_n=top_n)
+    print(f"Warming {len(combinations)} query combinations from the last {days} days")
+
+    start = time.perf_counter()
+    warmed, failed = 0, 0
+    for combination, count in combinations:
+        try:
+            app.lambda_handler(warmup_event(combination, refresh_embeddings), context)
+            warmed += 1
+        except Exception as e:
+            print(f"Error warming {combination} ({count} requests): {e}")
+            failed += 1
+
+    summary = {"warmed": warmed, "failed": failed, "seconds": round(time.perf_counter() - start, 3)}
+    print("Warmup complete:", summary)
+    return summary
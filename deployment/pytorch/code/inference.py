@@ -8,6 +8,8 @@ import json
 import io
 import time
 import torch
+import numpy as np
+import torch.nn.functional as F
 from transformers import AutoTokenizer, AutoModel
 # from sentence_transformers import models, losses, SentenceTransformer
 
@@ -34,6 +36,24 @@ def embed_tformer(model, tokenizer, sentences):
     sentence_embeddings = mean_pooling(model_output, encoded_input['attention_mask'])
     return sentence_embeddings
 
+# Dimensionality reduction fitted by src/dimensionality_reduction.py, packaged with the model
+PROJECTION_FILENAME = 'projection.npz'
+
+def load_projection(model_dir, device):
+    path = os.path.join(model_dir, PROJECTION_FILENAME)
+    if not os.path.exists(path):
+        return None
+    data = np.load(path)
+    logger.info('Projecting embeddings to %d dimensions (%s)', data['components'].shape[1], str(data['method']))
+    return {'mean': torch.from_numpy(data['mean']).to(device), 'components': torch.from_numpy(data['components']).to(device)}
+
+def apply_projection(sentence_embeddings, projection):
+    """Project embeddings like the stored document vectors: normalize, centre, project, normalize."""
+    if projection is None:
+        return sentence_embeddings
+    sentence_embeddings = F.normalize(sentence_embeddings, p=2, dim=1)
+    return F.normalize((sentence_embeddings - projection['mean']) @ projection['components'], p=2, dim=1)
+
 def model_fn(model_dir):
     logger.info('model_fn')
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -41,15 +61,33 @@ def model_fn(model_dir):
     tokenizer = AutoTokenizer.from_pretrained(model_dir)
     nlp_model = AutoModel.from_pretrained(model_dir)
     nlp_model.to(device)
-    model = {'model':nlp_model, 'tokenizer':tokenizer}
+    model = {'model':nlp_model, 'tokenizer':tokenizer, 'projection': load_projection(model_dir, device)}
 
     return model
 
+# Largest number of sentences encoded in one forward pass
+BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', '64'))
+
 # Deserialize the Invoke request body into an object we can perform prediction on
 def input_fn(serialized_input_data, content_type='text/plain'):
+    """
+    text/plain: a single sentence, embedded as one vector (the search lambda's query path).
+    application/json: a list of sentences, or {"inputs": [...]}, embedded as one vector per sentence.
+    """
     logger.info('Deserializing the input data.')
+    if isinstance(serialized_input_data, bytes):
+        serialized_input_data = serialized_input_data.decode('utf-8')
+    if content_type == 'application/json':
+        data = json.loads(serialized_input_data)
+        if isinstance(data, dict):
+            data = data.get('inputs')
+        if isinstance(data, str):
+            data = [data]
+        if not isinstance(data, list) or not all(isinstance(sentence, str) for sentence in data):
+            raise Exception('application/json input must be a list of strings or {"inputs": [...]}')
+        return {'sentences': data, 'batch': True}
     try:
-        data = [serialized_input_data.decode('utf-8')]
+        data = [serialized_input_data]
         return data
     except:
         raise Exception('Requested unsupported ContentType in content_type: {}'.format(content_type))
@@ -58,7 +96,18 @@ def input_fn(serialized_input_data, content_type='text/plain'):
 def predict_fn(input_object, model):
     logger.info("Calling model")
     start_time = time.time()
+    if isinstance(input_object, dict) and input_object.get('batch'):
+        # Batches are encoded in chunks of BATCH_SIZE to bound padding and memory
+        sentences = input_object['sentences']
+        response = []
+        for i in range(0, len(sentences), BATCH_SIZE):
+            sentence_embeddings = embed_tformer(model['model'], model['tokenizer'], sentences[i:i + BATCH_SIZE])
+            sentence_embeddings = apply_projection(sentence_embeddings, model.get('projection'))
+            response.extend(sentence_embeddings.tolist())
+        print("--- Inference time: %s seconds for %d sentences ---" % (time.time() - start_time, len(sentences)))
+        return response
     sentence_embeddings = embed_tformer(model['model'], model['tokenizer'], input_object)
+    sentence_embeddings = apply_projection(sentence_embeddings, model.get('projection'))
     print("--- Inference time: %s seconds ---" % (time.time() - start_time))
     response = sentence_embeddings[0].tolist()
     return response
@@ -6,11 +6,20 @@
 # from urllib.parse import urlparse
 # from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
 from opensearch import get_awsauth_from_secret, create_opensearch_connection, delete_aos_index_if_exists, load_data_to_opensearch_index
+from opensearch import versioned_index_name, validate_index, warm_index, swap_alias, cleanup_old_generations
+from opensearch import get_alias_indices, sync_data_to_opensearch_index, invoke_warmup_function
+from opensearch import EXTENT_FIELD, EXTENT_SIDES, FOOTPRINT_FIELD
+from temporal_extent import TEMPORAL_RANGE_FIELD
 from Preprocess_and_embed_text import read_parquet_from_s3_as_df
+from vector_store import download_vector_store, load_vector_store
 import argparse
 
+# Index sort of --index_sort; the field must be mapped when the index is created
+INDEX_SORT_FIELD = "popularity"
+INDEX_SORT_ORDER = "desc"
 
-def main(region, aos_host, os_secret_id, bucket, filename):
+
+def main(region, aos_host, os_secret_id, bucket, filename, local_dir='/tmp', alias="mpnet-mpf-knn", retention=2, sample_queries=("wildfire", "flood", "elevation"), mode="rebuild", warmup_function=None, index_sort=False, footprint_tolerance=None, embedding_version=''):
     awsauth = get_awsauth_from_secret(region, secret_id=os_secret_id)
     aos_client = create_opensearch_connection(aos_host, awsauth)
 
@@ -18,7 +27,8 @@ def main(region, aos_host, os_secret_id, bucket, filename):
         print("Unable to create OpenSearch client.")
         return
 
-    index_name = "mpnet-mpf-knn"
+    # Searches go through the alias; each build gets its own versioned index behind it
+    index_name = versioned_index_name(alias)
     knn_index = {
         "settings": {
             "index.knn": True,
@@ -42,26 +52,92 @@ def main(region, aos_host, os_secret_id, bucket, filename):
                 "coordinates": {
                     "type": "geo_shape",
                     "store": True
+                },
+                "content_hash": {
+                    "type": "keyword"
+                },
+                TEMPORAL_RANGE_FIELD: {
+                    "type": "date_range",
+                    "format": "yyyy-MM-dd"
+                },
+                EXTENT_FIELD: {
+                    "properties": {side: {"type": "double"} for side in EXTENT_SIDES}
                 }
             }
         }
     }
 
+    #Sort the segments by popularity: browse queries sorted the same way (INDEX_SORT_FIELD in lambda-search)
+    #stop after from + size documents per segment instead of collecting every match
+    if index_sort:
+        knn_index["settings"]["index.sort.field"] = INDEX_SORT_FIELD
+        knn_index["settings"]["index.sort.order"] = INDEX_SORT_ORDER
+        knn_index["mappings"]["properties"][INDEX_SORT_FIELD] = {"type": "long"}
+
+    #Simplified footprints: a lighter geo_shape for spatial filters; shapes the simplification breaks are skipped, not the record
+    if footprint_tolerance:
+        knn_index["mappings"]["properties"][FOOTPRINT_FIELD] = {"type": "geo_shape", "ignore_malformed": True}
+
     #Read the embedding data from the S3 bucket 
-    df_en = read_parquet_from_s3_as_df(region, bucket, filename)
+    if filename.endswith('.parquet'):
+        # Legacy format: vectors stored as a list column inside the parquet
+        df_en = read_parquet_from_s3_as_df(region, bucket, filename)
+        vectors = None
+    else:
+        # Vector artifact: memory-map the vectors and metadata instead of loading them
+        artifact_prefix = download_vector_store(region, bucket, filename, local_dir=local_dir)
+        df_en, vectors = load_vector_store(artifact_prefix)
+        print(f"Loaded vector artifact {filename}: {vectors.shape[0]} vectors of dimension {vectors.shape[1]} ({vectors.dtype})")
 
+    #The index dimension follows the vectors, so projected artifacts (dimensionality_reduction.py) index as they are
+    if vectors is not None:
+        knn_index["mappings"]["properties"]["vector"]["dimension"] = int(vectors.shape[1])
+    elif len(df_en):
+        knn_index["mappings"]["properties"]["vector"]["dimension"] = len(df_en["vector"].iloc[0])
+    #Content hashes cover the embedding version, with the dimension so a new projection reindexes every record
+    embedding_version = f"{embedding_version}/{knn_index['mappings']['properties']['vector']['dimension']}"
 
-    #Delete index if it exists 
-    delete_aos_index_if_exists(aos_client, index_to_delete=index_name)
+    if mode == "sync":
+        #Apply only the delta to the live generation behind the alias
+        live_indices = get_alias_indices(aos_client, alias)
+        if len(live_indices) != 1:
+            print(f"Sync needs alias {alias} to point at exactly one index, found {live_indices}. Run a rebuild first.")
+            return
+        #Fields added to the mapping since the live generation was created must be mapped before documents carry them
+        added_fields = [TEMPORAL_RANGE_FIELD, EXTENT_FIELD] + ([FOOTPRINT_FIELD] if footprint_tolerance else [])
+        aos_client.indices.put_mapping(index=live_indices[0], body={"properties": {field: knn_index["mappings"]["properties"][field] for field in added_fields}})
+        sync_data_to_opensearch_index(df_en, aos_client, live_indices[0], vectors=vectors, footprint_tolerance=footprint_tolerance,
+                                      embedding_version=embedding_version)
+        if warmup_function:
+            invoke_warmup_function(region, warmup_function)
+        return
 
-    #Create a index 
+    #Create a new index generation
     response = aos_client.indices.create(index=index_name,body=knn_index,ignore=400)
     print(f'Index creation response: {response}')
 
     #Load data to OpenSearch Index 
-    load_data_to_opensearch_index(df_en, aos_client, index_name)
-    res = aos_client.search(index=index_name, body={"query": {"match_all": {}}})
-    print(f"Records loaded into the index {index_name} is {res['hits']['total']['value']}.")
+    load_data_to_opensearch_index(df_en, aos_client, index_name, vectors=vectors, footprint_tolerance=footprint_tolerance,
+                                  embedding_version=embedding_version)
+
+    #Validate the new generation before it takes traffic
+    sample_vector = vectors[0].astype('float32').tolist() if vectors is not None and len(vectors) else None
+    if not validate_index(aos_client, index_name, expected_count=len(df_en), sample_queries=sample_queries, sample_vector=sample_vector):
+        print(f"Index {index_name} failed validation, alias {alias} is left unchanged.")
+        delete_aos_index_if_exists(aos_client, index_to_delete=index_name)
+        return
+
+    #Warm the new generation, then atomically switch the alias over to it
+    warm_index(aos_client, index_name, sample_queries=sample_queries)
+    swap_alias(aos_client, alias, index_name)
+
+    #Apply the retention policy to older generations
+    expired = cleanup_old_generations(aos_client, alias, keep=retention)
+    print(f"Records loaded into the index {index_name} behind alias {alias}; removed old generations: {expired}")
+
+    #Replay the most frequent recent queries against the new generation
+    if warmup_function:
+        invoke_warmup_function(region, warmup_function)
     
 
 if __name__ == "__main__":
@@ -69,12 +145,25 @@ if __name__ == "__main__":
     parser.add_argument('--region', type=str, required=True, help='AWS region')
     parser.add_argument('--aos_host', type=str, required=True, help='OpenSearch host')
     parser.add_argument('--os_secret_id', type=str, required=True, help='OpenSearch Secret ID')
-    parser.add_argument('--bucekt', type=str, required=True, help='embedding data S3 bucket')
-    parser.add_argument('--filename', type=str, required=True, help='embedding data filename')
+    parser.add_argument('--bucket', '--bucekt', dest='bucket', type=str, required=True, help='embedding data S3 bucket')
+    parser.add_argument('--filename', type=str, required=True, help='embedding data filename (.parquet) or vector artifact key prefix')
+    parser.add_argument('--local_dir', type=str, default='/tmp', help='Local directory the vector artifact is downloaded to')
+    parser.add_argument('--alias', type=str, default='mpnet-mpf-knn', help='Index alias searched by the lambda')
+    parser.add_argument('--retention', type=int, default=2, help='Number of index generations to keep')
+    parser.add_argument('--mode', type=str, default='rebuild', choices=['rebuild', 'sync'], help='rebuild a new index generation, or sync the delta into the live one')
+    parser.add_argument('--sample_queries', type=str, default='wildfire,flood,elevation', help='Comma separated queries used to validate and warm a new index')
+    parser.add_argument('--index_sort', action='store_true', help=f'Sort the index by {INDEX_SORT_FIELD} ({INDEX_SORT_ORDER}) so browse queries terminate early')
+    parser.add_argument('--footprint_tolerance', type=float, default=None, help='Also index a footprint simplified to this tolerance (degrees) for spatial filters')
+    parser.add_argument('--warmup_function', type=str, default=None, help='lambda-search warmup function to invoke once the index is live')
+    parser.add_argument('--embedding_version', type=str, default='', help='Embedding model of the vectors (e.g. its name); changing it makes a sync reindex every record')
 
     args = parser.parse_args()
 
-    main(region=args.region, aos_host=args.aos_host, os_secret_id=args.os_secret_id, bucket=args.bucket, filename=args.filename)
+    main(region=args.region, aos_host=args.aos_host, os_secret_id=args.os_secret_id, bucket=args.bucket, filename=args.filename,
+         local_dir=args.local_dir, alias=args.alias, retention=args.retention,
+         sample_queries=[q.strip() for q in args.sample_queries.split(',') if q.strip()], mode=args.mode,
+         warmup_function=args.warmup_function, index_sort=args.index_sort,
+         footprint_tolerance=args.footprint_tolerance, embedding_version=args.embedding_version)
 
 #bucekt ='webpresence-nlp-data-preprocessing-dev'
 #filename='semantic_search_embeddings.parquet'
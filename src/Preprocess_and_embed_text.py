@@ -1,127 +1,266 @@
+import os
+import logging
 import pandas as pd 
+import pyarrow as pa
+import pyarrow.compute as pc
 from sentence_transformers import SentenceTransformer, util
 import boto3
 import torch
 import argparse
 from tqdm import tqdm
-from io import BytesIO
+import fast_json
 from inference import model_fn, predict_fn
+from temporal_extent import temporal_range, TEMPORAL_RANGE_FIELD
+from parquet_io import count_parquet_rows, iter_parquet_batches, parquet_writer, read_parquet_schema
+from vector_store import ROW_ID_COLUMN, add_row_ids, create_vector_file, vector_store_paths, upload_vector_store
+
+SOURCE_FILES = ['records.parquet', 'sentinel1.parquet']
+
+COL_NAMES_LIST = [
+    'features_properties_id', 'features_geometry_coordinates', 'features_properties_title_en',
+    'features_properties_description_en', 'features_properties_date_published_date',
+    'features_properties_keywords_en', 'features_properties_options', 'features_properties_contact',
+    'features_properties_topicCategory', 'features_properties_date_created_date',
+    'features_properties_spatialRepresentation', 'features_properties_type',
+    'features_properties_temporalExtent_begin', 'features_properties_temporalExtent_end',
+    'features_properties_graphicOverview', 'features_properties_language', 'features_popularity',
+    'features_properties_sourceSystemName', 'features_properties_eoCollection',
+    'features_properties_eoFilters'
+]
+
+# Schema of the metadata file, fixed up front so every streamed batch is written with the same types
+METADATA_SCHEMA = pa.schema(
+    [(name, pa.string()) for name in COL_NAMES_LIST
+     if name not in ('features_properties_temporalExtent_begin', 'features_properties_temporalExtent_end', 'features_popularity')]
+    + [
+        ('features_popularity', pa.int64()),
+        ('organisation_en', pa.string()),
+        ('temporalExtent', pa.struct([('begin', pa.string()), ('end', pa.string())])),
+        (TEMPORAL_RANGE_FIELD, pa.struct([('gte', pa.string()), ('lte', pa.string())])),
+        ('text', pa.string()),
+        (ROW_ID_COLUMN, pa.int64()),
+    ]
+)
+CLEANED_SCHEMA = METADATA_SCHEMA.remove(METADATA_SCHEMA.get_field_index(ROW_ID_COLUMN))
+
+# Columns holding stringified JSON, parsed exactly once in clean_records
+JSON_COLUMNS = [
+    'features_geometry_coordinates', 'features_properties_options', 'features_properties_contact',
+    'features_properties_graphicOverview', 'features_properties_eoFilters'
+]
 
 # Load metadata
-def read_parquet_from_s3_as_df(region, s3_bucket, s3_key):
+def read_parquet_from_s3_as_df(region, s3_bucket, s3_key, columns=None, batch_size=10000):
     """
     Load a Parquet file from an S3 bucket into a pandas DataFrame.
+    The file is streamed by row group instead of being downloaded into memory first;
+    use iter_parquet_batches directly to process it with bounded memory.
 
     Parameters:
     - region: AWS region where the S3 bucket is located.
     - s3_bucket: Name of the S3 bucket.
     - s3_key: Key (path) to the Parquet file within the S3 bucket.
+    - columns: Optional list of columns to read.
+    - batch_size: Number of rows fetched per batch.
 
     Returns:
     - df: pandas DataFrame containing the data from the Parquet file.
     """
-
-    # Setup AWS session and clients
-    session = boto3.Session(region_name=region)
-    s3 = session.resource('s3')
-
-    # Load the Parquet file as a pandas DataFrame
-    object = s3.Object(s3_bucket, s3_key)
-    body = object.get()['Body'].read()
-    df = pd.read_parquet(io.BytesIO(body))
-    return df
+    uri = f"s3://{s3_bucket}/{s3_key}"
+    batches = list(iter_parquet_batches(uri, batch_size=batch_size, columns=columns, region=region))
+    # A file without rows yields no batches, so its schema comes from the footer
+    schema = batches[0].schema if batches else read_parquet_schema(uri, columns=columns, region=region)
+    return pa.Table.from_batches(batches, schema=schema).to_pandas()
 
 
 # Upload the duplicate date to S3 as a parquet file 
-def upload_df_to_s3_as_parquet(df, bucket_name, file_key):
-    # Save DataFrame as a Parquet file locally
-    parquet_file_path = 'temp.parquet'
-    df.to_parquet(parquet_file_path)
-
-    # Create an S3 client
-    s3_client = boto3.client('s3')
-
-    # Upload the Parquet file to S3 bucket
+def upload_df_to_s3_as_parquet(df, bucket_name, file_key, region=None):
+    """
+    Stream a DataFrame to S3 as a parquet file using a multipart upload,
+    without writing a temporary local file.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
     try:
-        response = s3_client.upload_file(parquet_file_path, bucket_name, file_key)
-        os.remove(parquet_file_path)
+        with parquet_writer(f"s3://{bucket_name}/{file_key}", table.schema, region=region) as writer:
+            writer.write_table(table)
         print(f'Uploading {file_key} to {bucket_name} as parquet file')
-        # Delete the local Parquet file
         return True
-    except ClientError as e:
+    except (OSError, pa.ArrowException) as e:
         logging.error(e)
         return False
 
 #Extract organization from contact json, English only 
+def organisation_en_from_contact(contact_data):
+    """
+    Extract the English organisation name from an already parsed contact object.
+    """
+    # If the parsed data is a list, iterate through it
+    if isinstance(contact_data, list):
+        for item in contact_data:
+            # Check if 'organisation' and 'en' keys exist
+            if isinstance(item, dict) and isinstance(item.get('organisation'), dict) and 'en' in item['organisation']:
+                return item['organisation']['en']
+    elif isinstance(contact_data, dict):
+        # If the data is a dictionary, extract 'organisation' in 'en' directly
+        organisation = contact_data.get('organisation') or {}
+        return organisation.get('en', None) if isinstance(organisation, dict) else None
+    return None
+
+
 def extract_organisation_en(contact_str):
     try:
         # Parse the stringified JSON into Python objects
-        contact_data = json.loads(contact_str)
-        # If the parsed data is a list, iterate through it
-        if isinstance(contact_data, list):
-            for item in contact_data:
-                # Check if 'organisation' and 'en' keys exist
-                if 'organisation' in item and 'en' in item['organisation']:
-                    return item['organisation']['en']
-        elif isinstance(contact_data, dict):
-            # If the data is a dictionary, extract 'organisation' in 'en' directly
-            return contact_data.get('organisation', {}).get('en', None)
-    except json.JSONDecodeError:
+        return organisation_en_from_contact(fast_json.loads(contact_str))
+    except (ValueError, TypeError):
         # Handle cases where the contact string is not valid JSON
         return None
-    except Exception as e:
-        # Catch-all for any other unexpected errors
-        return f"Error: {str(e)}"
+
+
+def parse_json_column(column):
+    """
+    Parse every value of a column of JSON strings exactly once.
+
+    Every value is wrapped in brackets and the column joined into a single JSON array with Arrow
+    compute, which is parsed in one call. Only when that fails (an invalid value) or a value did not
+    come back as a one-element array (a value merged with its neighbour by the join) is the column
+    parsed row by row.
+
+    Parameters:
+    - column: pyarrow Array/ChunkedArray of JSON strings.
+
+    Returns:
+    - parsed: list of Python objects, None for null or invalid values.
+    """
+    column = combine(column)
+    values = pc.fill_null(pc.if_else(pc.equal(column, ''), pa.scalar(None, pa.string()), column), 'null')
+    wrapped = pc.binary_join_element_wise('[', values, ']', '')
+    joined = pc.binary_join(pa.ListArray.from_arrays(pa.array([0, len(wrapped)], pa.int32()), wrapped), ',')[0].as_py()
+    try:
+        rows = fast_json.loads(f"[{joined}]")
+        if len(rows) == len(values) and all(isinstance(row, list) and len(row) == 1 for row in rows):
+            return [row[0] for row in rows]
+    except ValueError:
+        pass
+
+    parsed = []
+    for value in column.to_pylist():
+        try:
+            parsed.append(fast_json.loads(value) if value else None)
+        except (ValueError, TypeError):
+            parsed.append(None)
+    return parsed
+
+
+def null_values(column, values):
+    """
+    Replace the given placeholder strings with nulls, vectorized over the column.
+    """
+    return pc.if_else(pc.is_in(column, value_set=pa.array(values, pa.string())), pa.scalar(None, pa.string()), column)
+
 
 # Text preprocess
-def preprocess_records_into_text(df):
-    selected_columns = ['features_properties_title_en','features_properties_description_en','features_properties_keywords_en']
-    df = df[selected_columns]
-    return df.apply(lambda x: f"{x['features_properties_title_en']}\n{x['features_properties_description_en']}\nkeywords:{x['features_properties_keywords_en']}",axis=1 )
-
-
-def main(region, bucket, model_directory, output_bucket, output_key):
-    # Step 1: Load the data
-    df_parquet = read_parquet_from_s3_as_df(region, bucket, 'records.parquet')
-    df_sentinel1 = read_parquet_from_s3_as_df(region, bucket, 'sentinel1.parquet')
-    df = pd.concat([df_parquet, df_sentinel1], ignore_index=True)
-
-    # Step 2: Clean the data
-    col_names_list = [
-        'features_properties_id', 'features_geometry_coordinates', 'features_properties_title_en',
-        'features_properties_description_en', 'features_properties_date_published_date',
-        'features_properties_keywords_en', 'features_properties_options', 'features_properties_contact',
-        'features_properties_topicCategory', 'features_properties_date_created_date',
-        'features_properties_spatialRepresentation', 'features_properties_type',
-        'features_properties_temporalExtent_begin', 'features_properties_temporalExtent_end',
-        'features_properties_graphicOverview', 'features_properties_language', 'features_popularity',
-        'features_properties_sourceSystemName', 'features_properties_eoCollection',
-        'features_properties_eoFilters'
-    ]
-    df_en = df[col_names_list]
-    df_en['organisation_en'] = df_en['features_properties_contact'].apply(extract_organisation_en)
+def preprocess_records_into_text(table):
+    """
+    Build the text to embed for every record with vectorized string operations.
+    Nulls render as 'None', as the former per-row f-string did.
+    """
+    title, description, keywords = (
+        pc.fill_null(table.column(name), 'None')
+        for name in ['features_properties_title_en', 'features_properties_description_en', 'features_properties_keywords_en']
+    )
+    return pc.binary_join_element_wise(title, description, pc.binary_join_element_wise('keywords:', keywords, ''), '\n')
+
+
+def combine(column):
+    """
+    Return column as a single contiguous pyarrow Array.
+    """
+    return column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+
 
-    values_to_replace = {'Present': None, 'Not Available; Indisponible': None}
-    columns_to_replace = ['features_properties_temporalExtent_begin', 'features_properties_temporalExtent_end']
-    df_en[columns_to_replace] = df_en[columns_to_replace].replace(values_to_replace)
+def clean_records(batch):
+    """
+    Cleaning stage: turn a batch of raw records into a typed Arrow table matching METADATA_SCHEMA
+    (without row_id).
+
+    JSON columns are parsed once; the parse feeds the derived columns (organisation_en) and the
+    column is re-emitted as minified single-line JSON, which the index loader splices into
+    documents as-is instead of parsing it again. Everything else is vectorized Arrow compute.
+    """
+    table = batch if isinstance(batch, pa.Table) else pa.Table.from_batches([batch])
+    columns = {}
+    parsed_json = {}
+
+    for name in COL_NAMES_LIST:
+        if name in ('features_properties_temporalExtent_begin', 'features_properties_temporalExtent_end', 'features_popularity'):
+            continue
+        column = pc.cast(table.column(name), pa.string())
+        if name in JSON_COLUMNS:
+            parsed_json[name] = parse_json_column(column)
+            column = pa.array([fast_json.dumps(value) if value is not None else None for value in parsed_json[name]], pa.string())
+        elif name in ('features_properties_date_published_date', 'features_properties_date_created_date'):
+            column = null_values(column, ['Not Available; Indisponible'])
+        columns[name] = column
+
+    try:
+        popularity = pc.cast(table.column('features_popularity'), pa.int64())
+    except pa.ArrowInvalid:
+        popularity = pa.array(pd.to_numeric(table.column('features_popularity').to_pandas(), errors='coerce'), pa.float64()).cast(pa.int64(), safe=False)
+    columns['features_popularity'] = pc.fill_null(popularity, 0)
+
+    columns['organisation_en'] = pa.array([organisation_en_from_contact(contact) for contact in parsed_json['features_properties_contact']], pa.string())
 
-    df_en['temporalExtent'] = df_en.apply(lambda row: {'begin': row['features_properties_temporalExtent_begin'], 'end': row['features_properties_temporalExtent_end']}, axis=1)
-    df_en = df_en.drop(columns=['features_properties_temporalExtent_begin', 'features_properties_temporalExtent_end'])
+    # The date range is built from the raw bounds, where an ongoing ('Present') end can still be told from an unknown one
+    raw_begin = pc.cast(table.column('features_properties_temporalExtent_begin'), pa.string())
+    raw_end = pc.cast(table.column('features_properties_temporalExtent_end'), pa.string())
+    columns[TEMPORAL_RANGE_FIELD] = pa.array([temporal_range({'begin': begin, 'end': end}) for begin, end in zip(raw_begin.to_pylist(), raw_end.to_pylist())],
+                                             CLEANED_SCHEMA.field(TEMPORAL_RANGE_FIELD).type)
 
-    values_to_replace = {'Not Available; Indisponible': None}
-    columns_to_replace = ['features_properties_date_published_date', 'features_properties_date_created_date']
-    df_en[columns_to_replace] = df_en[columns_to_replace].replace(values_to_replace)
+    temporal_placeholders = ['Present', 'Not Available; Indisponible']
+    begin = null_values(raw_begin, temporal_placeholders)
+    end = null_values(raw_end, temporal_placeholders)
+    columns['temporalExtent'] = pa.StructArray.from_arrays([combine(begin), combine(end)], names=['begin', 'end'])
 
-    # Step 3: Preprocess text
-    df_en['text'] = preprocess_records_into_text(df_en)
+    cleaned = pa.Table.from_pydict({name: combine(column) for name, column in columns.items()})
+    cleaned = cleaned.append_column('text', combine(preprocess_records_into_text(cleaned)))
+    return cleaned.select(CLEANED_SCHEMA.names).cast(CLEANED_SCHEMA)
+
+
+def main(region, bucket, model_directory, output_bucket, output_key, vector_dtype='float32', local_dir='/tmp', batch_size=10000):
+    source_uris = [f"s3://{bucket}/{name}" for name in SOURCE_FILES]
+    n_rows = sum(count_parquet_rows(uri, region=region) for uri in source_uris)
+    print(f"Embedding {n_rows} records from {SOURCE_FILES}")
 
-    # Step 4: Embedding text
-    tqdm.pandas()
     model = model_fn(model_directory)
-    df_en['vector'] = df_en['text'].progress_apply(lambda x: predict_fn({"inputs": x}, model))
+    artifact_prefix = os.path.join(local_dir, os.path.basename(output_key))
+    vectors_path, metadata_path = vector_store_paths(artifact_prefix)
+    vectors = None
+    row = 0
+
+    # Records are streamed batch by batch, so memory is bounded by batch_size rather than the catalogue size
+    with parquet_writer(metadata_path, METADATA_SCHEMA) as writer:
+        for uri in source_uris:
+            # Step 1: Load the data
+            for batch in iter_parquet_batches(uri, batch_size=batch_size, columns=COL_NAMES_LIST, region=region):
+                # Step 2 & 3: Clean the data and preprocess text into a typed Arrow table
+                table = clean_records(batch)
+
+                # Step 4: Embedding text into the memory-mapped vector matrix
+                start_row = row
+                for text in tqdm(table.column('text').to_pylist(), desc=f"Embedding {uri} rows {start_row}-{start_row + table.num_rows}"):
+                    vector = predict_fn({"inputs": text}, model)
+                    if vectors is None:
+                        vectors = create_vector_file(vectors_path, n_rows, len(vector), dtype=vector_dtype)
+                    vectors[row] = vector
+                    row += 1
+
+                writer.write_table(add_row_ids(table, start_row=start_row).cast(METADATA_SCHEMA))
+
+    if vectors is not None:
+        vectors.flush()
 
-    # Step 5: Upload the embeddings as a Parquet file to S3 bucket
-    upload_df_to_s3_as_parquet(df=df_en, bucket_name=output_bucket, file_key=output_key)
+    # Step 5: Upload the vector artifact (vectors + metadata) to S3 bucket
+    upload_vector_store(artifact_prefix, bucket_name=output_bucket, key_prefix=output_key)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process and upload data to S3.')
@@ -129,7 +268,10 @@ if __name__ == "__main__":
     parser.add_argument('--bucket', type=str, required=True, help='Raw data S3 bucket name')
     parser.add_argument('--model_directory', type=str, required=True, help='Model directory')
     parser.add_argument('--output_bucket', type=str, required=True, help='Output S3 bucket name')
-    parser.add_argument('--output_key', type=str, required=True, help='Output S3 file key')
+    parser.add_argument('--output_key', type=str, required=True, help='Output S3 key prefix of the vector artifact')
+    parser.add_argument('--vector_dtype', type=str, default='float32', choices=['float32', 'float16'], help='Storage dtype of the vectors')
+    parser.add_argument('--local_dir', type=str, default='/tmp', help='Local scratch directory for the vector artifact')
+    parser.add_argument('--batch_size', type=int, default=10000, help='Number of records read and processed per batch')
     
     args = parser.parse_args()
     
@@ -138,5 +280,8 @@ if __name__ == "__main__":
         bucket=args.bucket,
         model_directory=args.model_directory,
         output_bucket=args.output_bucket,
-        output_key=args.output_key
-    )
\ No newline at end of file
+        output_key=args.output_key,
+        vector_dtype=args.vector_dtype,
+        local_dir=args.local_dir,
+        batch_size=args.batch_size
+    )
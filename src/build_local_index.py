@@ -0,0 +1,221 @@
+import os
+import json
+import boto3
+import argparse
+import numpy as np
+import fast_json
+from tqdm import tqdm
+from opensearch import iter_records, build_document_json, geometry_bbox, EXTENT_SIDES
+from vector_store import download_vector_store, load_vector_store, ROW_ID_COLUMN
+
+# Optional: HNSW graph for approximate search; without it lambda-search scans the vectors exactly
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# A local index adds these files next to a vector artifact (<prefix>.vectors.npy), all rows in matrix order.
+# They are read by deployment/lambda-search/local_index.py (SEARCH_BACKEND=local).
+#   <prefix>.documents.jsonl  one {"_id", "_source"} line per record, as the OpenSearch index stores it minus the vector
+#   <prefix>.columns.npz      line offsets, vector norms, and the sort, date range, extent and bbox columns
+#   <prefix>.facets.npz       per keyword field: its terms and one packed bitmap of records per term
+#   <prefix>.hnsw.bin         optional hnswlib graph (cosine space)
+DOCUMENTS_SUFFIX = '.documents.jsonl'
+COLUMNS_SUFFIX = '.columns.npz'
+FACETS_SUFFIX = '.facets.npz'
+HNSW_SUFFIX = '.hnsw.bin'
+
+# Sort fields of build_sort_filter besides _score: numbers, dates, and keywords stored as ranks
+NUMBER_COLUMNS = ['popularity']
+DATE_COLUMNS = ['published']
+KEYWORD_COLUMNS = ['title_en', 'title_fr']
+
+# filter_config.json keys that are not keyword facets
+RANGE_FILTER_KEYS = ['begin', 'end']
+DATE_RANGE_FILTER_KEY = 'temporal'  # date_range fields, stored as <path>.gte and <path>.lte date columns (NaT when open)
+SPATIAL_FILTER_KEY = 'bbox'
+EXTENT_FILTER_KEY = 'extent'  # numeric bounding box fields of the spatial prefilter, stored as number columns
+
+
+def field_path(path):
+    """Source path of a mapped field: 'organisation.en.keyword' -> 'organisation.en'."""
+    return path[:-len('.keyword')] if path.endswith('.keyword') else path
+
+
+def field_values(document, path):
+    """
+    Values of a dotted field path in a document, walking through lists like OpenSearch does.
+    Booleans are returned as 'true'/'false', the way a keyword field indexes them.
+    """
+    values = [document]
+    for part in field_path(path).split('.'):
+        found = []
+        for value in values:
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict) and item.get(part) is not None:
+                    found.append(item[part])
+        values = found
+    flat = []
+    for value in values:
+        flat.extend(value if isinstance(value, list) else [value])
+    return [('true' if value else 'false') if isinstance(value, bool) else str(value)
+            for value in flat if value is not None and value != '' and not isinstance(value, dict)]
+
+
+def parse_dates(values):
+    """datetime64[D] array of date strings (first value of each record), NaT where missing or invalid."""
+    dates = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[D]')
+    for row, value in enumerate(values):
+        if value:
+            try:
+                dates[row] = np.datetime64(value[0][:10], 'D')
+            except ValueError:
+                pass
+    return dates
+
+
+def keyword_ranks(values):
+    """int32 rank of each record's first value in sorted term order, -1 where missing."""
+    firsts = [value[0] if value else None for value in values]
+    terms = sorted({value for value in firsts if value is not None})
+    position = {term: rank for rank, term in enumerate(terms)}
+    return np.array([position[value] if value is not None else -1 for value in firsts], dtype=np.int32)
+
+
+def facet_bitmaps(values, n_rows):
+    """(terms, packed bitmaps) of a keyword field: bitmaps[i] has the bit of every record holding terms[i]."""
+    rows_by_term = {}
+    for row, record_values in enumerate(values):
+        for term in set(record_values):
+            rows_by_term.setdefault(term, []).append(row)
+    terms = sorted(rows_by_term)
+    bitmaps = np.zeros((len(terms), (n_rows + 7) // 8), dtype=np.uint8)
+    for i, term in enumerate(terms):
+        bits = np.zeros(n_rows, dtype=bool)
+        bits[rows_by_term[term]] = True
+        bitmaps[i] = np.packbits(bits)
+    return np.array(terms, dtype=str), bitmaps
+
+
+def vector_norms(vectors, chunk_size=10000):
+    norms = np.empty(vectors.shape[0], dtype=np.float32)
+    for start in range(0, vectors.shape[0], chunk_size):
+        norms[start:start + chunk_size] = np.linalg.norm(vectors[start:start + chunk_size].astype(np.float32), axis=1)
+    return norms
+
+
+def build_hnsw(vectors, path, m=16, ef_construction=200, chunk_size=10000):
+    index = hnswlib.Index(space='cosine', dim=vectors.shape[1])
+    index.init_index(max_elements=vectors.shape[0], M=m, ef_construction=ef_construction)
+    for start in tqdm(range(0, vectors.shape[0], chunk_size), desc="Building HNSW graph"):
+        chunk = vectors[start:start + chunk_size].astype(np.float32)
+        index.add_items(chunk, np.arange(start, start + len(chunk)))
+    index.save_index(path)
+
+
+def build_local_index(prefix, filter_config, hnsw=False, hnsw_m=16, hnsw_ef_construction=200):
+    """
+    Write the local index files of the vector artifact at prefix.
+
+    Parameters:
+    - prefix: Local path prefix of the vector artifact.
+    - filter_config: lambda-search filter_config.json contents (facet and filter field paths).
+    - hnsw: Also build an hnswlib graph (requires hnswlib).
+
+    Returns:
+    - paths: Local paths of the files written.
+    """
+    metadata, vectors = load_vector_store(prefix)
+    metadata = metadata.sort_by(ROW_ID_COLUMN)
+    n_rows = vectors.shape[0]
+
+    facet_paths = sorted({path for key, paths in filter_config.items()
+                          if key not in RANGE_FILTER_KEYS + [DATE_RANGE_FILTER_KEY, SPATIAL_FILTER_KEY, EXTENT_FILTER_KEY] for path in paths})
+    number_paths = NUMBER_COLUMNS + [f"{path}.{side}" for path in filter_config.get(EXTENT_FILTER_KEY, []) for side in EXTENT_SIDES]
+    date_paths = DATE_COLUMNS + [path for key in RANGE_FILTER_KEYS for path in filter_config.get(key, [])]
+    date_paths += [f"{path}.{bound}" for path in filter_config.get(DATE_RANGE_FILTER_KEY, []) for bound in ('gte', 'lte')]
+    spatial_field = filter_config.get(SPATIAL_FILTER_KEY, ['coordinates'])[0]
+
+    facet_values = {path: [] for path in facet_paths}
+    column_values = {path: [] for path in number_paths + date_paths + KEYWORD_COLUMNS}
+    bboxes = np.empty((n_rows, 4), dtype=np.float64)
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+
+    documents_path = f"{prefix}{DOCUMENTS_SUFFIX}"
+    with open(documents_path, 'wb') as file:
+        for row, x in enumerate(tqdm(iter_records(metadata), total=n_rows, desc="Writing documents")):
+            source = fast_json.loads(build_document_json(x, None))
+            source.pop('vector', None)
+            line = (fast_json.dumps({"_id": x.get('features_properties_id') or str(x[ROW_ID_COLUMN]), "_source": source}) + '\n').encode('utf-8')
+            file.write(line)
+            offsets[row + 1] = offsets[row] + len(line)
+
+            for path in facet_paths:
+                facet_values[path].append(field_values(source, path))
+            for path in column_values:
+                column_values[path].append(field_values(source, path))
+            geometry = source.get(field_path(spatial_field))
+            bboxes[row] = geometry_bbox(geometry.get('coordinates') if isinstance(geometry, dict) else None) or (np.nan,) * 4
+
+    columns = {"_offsets": offsets, "_norms": vector_norms(vectors)}
+    for path in number_paths:
+        columns[field_path(path)] = np.array([float(v[0]) if v else np.nan for v in column_values[path]], dtype=np.float64)
+    for path in date_paths:
+        columns[field_path(path)] = parse_dates(column_values[path])
+    for path in KEYWORD_COLUMNS:
+        columns[field_path(path)] = keyword_ranks(column_values[path])
+    for i, side in enumerate(['min_lon', 'min_lat', 'max_lon', 'max_lat']):
+        columns[f"{field_path(spatial_field)}.{side}"] = bboxes[:, i]
+    columns_path = f"{prefix}{COLUMNS_SUFFIX}"
+    np.savez(columns_path, **columns)
+
+    facets = {}
+    for path in facet_paths:
+        terms, bitmaps = facet_bitmaps(facet_values[path], n_rows)
+        facets[f"{field_path(path)}.terms"] = terms
+        facets[f"{field_path(path)}.bitmaps"] = bitmaps
+    facets_path = f"{prefix}{FACETS_SUFFIX}"
+    np.savez(facets_path, **facets)
+
+    paths = [documents_path, columns_path, facets_path]
+    if hnsw:
+        if hnswlib is None:
+            raise ImportError("hnswlib is required to build an HNSW graph")
+        build_hnsw(vectors, f"{prefix}{HNSW_SUFFIX}", m=hnsw_m, ef_construction=hnsw_ef_construction)
+        paths.append(f"{prefix}{HNSW_SUFFIX}")
+    print(f"Local index of {n_rows} records: {len(facet_paths)} facet fields, HNSW graph: {hnsw}")
+    return paths
+
+
+def main(region, bucket, filename, filter_config_path, local_dir='/tmp', hnsw=False, hnsw_m=16, hnsw_ef_construction=200):
+    with open(filter_config_path) as file:
+        filter_config = json.load(file)
+
+    artifact_prefix = download_vector_store(region, bucket, filename, local_dir=local_dir)
+    paths = build_local_index(artifact_prefix, filter_config, hnsw=hnsw, hnsw_m=hnsw_m, hnsw_ef_construction=hnsw_ef_construction)
+
+    # The local index files sit next to the artifact's vectors, under the same key prefix
+    s3_client = boto3.Session(region_name=region).client('s3')
+    for local_path in paths:
+        suffix = local_path[len(artifact_prefix):]
+        s3_client.upload_file(local_path, bucket, f"{filename}{suffix}")
+        print(f'Uploading {filename}{suffix} to {bucket}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the lambda-search local index of a vector artifact.')
+    parser.add_argument('--region', type=str, required=True, help='AWS region')
+    parser.add_argument('--bucket', type=str, required=True, help='Vector artifact S3 bucket')
+    parser.add_argument('--filename', type=str, required=True, help='Vector artifact key prefix')
+    parser.add_argument('--filter_config', type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'deployment', 'lambda-search', 'filter_config.json'),
+                        help='lambda-search filter_config.json')
+    parser.add_argument('--local_dir', type=str, default='/tmp', help='Local scratch directory for the artifact')
+    parser.add_argument('--hnsw', action='store_true', help='Also build an HNSW graph (requires hnswlib)')
+    parser.add_argument('--hnsw_m', type=int, default=16, help='HNSW graph degree')
+    parser.add_argument('--hnsw_ef_construction', type=int, default=200, help='HNSW construction beam width')
+
+    args = parser.parse_args()
+
+    main(region=args.region, bucket=args.bucket, filename=args.filename, filter_config_path=args.filter_config,
+         local_dir=args.local_dir, hnsw=args.hnsw, hnsw_m=args.hnsw_m, hnsw_ef_construction=args.hnsw_ef_construction)
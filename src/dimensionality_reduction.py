@@ -0,0 +1,202 @@
+import os
+import json
+import shutil
+import boto3
+import argparse
+import numpy as np
+from tqdm import tqdm
+from vector_store import vector_store_paths, create_vector_file, download_vector_store, load_vector_store, upload_vector_store
+
+# Projection artifact: the SageMaker encoder (deployment/pytorch/code/inference.py) applies it to query
+# vectors when the file is found in the model directory, so queries and documents share one space.
+PROJECTION_FILENAME = 'projection.npz'
+PROJECTION_METHODS = ('pca', 'truncate')
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def fit_projection(vectors, dimension, method='pca', rows=None, chunk_size=10000):
+    """
+    Fit a projection of the (unit normalized) vectors down to dimension.
+
+    'pca' keeps the top principal components of the centred vectors, accumulating the covariance
+    chunk by chunk so a memory-mapped matrix is never fully loaded. 'truncate' keeps the first
+    dimension coordinates, for Matryoshka-trained models whose leading coordinates carry the most information.
+
+    Parameters:
+    - vectors: (n_rows x source dimension) matrix, memmap or array.
+    - dimension: Target dimension.
+    - method: 'pca' (default) or 'truncate'.
+    - rows: Optional sorted row indices to fit on (e.g. a sample without the held-out queries).
+
+    Returns:
+    - projection: dict with mean (source dimension,), components (source dimension x dimension) and method.
+    """
+    if method not in PROJECTION_METHODS:
+        raise ValueError(f"Unsupported projection method '{method}'. Must be one of {PROJECTION_METHODS}.")
+    source_dimension = vectors.shape[1]
+    if not 0 < dimension <= source_dimension:
+        raise ValueError(f"Target dimension must be between 1 and {source_dimension}, got {dimension}.")
+
+    if method == 'truncate':
+        return {"mean": np.zeros(source_dimension, dtype=np.float32),
+                "components": np.eye(source_dimension, dimension, dtype=np.float32), "method": method}
+
+    rows = np.arange(vectors.shape[0]) if rows is None else rows
+    total = np.zeros(source_dimension, dtype=np.float64)
+    scatter = np.zeros((source_dimension, source_dimension), dtype=np.float64)
+    for start in tqdm(range(0, len(rows), chunk_size), desc="Fitting PCA"):
+        chunk = normalize_rows(np.asarray(vectors[rows[start:start + chunk_size]], dtype=np.float64))
+        total += chunk.sum(axis=0)
+        scatter += chunk.T @ chunk
+    mean = total / len(rows)
+    covariance = scatter / len(rows) - np.outer(mean, mean)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    order = np.argsort(eigenvalues)[::-1][:dimension]
+    explained = eigenvalues[order].sum() / eigenvalues.sum()
+    print(f"PCA to {dimension} dimensions keeps {explained:.1%} of the variance")
+    return {"mean": mean.astype(np.float32), "components": eigenvectors[:, order].astype(np.float32),
+            "method": method, "explained_variance": float(explained)}
+
+
+def project(vectors, projection):
+    """Project vectors: normalize, centre, multiply by the components, normalize again (cosine space)."""
+    vectors = normalize_rows(np.asarray(vectors, dtype=np.float32))
+    return normalize_rows((vectors - projection["mean"]) @ projection["components"])
+
+
+def save_projection(path, projection):
+    np.savez(path, mean=projection["mean"], components=projection["components"], method=projection["method"])
+
+
+def load_projection(path):
+    data = np.load(path)
+    return {"mean": data["mean"], "components": data["components"], "method": str(data["method"])}
+
+
+def project_vector_store(prefix, output_prefix, projection, dtype='float32', chunk_size=10000):
+    """
+    Write a new vector artifact at output_prefix with the projected vectors of the artifact at prefix.
+    The metadata file is copied unchanged, row_id still points at the matching row.
+    """
+    metadata_path = vector_store_paths(prefix)[1]
+    output_vectors_path, output_metadata_path = vector_store_paths(output_prefix)
+    _, vectors = load_vector_store(prefix)
+    projected = create_vector_file(output_vectors_path, vectors.shape[0], projection["components"].shape[1], dtype=dtype)
+    for start in tqdm(range(0, vectors.shape[0], chunk_size), desc="Projecting vectors"):
+        projected[start:start + chunk_size] = project(vectors[start:start + chunk_size], projection)
+    projected.flush()
+    del projected
+    shutil.copyfile(metadata_path, output_metadata_path)
+
+
+def exact_top_k(vectors, queries, k=10, exclude_rows=None, chunk_size=10000):
+    """
+    Row indices of the k nearest vectors (cosine) to every query, by exact search in chunks.
+
+    Parameters:
+    - exclude_rows: Optional row of each query in vectors, left out of its own results.
+
+    Returns:
+    - (n_queries x k) array of row indices, best first.
+    """
+    queries = normalize_rows(np.asarray(queries, dtype=np.float32))
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, vectors.shape[0], chunk_size):
+        chunk = normalize_rows(np.asarray(vectors[start:start + chunk_size], dtype=np.float32))
+        scores = queries @ chunk.T
+        if exclude_rows is not None:
+            local = exclude_rows - start
+            inside = (local >= 0) & (local < len(chunk))
+            scores[np.flatnonzero(inside), local[inside]] = -np.inf
+        rows = np.broadcast_to(np.arange(start, start + len(chunk)), scores.shape)
+        best_rows = np.concatenate([best_rows, rows], axis=1)
+        best_scores = np.concatenate([best_scores, scores], axis=1)
+        if best_scores.shape[1] > k:
+            top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_rows = np.take_along_axis(best_rows, top, axis=1)
+            best_scores = np.take_along_axis(best_scores, top, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_rows, order, axis=1)
+
+
+def recall_report(vectors, projected_vectors, queries, projection, ks=(1, 10, 50), exclude_rows=None):
+    """
+    Recall@k of exact search on the projected vectors against exact search on the full vectors:
+    the share of each query's full-dimension top k that the projected search also returns in its top k.
+    """
+    max_k = max(ks)
+    full = exact_top_k(vectors, queries, k=max_k, exclude_rows=exclude_rows)
+    reduced = exact_top_k(projected_vectors, project(queries, projection), k=max_k, exclude_rows=exclude_rows)
+    report = {"queries": len(queries), "source_dimension": int(vectors.shape[1]),
+              "dimension": int(projected_vectors.shape[1]), "method": projection["method"]}
+    for k in ks:
+        overlap = [len(np.intersect1d(full[i, :k], reduced[i, :k])) / k for i in range(len(queries))]
+        report[f"recall@{k}"] = float(np.mean(overlap))
+    return report
+
+
+def main(region, bucket, filename, output_key, dimension=256, method='pca', model_directory=None, queries_path=None,
+         n_queries=1000, fit_sample=100000, vector_dtype='float32', local_dir='/tmp', seed=0):
+    artifact_prefix = download_vector_store(region, bucket, filename, local_dir=local_dir)
+    _, vectors = load_vector_store(artifact_prefix)
+    n_rows = vectors.shape[0]
+    rng = np.random.default_rng(seed)
+
+    # Held-out queries: embedded query texts if given, else corpus rows kept out of the fit
+    if queries_path:
+        queries, exclude_rows = np.load(queries_path), None
+        fit_rows = np.arange(n_rows)
+    else:
+        exclude_rows = np.sort(rng.choice(n_rows, size=min(n_queries, n_rows // 10), replace=False))
+        fit_rows = np.setdiff1d(np.arange(n_rows), exclude_rows)
+        queries = np.asarray(vectors[exclude_rows], dtype=np.float32)
+    if len(fit_rows) > fit_sample:
+        fit_rows = np.sort(rng.choice(fit_rows, size=fit_sample, replace=False))
+
+    projection = fit_projection(vectors, dimension, method=method, rows=fit_rows)
+    projection_path = os.path.join(local_dir, PROJECTION_FILENAME)
+    save_projection(projection_path, projection)
+    if model_directory:
+        # Packaged with the model, so the encoder projects query vectors the same way
+        shutil.copyfile(projection_path, os.path.join(model_directory, PROJECTION_FILENAME))
+        print(f"Copied {PROJECTION_FILENAME} to {model_directory}")
+
+    output_prefix = os.path.join(local_dir, os.path.basename(output_key))
+    project_vector_store(artifact_prefix, output_prefix, projection, dtype=vector_dtype)
+    _, projected_vectors = load_vector_store(output_prefix)
+
+    report = recall_report(vectors, projected_vectors, queries, projection, exclude_rows=exclude_rows)
+    print("Recall against full-dimension exact search:", json.dumps(report))
+
+    upload_vector_store(output_prefix, bucket_name=bucket, key_prefix=output_key)
+    s3_client = boto3.Session(region_name=region).client('s3')
+    s3_client.upload_file(projection_path, bucket, f"{output_key}.{PROJECTION_FILENAME}")
+    s3_client.put_object(Bucket=bucket, Key=f"{output_key}.recall.json", Body=json.dumps(report, indent=2).encode('utf-8'))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reduce the dimension of a vector artifact with PCA or truncation.')
+    parser.add_argument('--region', type=str, required=True, help='AWS region')
+    parser.add_argument('--bucket', type=str, required=True, help='Vector artifact S3 bucket')
+    parser.add_argument('--filename', type=str, required=True, help='Vector artifact key prefix')
+    parser.add_argument('--output_key', type=str, required=True, help='Key prefix of the projected vector artifact')
+    parser.add_argument('--dimension', type=int, default=256, help='Target dimension')
+    parser.add_argument('--method', type=str, default='pca', choices=PROJECTION_METHODS, help='pca, or truncate for Matryoshka models')
+    parser.add_argument('--model_directory', type=str, default=None, help='Model directory the projection is copied into before packaging')
+    parser.add_argument('--queries', type=str, default=None, help='.npy of held-out query embeddings; default: corpus rows left out of the fit')
+    parser.add_argument('--n_queries', type=int, default=1000, help='Held-out corpus rows used as queries when --queries is not set')
+    parser.add_argument('--fit_sample', type=int, default=100000, help='Maximum number of vectors the projection is fitted on')
+    parser.add_argument('--vector_dtype', type=str, default='float32', choices=['float32', 'float16'], help='Storage dtype of the projected vectors')
+    parser.add_argument('--local_dir', type=str, default='/tmp', help='Local scratch directory for the artifacts')
+
+    args = parser.parse_args()
+
+    main(region=args.region, bucket=args.bucket, filename=args.filename, output_key=args.output_key, dimension=args.dimension,
+         method=args.method, model_directory=args.model_directory, queries_path=args.queries, n_queries=args.n_queries,
+         fit_sample=args.fit_sample, vector_dtype=args.vector_dtype, local_dir=args.local_dir)
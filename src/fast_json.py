@@ -0,0 +1,26 @@
+import json
+
+# orjson is several times faster than the standard library; fall back to json when it isn't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(value):
+    """
+    Parse a JSON string (or bytes) with orjson when available.
+    Raises ValueError on invalid JSON with either parser.
+    """
+    if orjson is not None:
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+def dumps(obj):
+    """
+    Serialize obj to a minified, single-line JSON string with orjson when available.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
@@ -1,9 +1,23 @@
+import re
 import json
+import hashlib
 import time
 import boto3
+import numpy as np
+import fast_json
 from tqdm import tqdm
+from datetime import datetime
 from urllib.parse import urlparse
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth, helpers
+from temporal_extent import TEMPORAL_RANGE_FIELD, temporal_range
+
+INDEX_GENERATION_FORMAT = '%Y%m%d%H%M%S'
+
+# Numeric bounding box of each record's geometry, for cheap spatial prefilters (mapped in Create_Opensearch_index.py)
+EXTENT_FIELD = 'extent'
+EXTENT_SIDES = ('min_lon', 'min_lat', 'max_lon', 'max_lat')
+# Optional simplified copy of the geometry (Create_Opensearch_index.py --footprint_tolerance)
+FOOTPRINT_FIELD = 'footprint'
 
 
 def get_awsauth_from_secret(region, secret_id):
@@ -75,71 +89,458 @@ def delete_aos_index_if_exists(aos_client, index_to_delete):
     print("Indexes after deletion attempt:", existing_indices_after_deletion)
 
 
-def load_data_to_opensearch_index(df_en, aos_client, index_name, log_level="INFO"):
+def versioned_index_name(alias, timestamp=None):
+    """
+    Name of a new index generation for alias, e.g. mpnet-mpf-knn-20250101120000.
+    """
+    timestamp = timestamp or datetime.utcnow()
+    return f"{alias}-{timestamp.strftime(INDEX_GENERATION_FORMAT)}"
+
+
+def list_index_generations(aos_client, alias):
+    """
+    List the versioned indexes built for alias, oldest first.
+    """
+    pattern = re.compile(rf"^{re.escape(alias)}-\d{{14}}$")
+    all_indices = aos_client.cat.indices(index=f"{alias}-*", format='json')
+    return sorted(index['index'] for index in all_indices if pattern.match(index['index']))
+
+
+def get_alias_indices(aos_client, alias):
+    """
+    Return the indexes alias currently points to (empty if the alias does not exist).
+    """
+    if not aos_client.indices.exists_alias(name=alias):
+        return []
+    return list(aos_client.indices.get_alias(name=alias).keys())
+
+
+def validate_index(aos_client, index_name, expected_count, sample_queries=(), sample_vector=None, min_doc_ratio=0.99):
+    """
+    Check a freshly loaded index before it is exposed to searches.
+
+    Parameters:
+    - aos_client: OpenSearch client.
+    - index_name: Index to validate.
+    - expected_count: Number of records that were loaded.
+    - sample_queries: Keyword queries that must each return at least one hit.
+    - sample_vector: Optional vector for a k-NN query that must return at least one hit.
+    - min_doc_ratio: Minimum share of expected_count that must be searchable.
+
+    Returns:
+    - True if every check passed, False otherwise.
+    """
+    aos_client.indices.refresh(index=index_name)
+    doc_count = aos_client.count(index=index_name)['count']
+    print(f"Index {index_name} holds {doc_count} of {expected_count} records.")
+    if doc_count < expected_count * min_doc_ratio:
+        print(f"Validation failed: {doc_count} documents is below {min_doc_ratio:.0%} of {expected_count}.")
+        return False
+
+    queries = [{"multi_match": {"query": q, "fields": ["title", "description", "keywords"]}} for q in sample_queries]
+    if sample_vector is not None:
+        queries.append({"knn": {"vector": {"vector": sample_vector, "k": 10}}})
+    for query in queries:
+        res = aos_client.search(index=index_name, body={"size": 1, "_source": False, "query": query})
+        if res['hits']['total']['value'] == 0:
+            print(f"Validation failed: sample query returned no hits: {list(query)[0]}")
+            return False
+    print(f"Index {index_name} passed validation ({len(queries)} sample queries).")
+    return True
+
+
+def warm_index(aos_client, index_name, sample_queries=()):
+    """
+    Load the k-NN graphs of index_name into memory and run the sample queries once,
+    so the first searches after the alias swap do not pay for cold caches.
+    """
+    try:
+        response = aos_client.transport.perform_request('GET', f"/_plugins/_knn/warmup/{index_name}")
+        print(f"k-NN warmup response: {response}")
+    except Exception as e:
+        print(f"Error warming up k-NN graphs of {index_name}: {e}")
+    for q in sample_queries:
+        aos_client.search(index=index_name, body={"size": 10, "query": {"multi_match": {"query": q, "fields": ["title", "description", "keywords"]}}})
+
+
+def invoke_warmup_function(region, function_name, payload=None):
+    """
+    Asynchronously invoke the lambda-search warmup function (warmup.lambda_handler), which replays
+    the most frequent recent queries once the new index takes traffic.
+    """
+    lambda_client = boto3.client('lambda', region_name=region)
+    try:
+        response = lambda_client.invoke(FunctionName=function_name, InvocationType='Event',
+                                        Payload=json.dumps(payload or {}).encode('utf-8'))
+        print(f"Invoked warmup function {function_name}: status {response.get('StatusCode')}")
+        return response
+    except Exception as e:
+        print(f"Error invoking warmup function {function_name}: {e}")
+        return None
+
+
+def swap_alias(aos_client, alias, new_index):
+    """
+    Atomically point alias at new_index.
+
+    Every index currently behind the alias is removed from it in the same _aliases call. A concrete
+    index that still carries the alias name (from before versioned builds) is deleted in that call
+    too, so searches switch over without ever seeing a missing index.
+    """
+    actions = [{"remove": {"index": index, "alias": alias}} for index in get_alias_indices(aos_client, alias) if index != new_index]
+    if aos_client.indices.exists(index=alias) and not aos_client.indices.exists_alias(name=alias):
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": new_index, "alias": alias}})
+    response = aos_client.indices.update_aliases(body={"actions": actions})
+    print(f"Alias {alias} now points to {new_index}: {response}")
+    return response
+
+
+def cleanup_old_generations(aos_client, alias, keep=2):
+    """
+    Retention policy: delete all but the newest `keep` generations of alias.
+    Generations the alias still points to are never deleted.
+    """
+    live = set(get_alias_indices(aos_client, alias))
+    generations = list_index_generations(aos_client, alias)
+    expired = [index for index in generations[:max(len(generations) - keep, 0)] if index not in live]
+    for index in expired:
+        delete_aos_index_if_exists(aos_client, index_to_delete=index)
+    return expired
+
+
+def iter_records(data, chunk_size=1000):
+    """
+    Yield records as dictionaries from a pandas DataFrame or a pyarrow Table,
+    converting chunk_size rows at a time instead of materializing the whole dataset.
+    """
+    if hasattr(data, 'to_batches'):
+        for batch in data.to_batches(max_chunksize=chunk_size):
+            yield from batch.to_pylist()
+    else:
+        for start in range(0, len(data), chunk_size):
+            yield from data.iloc[start:start + chunk_size].to_dict("records")
+
+
+def vectors_have_nulls(vectors, chunk_size=10000):
+    """
+    Check a vector matrix for NaN values chunk by chunk, so a memory-mapped matrix is never fully loaded.
+    """
+    for start in range(0, vectors.shape[0], chunk_size):
+        if np.isnan(vectors[start:start + chunk_size]).any():
+            return True
+    return False
+
+
+def json_fragment(value, default='[]', validate=False):
+    """
+    Return a stringified JSON column value as a single-line JSON fragment.
+    Values written by the cleaning stage are already minified and are returned untouched;
+    other values are re-parsed when they span several lines, or always with validate
+    (legacy parquet files), and replaced by default when they are not valid JSON.
+    """
+    if not isinstance(value, str) or not value.strip():
+        return default
+    if validate or '\n' in value:
+        try:
+            return fast_json.dumps(fast_json.loads(value))
+        except ValueError:
+            return default
+    return value
+
+
+def record_temporal_range(x):
+    """
+    date_range value of a cleaned record: the range the cleaning stage built from the raw temporal
+    columns, or for records cleaned before it did, one rebuilt from temporalExtent. Ongoing ends
+    were already nulled there, so those records are indexed as if their end were unknown.
+    """
+    if TEMPORAL_RANGE_FIELD not in x:
+        return temporal_range(x.get('temporalExtent'))
+    stored = x.get(TEMPORAL_RANGE_FIELD)
+    if not isinstance(stored, dict) or not stored.get('gte'):
+        return None
+    return {bound: value for bound, value in stored.items() if value}
+
+
+def geometry_bbox(coordinates):
+    """(min_lon, min_lat, max_lon, max_lat) of GeoJSON coordinates at any nesting depth, None if there are no points."""
+    points = []
+    def walk(value):
+        if isinstance(value, list) and len(value) >= 2 and all(isinstance(v, (int, float)) for v in value[:2]):
+            points.append(value[:2])
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+    walk(coordinates)
+    if not points:
+        return None
+    coords = np.asarray(points, dtype=np.float64)
+    return float(coords[:, 0].min()), float(coords[:, 1].min()), float(coords[:, 0].max()), float(coords[:, 1].max())
+
+
+def simplify_ring(ring, tolerance):
+    """
+    Douglas-Peucker simplification of a closed polygon ring, keeping every point further than
+    tolerance (in degrees) from the simplified outline. When simplifying leaves fewer than the
+    4 points of a valid ring, the ring's bounding rectangle is returned instead.
+    """
+    points = np.asarray(ring, dtype=np.float64)[:, :2]
+    if len(points) <= 4:
+        return ring
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(segment[0], segment[1])
+        if length == 0:
+            # First and last points of a closed ring coincide: distance to that point
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            keep[start + 1 + farthest] = True
+            stack.extend([(start, start + 1 + farthest), (start + 1 + farthest, end)])
+    simplified = points[keep]
+    if len(simplified) >= 4:
+        return simplified.tolist()
+    (min_lon, min_lat), (max_lon, max_lat) = points.min(axis=0).tolist(), points.max(axis=0).tolist()
+    return [[min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat], [min_lon, min_lat]]
+
+
+def simplified_footprint(coordinates, tolerance):
+    """Polygon of the simplified rings of polygon coordinates, None if they are empty or malformed."""
+    try:
+        return {"type": "Polygon", "coordinates": [simplify_ring(ring, tolerance) for ring in coordinates]} if coordinates else None
+    except (ValueError, TypeError, IndexError):
+        return None
+
+
+def build_metadata_json(x, footprint_tolerance=None, validate_json=False):
+    """
+    Build the JSON body of an index document from a cleaned metadata record, without its vector.
+
+    The JSON columns (geometry, options, contact, graphicOverview, eoFilters) are spliced into
+    the body as raw fragments, so they are parsed once in the cleaning stage and never again here,
+    except for the geometry, read once more for its extent and, with footprint_tolerance, a
+    simplified footprint. validate_json re-parses every JSON column, for legacy records that did not
+    go through the cleaning stage.
+    """
+    coordinates_json = json_fragment(x.get('features_geometry_coordinates'), validate=validate_json)
+    coordinates = fast_json.loads(coordinates_json)
+    bbox = geometry_bbox(coordinates)
+    document = {
+        'id': x.get('features_properties_id', ''),
+        'title': x.get('features_properties_title_en', ''),
+        'description': x.get('features_properties_description_en', ''),
+        'published': x.get('features_properties_date_published_date', ''),
+        'keywords': x.get('features_properties_keywords_en', ''),
+        'topicCategory': x.get('features_properties_topicCategory', ''),
+        'created': x.get('features_properties_date_created_date', ''),
+        'spatialRepresentation': x.get('features_properties_spatialRepresentation', ''),
+        'type': x.get('features_properties_type', ''),
+        'temporalExtent': x.get('temporalExtent', ''),
+        TEMPORAL_RANGE_FIELD: record_temporal_range(x),
+        'language': x.get('features_properties_language', ''),
+        'organisation': x.get('organisation_en', ''),
+        'popularity': int(x.get('features_popularity', '0')),
+        'systemName': x.get('features_properties_sourceSystemName', ''),
+        'eoCollection': x.get('features_properties_eoCollection', ''),
+        EXTENT_FIELD: dict(zip(EXTENT_SIDES, bbox)) if bbox else None,
+    }
+    if footprint_tolerance:
+        document[FOOTPRINT_FIELD] = simplified_footprint(coordinates, footprint_tolerance)
+    fragments = {
+        'coordinates': '{"type":"Polygon","coordinates":' + coordinates_json + '}',
+        'options': json_fragment(x.get('features_properties_options'), validate=validate_json),
+        'contact': json_fragment(x.get('features_properties_contact'), validate=validate_json),
+        'graphicOverview': json_fragment(x.get('features_properties_graphicOverview'), validate=validate_json),
+        'eoFilters': json_fragment(x.get('features_properties_eoFilters'), validate=validate_json),
+    }
+    body = fast_json.dumps(document)
+    return body[:-1] + ''.join(f',"{key}":{value}' for key, value in fragments.items()) + '}'
+
+
+def add_vector(metadata_json, vector):
+    """Append the vector (a list or a numpy array) to a body built by build_metadata_json."""
+    vector = vector.tolist() if hasattr(vector, 'tolist') else vector
+    return f'{metadata_json[:-1]},"vector":{fast_json.dumps(vector)}}}'
+
+
+def build_document_json(x, vector, footprint_tolerance=None, validate_json=False):
+    """
+    Build the JSON body of an index document from a cleaned metadata record and its vector
+    (see build_metadata_json).
+    """
+    return add_vector(build_metadata_json(x, footprint_tolerance=footprint_tolerance, validate_json=validate_json), vector)
+
+
+def add_content_hash(metadata_json, embedding_version=''):
+    """
+    Append a content_hash field to a document body built by build_metadata_json.
+
+    The hash covers the metadata and embedding_version, not the vector: re-embedding unchanged
+    text gives slightly different floats from one run to the next, while a new embedding model
+    shows up as a new embedding_version.
+
+    Returns:
+    - (body, content_hash)
+    """
+    content_hash = hashlib.sha1(f"{embedding_version}\x1f{metadata_json}".encode('utf-8')).hexdigest()
+    return f'{metadata_json[:-1]},"content_hash":"{content_hash}"}}', content_hash
+
+
+def iter_documents(df_en, vectors=None, log_level="INFO", footprint_tolerance=None, embedding_version=''):
+    """
+    Yield (record_id, body, content_hash) for every record of df_en, hashed with embedding_version.
+    Records that cannot be turned into a document are reported and yielded with a None body,
+    so callers can skip them without treating the record as gone.
+    """
+    for x in iter_records(df_en):
+        record_id = x.get('features_properties_id') or None
+        try:
+            # Without a vector artifact the records come from a legacy parquet: vector column, unvalidated JSON columns
+            if vectors is not None:
+                vector = vectors[x['row_id']].astype(np.float32)
+            else:
+                vector = x.get("vector", "")
+
+            metadata_json = build_metadata_json(x, footprint_tolerance=footprint_tolerance, validate_json=vectors is None)
+            body, content_hash = add_content_hash(metadata_json, embedding_version)
+            body = add_vector(body, vector)
+
+            if log_level == "DEBUG":
+                print(body)
+
+        except Exception as e:
+            print(f"Error building document {record_id}: {e}")
+            body, content_hash = None, None
+        yield record_id, body, content_hash
+
+
+def index_action(index_name, record_id, body):
+    """
+    Bulk index action. The record id is used as _id so repeated loads overwrite instead of duplicating.
+    """
+    action = {"_op_type": "index", "_index": index_name, "_source": body}
+    if record_id:
+        action["_id"] = record_id
+    return action
+
+
+def run_bulk(aos_client, actions, chunk_size=500, max_chunk_bytes=50 * 1024 * 1024):
+    """
+    Send actions with the bulk API and return (succeeded, failed) counts.
+    """
+    succeeded, failed = 0, 0
+    for ok, item in tqdm(helpers.streaming_bulk(aos_client, actions, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes,
+                                                raise_on_error=False, raise_on_exception=False, request_timeout=120),
+                         desc="Bulk actions"):
+        if ok:
+            succeeded += 1
+        else:
+            failed += 1
+            print(f"Bulk action failed: {item}")
+    return succeeded, failed
+
+
+def load_data_to_opensearch_index(df_en, aos_client, index_name, log_level="INFO", vectors=None, footprint_tolerance=None, embedding_version=''):
     """
     Index data from a pandas DataFrame to an OpenSearch index.
 
     Parameters:
-    - df_en: DataFrame containing the data to index.
+    - df_en: DataFrame (or pyarrow Table) containing the data to index.
     - aos_client: OpenSearch client.
     - index_name: Name of the OpenSearch index to which the data will be indexed.
     - log_level: Logging level, defaults to "INFO". Set to "DEBUG" for detailed logs.
+    - vectors: Optional vector matrix from a vector artifact. When given, each record's
+      vector is read from the row pointed to by its row_id instead of a 'vector' column.
+    - footprint_tolerance: Optional Douglas-Peucker tolerance (degrees) of the simplified footprint
+      indexed next to the geometry; no footprint when not set.
+    - embedding_version: Model and projection the vectors come from, part of the content hashes.
     """
     start_time = time.time()
 
-    # Convert DataFrame to a list of dictionaries (JSON)
-    json_en = df_en.to_dict("records")
-    
     # check if vector has null values 
-    vectors = [item['vector'] for item in json_en]
-    import numpy as np 
-    array = np.array(vectors, dtype=object)
-    has_null = np.any(array == None)
+    if vectors is not None:
+        has_null = vectors_have_nulls(vectors)
+    else:
+        array = np.array(df_en['vector'].tolist(), dtype=object)
+        has_null = np.any(array == None)
     print(f"vector has null values: {has_null}")
 
     # Index the data
-    for x in tqdm(json_en, desc="Indexing Records"):
-        try:
-            bounding_box = json.loads(x.get('features_geometry_coordinates', '[]'))
-            coordinates = {
-                "type": "Polygon",
-                "coordinates": bounding_box
-            }
-
-            document = {
-                'id': x.get('features_properties_id', ''),
-                'coordinates': coordinates,
-                'title': x.get('features_properties_title_en', ''),
-                'description': x.get('features_properties_description_en', ''),
-                'published': x.get('features_properties_date_published_date', ''),
-                'keywords': x.get('features_properties_keywords_en', ''),
-                'options': json.loads(x.get('features_properties_options', '[]')),
-                'contact': json.loads(x.get('features_properties_contact', '[]')),
-                'topicCategory': x.get('features_properties_topicCategory', ''),
-                'created': x.get('features_properties_date_created_date', ''),
-                'spatialRepresentation': x.get('features_properties_spatialRepresentation', ''),
-                'type': x.get('features_properties_type', ''),
-                'temporalExtent': x.get('temporalExtent', ''),
-                'graphicOverview': json.loads(x.get('features_properties_graphicOverview', '[]')),
-                'language': x.get('features_properties_language', ''),
-                'organisation': x.get('organisation_en', ''),
-                'popularity': int(x.get('features_popularity', '0')),
-                'systemName': x.get('features_properties_sourceSystemName', ''),
-                'eoCollection': x.get('features_properties_eoCollection', ''),
-                'eoFilters': json.loads(x.get('features_properties_eoFilters', '[]')),
-                "vector":x.get("vector", "")
-            }
-
-            if log_level == "DEBUG":
-                print((json.dumps(document, indent=4)))
-
-            aos_client.index(index=index_name, body=document)
+    actions = (index_action(index_name, record_id, body) for record_id, body, _ in iter_documents(df_en, vectors, log_level, footprint_tolerance, embedding_version)
+               if body is not None)
+    succeeded, failed = run_bulk(aos_client, actions)
+    print(f"Indexed {succeeded} documents ({failed} failed) in {time.time() - start_time:.1f}s")
 
-        except Exception as e:
-            print(e)
     # Final record count check
     try:
-        res = client.search(index=index_name, body={"query": {"match_all": {}}})
-        print(f"Total documents in index: {res['hits']['total']['value']}")
+        aos_client.indices.refresh(index=index_name)
+        print(f"Total documents in index: {aos_client.count(index=index_name)['count']}")
     except Exception as e:
         print(f"Error retrieving document count: {e}")
+
+
+def fetch_index_hashes(aos_client, index_name):
+    """
+    Return {_id: content_hash} for every document of index_name.
+    Documents loaded before content hashes were stored map to None.
+    """
+    hashes = {}
+    for hit in helpers.scan(aos_client, index=index_name, query={"_source": ["content_hash"], "query": {"match_all": {}}}, size=5000):
+        hashes[hit['_id']] = hit.get('_source', {}).get('content_hash')
+    return hashes
+
+
+def sync_data_to_opensearch_index(df_en, aos_client, index_name, log_level="INFO", vectors=None, footprint_tolerance=None, embedding_version=''):
+    """
+    Incrementally bring index_name in line with df_en.
+
+    The content hash of every record is compared with the one stored in the index, keyed by
+    features_properties_id (the document _id). Only new or changed records are (re)indexed and
+    documents whose record disappeared are deleted, so a refresh costs the delta, not the corpus.
+    The hash covers the metadata and embedding_version, so a new model reindexes every record.
+
+    Returns:
+    - dict with the number of indexed, updated, unchanged and deleted records.
+    """
+    start_time = time.time()
+    existing = fetch_index_hashes(aos_client, index_name)
+    print(f"Index {index_name} holds {len(existing)} documents.")
+
+    stats = {"indexed": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+    seen = set()
+
+    def actions():
+        for record_id, body, content_hash in iter_documents(df_en, vectors, log_level, footprint_tolerance, embedding_version):
+            if not record_id:
+                print("Skipping record without features_properties_id.")
+                continue
+            seen.add(record_id)
+            if body is None:
+                continue
+            if record_id not in existing:
+                stats["indexed"] += 1
+            elif existing[record_id] != content_hash:
+                stats["updated"] += 1
+            else:
+                stats["unchanged"] += 1
+                continue
+            yield index_action(index_name, record_id, body)
+
+        for record_id in existing.keys() - seen:
+            stats["deleted"] += 1
+            yield {"_op_type": "delete", "_index": index_name, "_id": record_id}
+
+    succeeded, failed = run_bulk(aos_client, actions())
+    aos_client.indices.refresh(index=index_name)
+    print(f"Synced {index_name} in {time.time() - start_time:.1f}s: {stats} ({succeeded} bulk actions succeeded, {failed} failed)")
+    return stats
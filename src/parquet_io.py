@@ -0,0 +1,89 @@
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+
+def resolve_filesystem(uri, region=None, filesystem=None):
+    """
+    Resolve a parquet location into a (filesystem, path) pair.
+
+    Parameters:
+    - uri: 's3://bucket/key' or a local path.
+    - region: AWS region used when an S3 filesystem is created.
+    - filesystem: Optional pyarrow FileSystem to use instead (e.g. a LocalFileSystem,
+      SubTreeFileSystem or fsspec-backed stand-in for S3 in tests). uri is then a path on it.
+
+    Returns:
+    - (filesystem, path)
+    """
+    if filesystem is not None:
+        return filesystem, uri
+    parsed = urlparse(uri)
+    if parsed.scheme == 's3':
+        return pafs.S3FileSystem(region=region), f"{parsed.netloc}/{parsed.path.lstrip('/')}"
+    return pafs.LocalFileSystem(), uri
+
+
+def count_parquet_rows(uri, region=None, filesystem=None):
+    """
+    Return the number of rows of a parquet file from its footer, without reading any data.
+    """
+    fs, path = resolve_filesystem(uri, region=region, filesystem=filesystem)
+    with fs.open_input_file(path) as f:
+        return pq.ParquetFile(f).metadata.num_rows
+
+
+def read_parquet_schema(uri, columns=None, region=None, filesystem=None):
+    """
+    Return the arrow schema of a parquet file (restricted to columns) from its footer,
+    for files whose batches cannot provide it because they have no rows.
+    """
+    fs, path = resolve_filesystem(uri, region=region, filesystem=filesystem)
+    with fs.open_input_file(path) as f:
+        schema = pq.ParquetFile(f).schema_arrow
+    return pa.schema([schema.field(name) for name in columns]) if columns is not None else schema
+
+
+def iter_parquet_batches(uri, batch_size=10000, columns=None, region=None, filesystem=None):
+    """
+    Stream a parquet file as pyarrow RecordBatches.
+
+    Only the row groups needed for the current batch are fetched (ranged GETs on S3),
+    so memory stays bounded by batch_size rather than by the file size.
+
+    Parameters:
+    - uri: 's3://bucket/key' or a local path.
+    - batch_size: Maximum number of rows per batch.
+    - columns: Optional list of columns to read.
+    - region: AWS region of the bucket.
+    - filesystem: Optional pyarrow FileSystem overriding the one derived from uri.
+    """
+    fs, path = resolve_filesystem(uri, region=region, filesystem=filesystem)
+    with fs.open_input_file(path) as f:
+        parquet_file = pq.ParquetFile(f)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            yield batch
+
+
+@contextmanager
+def parquet_writer(uri, schema, region=None, filesystem=None):
+    """
+    Open a pyarrow ParquetWriter that streams to uri.
+
+    On S3 the output stream buffers one part in memory and sends it as a multipart
+    upload part, so no temporary local file is needed and memory stays bounded.
+
+    Usage:
+        with parquet_writer('s3://bucket/key.parquet', schema, region) as writer:
+            writer.write_table(table)
+    """
+    fs, path = resolve_filesystem(uri, region=region, filesystem=filesystem)
+    with fs.open_output_stream(path) as sink:
+        writer = pq.ParquetWriter(sink, schema)
+        try:
+            yield writer
+        finally:
+            writer.close()
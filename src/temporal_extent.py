@@ -0,0 +1,51 @@
+import re
+import calendar
+from datetime import datetime
+
+# date_range field holding each record's temporal extent (mapped in Create_Opensearch_index.py)
+TEMPORAL_RANGE_FIELD = 'temporalRange'
+PARTIAL_DATE_PATTERN = re.compile(r'^\s*(\d{4})(?:-(\d{2}))?(?:-(\d{2}))?')
+# Temporal extent end of ongoing records; any other end that is not a date ('Not Available; Indisponible') is unknown
+ONGOING_TEMPORAL_END = 'Present'
+
+
+def temporal_bound(value, upper=False):
+    """
+    YYYY-MM-DD date of a temporal extent bound, None if it is missing or not a date ('Present',
+    'Not Available; Indisponible'). Partial dates (YYYY, YYYY-MM) are widened to the first day of
+    their year or month, or with upper to the last one.
+    """
+    match = PARTIAL_DATE_PATTERN.match(value) if isinstance(value, str) else None
+    if match is None:
+        return None
+    year, month, day = match.groups()
+    year = int(year)
+    month = int(month) if month else (12 if upper else 1)
+    if day:
+        day = int(day)
+    else:
+        day = calendar.monthrange(year, month)[1] if upper and 1 <= month <= 12 else 1
+    try:
+        return datetime(year, month, day).strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def temporal_range(temporal_extent):
+    """
+    date_range value of a record's raw temporal extent {begin, end}, before the cleaning stage
+    nulls its placeholders.
+
+    An ongoing extent (end 'Present') is left open-ended. An extent whose begin is not a date or
+    whose end is unknown ('Not Available; Indisponible', missing) cannot be placed in time, so
+    like one with inverted bounds it returns None and the record has no temporal range; the search
+    filters those records on their temporalExtent begin and end instead.
+    """
+    extent = temporal_extent if isinstance(temporal_extent, dict) else {}
+    begin = temporal_bound(extent.get('begin'))
+    raw_end = extent.get('end')
+    ongoing = isinstance(raw_end, str) and raw_end.strip() == ONGOING_TEMPORAL_END
+    end = None if ongoing else temporal_bound(raw_end, upper=True)
+    if begin is None or (end is None and not ongoing) or (end and begin > end):
+        return None
+    return {'gte': begin} if ongoing else {'gte': begin, 'lte': end}
@@ -0,0 +1,138 @@
+import os
+import boto3
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# A vector artifact is two files sharing a prefix:
+#   <prefix>.vectors.npy       contiguous (n_rows x dimension) float32/float16 matrix, memory-mappable
+#   <prefix>.metadata.parquet  record metadata, row_id points at the matching row of the matrix
+VECTORS_SUFFIX = '.vectors.npy'
+METADATA_SUFFIX = '.metadata.parquet'
+ROW_ID_COLUMN = 'row_id'
+SUPPORTED_DTYPES = ('float32', 'float16')
+
+
+def vector_store_paths(prefix):
+    """
+    Return the (vectors_path, metadata_path) pair for an artifact prefix.
+    """
+    return f"{prefix}{VECTORS_SUFFIX}", f"{prefix}{METADATA_SUFFIX}"
+
+
+def create_vector_file(path, n_rows, dimension, dtype='float32'):
+    """
+    Allocate an on-disk .npy matrix and return it as a writable memmap.
+
+    Rows are written straight to the page cache, so the full matrix never has to
+    be held in memory while embedding.
+
+    Parameters:
+    - path: Local path of the .npy file to create.
+    - n_rows: Number of vectors (records) in the artifact.
+    - dimension: Embedding dimension.
+    - dtype: 'float32' (default) or 'float16'.
+
+    Returns:
+    - vectors: numpy memmap of shape (n_rows, dimension).
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported vector dtype '{dtype}'. Must be one of {SUPPORTED_DTYPES}.")
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(n_rows, dimension))
+
+
+def add_row_ids(metadata, start_row=0):
+    """
+    Return metadata as a pyarrow Table with a row_id column numbered from start_row.
+
+    Parameters:
+    - metadata: pandas DataFrame or pyarrow Table, one row per vector, in matrix order.
+    - start_row: row_id assigned to the first record (the batch offset when streaming).
+    """
+    table = metadata if isinstance(metadata, pa.Table) else pa.Table.from_pandas(metadata, preserve_index=False)
+    if ROW_ID_COLUMN in table.column_names:
+        table = table.drop([ROW_ID_COLUMN])
+    row_ids = pa.array(np.arange(start_row, start_row + table.num_rows, dtype=np.int64))
+    return table.append_column(ROW_ID_COLUMN, row_ids)
+
+
+def write_metadata_file(path, metadata, start_row=0):
+    """
+    Write record metadata to a parquet file with a row_id column into the vector matrix.
+
+    Parameters:
+    - path: Local path of the parquet file to create.
+    - metadata: pandas DataFrame or pyarrow Table, one row per vector, in matrix order.
+    - start_row: row_id assigned to the first record.
+    """
+    pq.write_table(add_row_ids(metadata, start_row=start_row), path)
+
+
+def write_vector_store(prefix, metadata, vectors, dtype='float32'):
+    """
+    Write a complete artifact from in-memory metadata and vectors.
+
+    Parameters:
+    - prefix: Local path prefix of the artifact.
+    - metadata: pandas DataFrame or pyarrow Table, one row per vector.
+    - vectors: 2-D array-like of embeddings, in the same order as metadata.
+    - dtype: 'float32' (default) or 'float16'.
+    """
+    vectors_path, metadata_path = vector_store_paths(prefix)
+    vectors = np.asarray(vectors)
+    matrix = create_vector_file(vectors_path, vectors.shape[0], vectors.shape[1], dtype=dtype)
+    matrix[:] = vectors
+    matrix.flush()
+    del matrix
+    write_metadata_file(metadata_path, metadata)
+
+
+def load_vector_store(prefix, mmap=True):
+    """
+    Load an artifact written by write_vector_store.
+
+    With mmap=True neither file is read into memory up front: the vectors come back as a
+    read-only numpy memmap and the metadata as a memory-mapped pyarrow Table.
+
+    Parameters:
+    - prefix: Local path prefix of the artifact.
+    - mmap: Memory-map the files instead of reading them (default True).
+
+    Returns:
+    - (metadata, vectors): pyarrow Table and numpy array (memmap when mmap=True).
+    """
+    vectors_path, metadata_path = vector_store_paths(prefix)
+    vectors = np.load(vectors_path, mmap_mode='r' if mmap else None)
+    metadata = pq.read_table(metadata_path, memory_map=mmap)
+    if metadata.num_rows != vectors.shape[0]:
+        raise ValueError(f"Artifact {prefix} is inconsistent: {metadata.num_rows} metadata rows "
+                         f"for {vectors.shape[0]} vectors.")
+    return metadata, vectors
+
+
+def upload_vector_store(prefix, bucket_name, key_prefix):
+    """
+    Upload both files of a local artifact to S3 under key_prefix.
+    upload_file switches to multipart uploads for large files, so nothing is buffered in memory.
+    """
+    s3_client = boto3.client('s3')
+    for local_path in vector_store_paths(prefix):
+        suffix = local_path[len(prefix):]
+        s3_client.upload_file(local_path, bucket_name, f"{key_prefix}{suffix}")
+        print(f'Uploading {key_prefix}{suffix} to {bucket_name}')
+
+
+def download_vector_store(region, bucket_name, key_prefix, local_dir='/tmp'):
+    """
+    Download an artifact from S3 to local_dir so it can be memory-mapped.
+
+    Returns:
+    - prefix: Local path prefix to pass to load_vector_store.
+    """
+    session = boto3.Session(region_name=region)
+    s3_client = session.client('s3')
+    prefix = os.path.join(local_dir, os.path.basename(key_prefix))
+    for local_path in vector_store_paths(prefix):
+        suffix = local_path[len(prefix):]
+        s3_client.download_file(bucket_name, f"{key_prefix}{suffix}", local_path)
+    return prefix